@@ -1,9 +1,10 @@
 from django.contrib import admin
-from .models import User, Note, JournalEntry, PartnerRequest, UserProfile
+from .models import User, Note, JournalEntry, PartnerRequest, UserProfile, NotificationOutbox, Tombstone
 
 admin.site.register(User)
 admin.site.register(Note)
 admin.site.register(JournalEntry)
 admin.site.register(PartnerRequest)
 admin.site.register(UserProfile)
-
+admin.site.register(NotificationOutbox)
+admin.site.register(Tombstone)
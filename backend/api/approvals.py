@@ -0,0 +1,100 @@
+"""
+Edit and deletion approval for notes and journal entries
+
+Both models carry the same approval fields, and the same rules apply:
+- the author edits directly; that also drops any pending edit request
+- the partner's edit is held as pending_title/pending_content until the
+  author applies it (by editing with those values)
+- the first DELETE, by either of the couple, only requests deletion; a
+  DELETE from the other one deletes
+
+Each transition is one transaction that re-reads the approval state under
+a row lock (SELECT ... FOR UPDATE on PostgreSQL; on SQLite the BEGIN
+IMMEDIATE of api/sqlite_backend already holds the write lock) and writes
+the row once with update_fields. Two partners acting at once are thereby
+applied one after the other instead of one overwriting the other's
+request. The whole transaction is retried on SQLite lock errors (see
+api/write_retry.py). Saves still send post_save, so the list cache,
+search index, events and sync see them as before.
+
+The views (NoteDetailView, JournalEntryDetailView) check access and send
+notifications; the functions here return an outcome for them to act on.
+"""
+from django.db import router, transaction
+from .write_retry import retry_on_lock
+
+# Outcomes
+REQUESTED = 'requested'
+ALREADY_REQUESTED = 'already_requested'
+CONFLICT = 'conflict'
+DELETED = 'deleted'
+
+# The approval state re-read under the lock
+STATE_FIELDS = ('edit_requested_by', 'edit_approved_by', 'deletion_requested_by', 'deletion_approved_by')
+# Cleared by the author's edit
+PENDING_EDIT_FIELDS = ('edit_requested_by', 'edit_approved_by', 'pending_title', 'pending_content')
+
+
+def _lock(instance):
+    """Refresh instance's approval state from its row, locked until the transaction ends"""
+    state = type(instance).objects.select_for_update().values('is_shared', *STATE_FIELDS).get(pk=instance.pk)
+    # The stored sharing flag, for the save's change event (api/events.py)
+    instance._was_shared = state.pop('is_shared')
+    for field, value in state.items():
+        # Setting the id drops a cached related user only if it changed
+        setattr(instance, f'{field}_id', value)
+
+
+def _transition(instance, func, *args):
+    def run():
+        with transaction.atomic():
+            _lock(instance)
+            return func(instance, *args)
+    return retry_on_lock(router.db_for_write(type(instance), instance=instance), run)
+
+
+def _edit(instance, changes):
+    for field, value in changes.items():
+        setattr(instance, field, value)
+    for field in PENDING_EDIT_FIELDS:
+        setattr(instance, field, None)
+    instance.save(update_fields={*changes, *PENDING_EDIT_FIELDS, 'updated_at'})
+
+
+def edit(instance, changes):
+    """The author's edit: apply changes (validated field values) and drop any pending edit request"""
+    _transition(instance, _edit, changes)
+
+
+def _request_edit(instance, user, title, content):
+    if instance.edit_requested_by_id == user.pk:
+        return ALREADY_REQUESTED
+    if instance.edit_requested_by_id:
+        return CONFLICT
+    instance.edit_requested_by = user
+    instance.pending_title = title
+    instance.pending_content = content
+    instance.save(update_fields=['edit_requested_by', 'pending_title', 'pending_content', 'updated_at'])
+    return REQUESTED
+
+
+def request_edit(instance, user, title, content):
+    """The partner's edit, held for the author: REQUESTED, ALREADY_REQUESTED or CONFLICT"""
+    return _transition(instance, _request_edit, user, title, content)
+
+
+def _request_deletion(instance, user):
+    if not instance.deletion_requested_by_id:
+        instance.deletion_requested_by = user
+        instance.save(update_fields=['deletion_requested_by', 'updated_at'])
+        return REQUESTED
+    if instance.deletion_requested_by_id == user.pk:
+        return ALREADY_REQUESTED
+    # The other one of the couple asked first: both agree
+    instance.delete()
+    return DELETED
+
+
+def request_deletion(instance, user):
+    """A DELETE by user: REQUESTED, ALREADY_REQUESTED or DELETED"""
+    return _transition(instance, _request_deletion, user)
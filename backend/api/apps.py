@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class ApiConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'api'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import search  # noqa: F401
+        from . import sync  # noqa: F401
+        from . import events  # noqa: F401
+        from . import notification_routing  # noqa: F401
+        from . import couple  # noqa: F401
+        from . import long_poll  # noqa: F401
+        from . import likes  # noqa: F401
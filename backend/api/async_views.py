@@ -0,0 +1,239 @@
+"""
+Async views, served by the ASGI entry point (notetaker/asgi.py)
+
+With ASYNC_READ_VIEWS on (asgi.py turns it on), GET on the hot read
+endpoints - notes list, journal list, journal by date and auth/me - and
+on the /api/changes/ long-poll is handled here. The request waits on the
+event loop, and only the database work is handed to a thread. The other methods on those URLs fall through
+to the DRF views. Responses are the same as the DRF views': same ETags and
+304s, list cache, cursor pagination and JSON payloads.
+
+The event stream also lives here, since it only works as an async view.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from .authentication import CoupleJWTAuthentication
+from .etags import notes_etag, journal_etag, users_etag
+from .serializers import UserSerializer, JournalEntrySerializer, JournalEntrySummarySerializer, wants_summary
+from . import events
+from . import long_poll
+from . import views
+import asyncio
+
+
+def jwt_user(request, allow_query_token=False):
+    """
+    User authenticated by the JWT in the Authorization header (or, for
+    EventSource, which can't set headers, ?access_token=); None if missing
+    or invalid
+    """
+    authentication = CoupleJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if not raw_token and allow_query_token:
+        raw_token = request.GET.get('access_token')
+    if not raw_token:
+        return None
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def _json_response(data, status_code=200, headers=None):
+    return HttpResponse(
+        JSONRenderer().render(data), status=status_code,
+        content_type='application/json', headers=headers,
+    )
+
+
+def _unauthorized():
+    return _json_response(
+        {'detail': 'Authentication credentials were not provided.'},
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        headers={'WWW-Authenticate': 'Bearer realm="api"'},
+    )
+
+
+async def _authenticate(request):
+    user = await sync_to_async(jwt_user)(request)
+    if user is not None:
+        # etag functions and the list cache read request.user
+        request.user = user
+    return user
+
+
+async def _conditional(request, etag_func, build_response):
+    """Async equivalent of django.views.decorators.http.condition(etag_func=...)"""
+    etag = await sync_to_async(etag_func)(request)
+    etag = quote_etag(etag) if etag else None
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = await build_response()
+        if etag and request.method in ('GET', 'HEAD'):
+            response.headers.setdefault('ETag', etag)
+    return response
+
+
+def _run_list_view(view_class, request, user):
+    """
+    Run view_class's GET (cache, search, pagination, serializer) for request
+
+    Goes through the same steps as APIView.dispatch() - permissions,
+    throttles, content negotiation and exception handling - except that
+    the user authenticated on the event loop is reused.
+    """
+    view = view_class()
+    view.args, view.kwargs = (), {}
+    drf_request = view.initialize_request(request)
+    drf_request.user = user
+    view.request = drf_request
+    view.headers = view.default_response_headers
+    try:
+        view.initial(drf_request)
+        response = view.list(drf_request)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    response = view.finalize_response(drf_request, response)
+    return response.render()
+
+
+def _hybrid(async_get, drf_view):
+    """View answering GET with async_get and any other method with the DRF view"""
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await async_get(request, *args, **kwargs)
+        return await sync_to_async(drf_view)(request, *args, **kwargs)
+    # DRF views handle CSRF themselves (JWT requests are exempt)
+    view.csrf_exempt = True
+    return view
+
+
+async def note_list(request):
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    return await _conditional(request, notes_etag, sync_to_async(
+        lambda: _run_list_view(views.NoteListCreateView, request, user)
+    ))
+
+
+async def journal_list(request):
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    return await _conditional(request, journal_etag, sync_to_async(
+        lambda: _run_list_view(views.JournalEntryListCreateView, request, user)
+    ))
+
+
+async def journal_entries_by_date(request):
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    date = request.GET.get('date')
+    if not date:
+        return _json_response({'error': 'Date parameter is required'}, status.HTTP_400_BAD_REQUEST)
+    try:
+        day = views.parse_day(date)
+    except ValueError:
+        return _json_response({'error': 'Date must be YYYY-MM-DD'}, status.HTTP_400_BAD_REQUEST)
+
+    async def build_response():
+        # select_related covers every user the serializer touches, so
+        # serializing needs no further queries and can stay on the loop
+        entries = views.trim_for_representation(
+            views.get_visible_journal_entries(user).filter(date=day), request, views.JOURNAL_USER_RELATIONS
+        )
+        entries = [entry async for entry in entries]
+        serializer_class = JournalEntrySummarySerializer if wants_summary(request) else JournalEntrySerializer
+        return _json_response(serializer_class(entries, many=True, context={'request': request}).data)
+    return await _conditional(request, journal_etag, build_response)
+
+
+async def current_user(request):
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    async def build_response():
+        # The partner was loaded with the user (api/couple.py)
+        return _json_response(UserSerializer(user, context={'request': request}).data)
+    return await _conditional(request, users_etag, build_response)
+
+
+async def wait_for_changes(request):
+    """Long-poll on the event loop, see views.wait_for_changes()"""
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    try:
+        since = long_poll.parse_since(request.GET)
+    except ValueError:
+        return _json_response({'error': 'Versions must be integers'}, status.HTTP_400_BAD_REQUEST)
+    result = await long_poll.async_wait_for_changes(user, since, long_poll.get_timeout(request.GET))
+    return _json_response(result, headers={'Cache-Control': 'no-store'})
+
+
+note_list_create_view = _hybrid(note_list, views.NoteListCreateView.as_view())
+journal_list_create_view = _hybrid(journal_list, views.JournalEntryListCreateView.as_view())
+journal_by_date_view = _hybrid(journal_entries_by_date, views.journal_entries_by_date)
+current_user_view = _hybrid(current_user, views.current_user)
+wait_for_changes_view = _hybrid(wait_for_changes, views.wait_for_changes)
+
+
+async def event_stream(request):
+    """
+    Server-Sent Events stream of the couple's changes (see api/events.py)
+
+    Needs the ASGI entry point; under WSGI it answers 501 straight away
+    rather than holding a worker for the life of a stream that would never
+    be flushed (EventSource doesn't retry after an error status). The
+    stream ends after EVENT_STREAM_MAX_AGE seconds and EventSource
+    reconnects with Last-Event-ID, which replays anything published in
+    between.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'Event stream requires the ASGI server'}, status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    user = await sync_to_async(jwt_user)(request, allow_query_token=True)
+    if user is None:
+        return JsonResponse({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    subscription = events.get_broker().subscribe(events.user_channel(user.pk), last_event_id)
+    keepalive = getattr(settings, 'EVENT_STREAM_KEEPALIVE', 15)
+    max_age = getattr(settings, 'EVENT_STREAM_MAX_AGE', 300)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_age
+        try:
+            yield f'retry: {keepalive * 1000}\n\n'
+            while loop.time() < deadline:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    break
+                yield events.format_event(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
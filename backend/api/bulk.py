@@ -0,0 +1,248 @@
+"""
+Bulk export and import of a couple's notes, journal entries and likes
+
+The format is NDJSON, one JSON object per line with a "type": an "export"
+header, then "note", "journal_entry" and "like" records. Export streams the
+lines from .iterator() queries, so the full set is never held in memory.
+
+Import reads the same format a line at a time. Note and journal entry
+records are validated with NoteSerializer / JournalEntrySerializer while
+the upload is read, outside any transaction, so a slow client doesn't hold
+the database's write lock (the whole database on SQLite). Once every line
+is in and valid, the rows are inserted with bulk_create in batches, in one
+short transaction: if any record is invalid, nothing is imported. Records
+authored by someone else (the partner's shared notes in the importer's own
+export) and likes are skipped. Imported items keep their created_at;
+updated_at is the time of the import, so delta sync (api/sync.py) picks
+them up.
+
+bulk_create doesn't send post_save, so import_records() does the receivers'
+work once for the whole import: search indexing, list cache invalidation,
+one event, and one notification to the partner instead of one per note.
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from .models import Note, JournalEntry, NoteLike
+from .serializers import NoteSerializer, JournalEntrySerializer
+from .notification_utils import send_notification_to_partner
+from .list_cache import NOTES, JOURNAL
+from . import events
+from . import list_cache
+from . import search
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/x-ndjson'
+EXPORT_VERSION = 1
+MAX_REPORTED_ERRORS = 20
+
+NOTE_EXPORT_FIELDS = ('id', 'title', 'content', 'is_shared', 'created_at', 'updated_at')
+JOURNAL_EXPORT_FIELDS = ('id', 'title', 'content', 'date', 'mood', 'is_shared', 'created_at', 'updated_at')
+
+# Record type -> (model, serializer, fields taken from the record). Ids,
+# authors and pending edit/deletion requests are never imported.
+IMPORT_TYPES = {
+    'note': (Note, NoteSerializer, ('title', 'content', 'is_shared')),
+    'journal_entry': (JournalEntry, JournalEntrySerializer, ('title', 'content', 'date', 'mood', 'is_shared')),
+}
+
+
+class InvalidImport(Exception):
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+
+def _line(record):
+    return json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _records(queryset, record_type, fields, chunk_size, renames):
+    for row in queryset.values(*fields, *renames).iterator(chunk_size=chunk_size):
+        for lookup, name in renames.items():
+            row[name] = row.pop(lookup)
+        yield _line({'type': record_type, **row})
+
+
+def export_lines(user, notes, entries):
+    """
+    NDJSON lines for notes and entries (querysets of what user can see) and
+    the likes on those notes, oldest first
+    """
+    chunk_size = getattr(settings, 'BULK_EXPORT_CHUNK_SIZE', 500)
+    yield _line({
+        'type': 'export',
+        'version': EXPORT_VERSION,
+        'exported_at': timezone.now(),
+        'user': user.username,
+        'partner': user.partner.username if user.partner_id else None,
+    })
+    yield from _records(
+        notes.order_by('created_at', 'id'), 'note', NOTE_EXPORT_FIELDS, chunk_size,
+        {'author__username': 'author'},
+    )
+    yield from _records(
+        entries.order_by('date', 'id'), 'journal_entry', JOURNAL_EXPORT_FIELDS, chunk_size,
+        {'author__username': 'author'},
+    )
+    likes = NoteLike.objects.filter(note__in=notes.values('pk')).order_by('created_at', 'id')
+    yield from _records(
+        likes, 'like', ('id', 'created_at'), chunk_size,
+        {'note_id': 'note', 'user__username': 'user'},
+    )
+
+
+def _read(lines):
+    """(line number, record) for each non-blank line"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, e
+            continue
+        yield number, record
+
+
+class _Batch:
+    """Validated rows of one model waiting for bulk_create"""
+
+    def __init__(self, model):
+        self.model = model
+        self.objects = []
+        self.created_at = []  # original created_at of each object, or None
+
+    def add(self, obj, created_at):
+        self.objects.append(obj)
+        self.created_at.append(created_at)
+
+    @property
+    def created(self):
+        return len(self.objects)
+
+    @property
+    def shared(self):
+        return sum(1 for obj in self.objects if obj.is_shared)
+
+    def save(self, batch_size):
+        if not self.objects:
+            return
+        self.model.objects.bulk_create(self.objects, batch_size=batch_size)
+        # bulk_create sets auto_now_add fields itself, so restore the originals afterwards
+        backdated = []
+        for obj, created_at in zip(self.objects, self.created_at):
+            if created_at is not None:
+                obj.created_at = created_at
+                backdated.append(obj)
+        if backdated:
+            self.model.objects.bulk_update(backdated, ['created_at'], batch_size=batch_size)
+        search.index_instances(self.objects)
+
+
+def _validate(user, lines, batches):
+    """
+    Validate lines into batches; returns the number of records skipped.
+    Raises InvalidImport, with the first invalid lines, if any are invalid.
+    """
+    max_records = getattr(settings, 'BULK_IMPORT_MAX_RECORDS', 20000)
+    parse_datetime = serializers.DateTimeField().to_internal_value
+    journal_dates = set(JournalEntry.objects.filter(author=user).values_list('date', flat=True))
+    errors = []
+    skipped = 0
+    count = 0
+
+    for number, record in _read(lines):
+        count += 1
+        if count > max_records:
+            raise InvalidImport(f'Imports are limited to {max_records} records')
+        if isinstance(record, Exception) or not isinstance(record, dict):
+            errors.append({'line': number, 'errors': 'Not a JSON object'})
+        elif record.get('type') not in IMPORT_TYPES or record.get('author', user.username) != user.username:
+            skipped += 1
+            continue
+        else:
+            model, serializer_class, fields = IMPORT_TYPES[record['type']]
+            serializer = serializer_class(data={field: record[field] for field in fields if field in record})
+            created_at = None
+            if not serializer.is_valid():
+                errors.append({'line': number, 'errors': serializer.errors})
+            else:
+                if record.get('created_at'):
+                    try:
+                        created_at = parse_datetime(record['created_at'])
+                    except serializers.ValidationError as e:
+                        errors.append({'line': number, 'errors': {'created_at': e.detail}})
+                if model is JournalEntry:
+                    # Same default as JournalEntry.date
+                    date = serializer.validated_data.setdefault('date', timezone.now().date())
+                    if date in journal_dates:
+                        errors.append({'line': number, 'errors': {'date': [f'There is already a journal entry for {date}']}})
+                    journal_dates.add(date)
+
+        if errors:
+            # Nothing will be saved; keep validating to report more problems
+            if len(errors) >= MAX_REPORTED_ERRORS:
+                break
+            continue
+        batches[model].add(model(author=user, **serializer.validated_data), created_at)
+
+    if errors:
+        raise InvalidImport('Invalid records, nothing was imported', errors)
+    return skipped
+
+
+def import_records(user, lines):
+    """
+    Import NDJSON lines (bytes or str) as user's notes and journal entries
+
+    Returns counts of notes and journal entries created and records skipped.
+    Raises InvalidImport, with the first invalid lines, if anything was
+    wrong; nothing is imported in that case. IntegrityError means a journal
+    entry for one of the dates was created during the import.
+    """
+    batch_size = getattr(settings, 'BULK_IMPORT_BATCH_SIZE', 500)
+    batches = {Note: _Batch(Note), JournalEntry: _Batch(JournalEntry)}
+    skipped = _validate(user, lines, batches)
+
+    notes, entries = batches[Note], batches[JournalEntry]
+    if notes.created or entries.created:
+        with transaction.atomic():
+            for batch in batches.values():
+                batch.save(batch_size)
+            _after_import(user, notes, entries)
+
+    logger.info(f'Imported {notes.created} notes and {entries.created} journal entries for {user.username}')
+    return {'notes': notes.created, 'journal_entries': entries.created, 'skipped': skipped}
+
+
+def _after_import(user, notes, entries):
+    """What the post_save receivers would have done, once for the whole import"""
+    kinds = [kind for kind, batch in ((NOTES, notes), (JOURNAL, entries)) if batch.created]
+    list_cache.invalidate_user(user, kinds)
+    shared = notes.shared + entries.shared
+    events.publish_to_couple(user, {
+        'type': 'import.completed',
+        'author_id': user.pk,
+        'notes': notes.created,
+        'journal_entries': entries.created,
+    }, shared=bool(shared))
+
+    if shared and user.partner_id:
+        parts = []
+        if notes.shared:
+            parts.append(f'{notes.shared} note{"s" if notes.shared != 1 else ""}')
+        if entries.shared:
+            parts.append(f'{entries.shared} journal entr{"ies" if entries.shared != 1 else "y"}')
+        send_notification_to_partner(
+            user,
+            'note_created' if notes.shared else 'journal_created',
+            f'💕 {user.username} imported their notes',
+            ' and '.join(parts),
+        )
@@ -0,0 +1,107 @@
+"""
+Request-scoped couple context: the authenticated user and their partner
+
+CoupleJWTAuthentication (api/authentication.py) loads the user with their
+partner and profile in one query (see load_user()) and attaches a Couple
+as `request.user.couple`. Views use it for "is this the user's or their
+partner's?" decisions and pass it to serializers, so neither the partner
+nor either profile is fetched again during the request.
+
+With COUPLE_CACHE_TIMEOUT > 0 the loaded user is also cached across
+requests in the COUPLE_CACHE cache. Saving a user (which
+connect_partner/disconnect_partner, profile edits and password changes
+all do) or their profile drops both partners' cached entries.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import User, UserProfile
+
+
+class Couple:
+    """The authenticated user and their partner (None if they have none)"""
+
+    def __init__(self, user):
+        self.user = user
+        self.partner = user.partner if user.partner_id else None
+
+    @property
+    def user_ids(self):
+        return [self.user.pk, self.partner.pk] if self.partner else [self.user.pk]
+
+    def includes(self, user_id):
+        """Whether user_id is the user or their partner"""
+        return user_id in self.user_ids
+
+    def is_partner(self, user_id):
+        return self.partner is not None and user_id == self.partner.pk
+
+    def partner_of(self, user_id):
+        """The other member of the couple for one of its members (None if unknown)"""
+        if user_id == self.user.pk:
+            return self.partner
+        if self.is_partner(user_id):
+            return self.user if self.partner.partner_id == self.user.pk else self.partner.partner
+        return None
+
+    def visible(self, field='author'):
+        """Q for rows the user may see: their own plus the partner's shared ones"""
+        q = Q(**{f'{field}_id': self.user.pk})
+        if self.partner:
+            q |= Q(**{f'{field}_id': self.partner.pk, 'is_shared': True})
+        return q
+
+
+def couple_for(user):
+    """user's Couple, built from the loaded partner if authentication didn't attach one"""
+    couple = getattr(user, 'couple', None)
+    if couple is None:
+        couple = user.couple = Couple(user)
+    return couple
+
+
+def get_cache():
+    return caches[getattr(settings, 'COUPLE_CACHE', 'default')]
+
+
+def _key(user_id):
+    return f'couple_user:{user_id}'
+
+
+def load_user(user_id):
+    """
+    User user_id with partner and profile joined (one query) and the Couple
+    attached; raises User.DoesNotExist
+    """
+    timeout = getattr(settings, 'COUPLE_CACHE_TIMEOUT', 0)
+    user = get_cache().get(_key(user_id)) if timeout else None
+    if user is None:
+        user = User.objects.select_related('partner', 'profile').get(pk=user_id)
+        if user.partner_id and user.partner.partner_id == user.pk:
+            # The partner's partner is this user; saves a query when serializing the partner
+            user.partner.partner = user
+        if timeout:
+            get_cache().set(_key(user_id), user, timeout)
+    user.couple = Couple(user)
+    return user
+
+
+def invalidate(*user_ids):
+    if not getattr(settings, 'COUPLE_CACHE_TIMEOUT', 0):
+        return
+    keys = [_key(user_id) for user_id in user_ids if user_id]
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # The partner's cached copy embeds this user too
+    invalidate(instance.pk, instance.partner_id)
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_cached_profile_owner(sender, instance, **kwargs):
+    invalidate(instance.user_id)
@@ -0,0 +1,116 @@
+"""
+ETags for conditional GETs on the read endpoints
+
+Each etag function is meant for django.views.decorators.http.condition()
+and is computed without serializing anything. It hashes a state digest of
+the rows behind the response: the couple's version number from
+api/list_cache.py (bumped on every write) together with a cheap aggregate
+query (row count plus latest timestamp), so writes that skip the signals
+(queryset .update(), another process with its own cache) still change it.
+The request URL and Accept header are part of the hash, so every page,
+search and representation gets its own tag.
+
+The same digest is part of the list cache keys (CachedListMixin's
+list_cache_state, the journal calendar) and is computed once per request
+by request_state(), so a cached body is only ever served under the ETag of
+the rows it was built from. api/long_poll.py watches the digests too.
+
+A matching If-None-Match gets a 304 before the view runs, so neither the
+list query nor the serializer is executed.
+"""
+from hashlib import sha1
+from django.conf import settings
+from django.db.models import Count, Max
+from .models import Note, NoteLike, JournalEntry, UserProfile
+from .couple import couple_for
+from . import list_cache
+from .list_cache import NOTES, JOURNAL, USERS
+
+
+def _digest(*parts):
+    return sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _etag(request, *parts):
+    return _digest(request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), *parts)
+
+
+def _is_conditional(request):
+    return request.method in ('GET', 'HEAD') and request.user.is_authenticated
+
+
+def notes_state(user):
+    """Digest of the couple's notes and likes"""
+    visible = couple_for(user).visible()
+    notes = Note.objects.filter(visible).aggregate(count=Count('id'), latest=Max('updated_at'))
+    likes = NoteLike.objects.filter(note__in=Note.objects.filter(visible)).aggregate(
+        count=Count('id'), latest=Max('created_at')
+    )
+    return _digest(
+        list_cache.get_version(NOTES, list_cache.couple_id(user)),
+        notes['count'], notes['latest'], likes['count'], likes['latest'],
+    )
+
+
+def journal_state(user):
+    """Digest of the couple's journal entries"""
+    entries = JournalEntry.objects.filter(couple_for(user).visible()).aggregate(count=Count('id'), latest=Max('updated_at'))
+    return _digest(
+        list_cache.get_version(JOURNAL, list_cache.couple_id(user)),
+        entries['count'], entries['latest'],
+    )
+
+
+def users_state(user):
+    """Digest of the user, who their partner is, and both profiles"""
+    profiles = UserProfile.objects.filter(user_id__in=[user.pk, user.partner_id]).aggregate(
+        count=Count('id'), latest=Max('updated_at')
+    )
+    return _digest(
+        user.partner_id, user.username, user.email,
+        list_cache.get_version(USERS, list_cache.couple_id(user)),
+        profiles['count'], profiles['latest'],
+    )
+
+
+STATE_FUNCTIONS = {
+    NOTES: notes_state,
+    JOURNAL: journal_state,
+    USERS: users_state,
+}
+
+
+def request_state(request, kind):
+    """kind's state digest for request.user, computed once per request (DRF or Django request alike)"""
+    http_request = getattr(request, '_request', request)
+    states = http_request.__dict__.setdefault('_list_states', {})
+    if kind not in states:
+        states[kind] = STATE_FUNCTIONS[kind](request.user)
+    return states[kind]
+
+
+def notes_etag(request, *args, **kwargs):
+    """Notes list, detail and search: notes and likes of the couple"""
+    if not _is_conditional(request):
+        return None
+    return _etag(request, NOTES, request.user.pk, request_state(request, NOTES))
+
+
+def journal_etag(request, *args, **kwargs):
+    """Journal list, detail, by-date and search: entries of the couple"""
+    if not _is_conditional(request):
+        return None
+    return _etag(request, JOURNAL, request.user.pk, request_state(request, JOURNAL))
+
+
+def users_etag(request, *args, **kwargs):
+    """Current user, own profile and partner profile"""
+    if not _is_conditional(request):
+        return None
+    return _etag(request, USERS, request.user.pk, request_state(request, USERS))
+
+
+def vapid_key_etag(request, *args, **kwargs):
+    if not _is_conditional(request) or not settings.VAPID_PUBLIC_KEY:
+        return None
+    return _etag(request, settings.VAPID_PUBLIC_KEY)
@@ -0,0 +1,270 @@
+"""
+Real-time events for the /api/events/ stream (Server-Sent Events)
+
+Writes to notes, journal entries and likes publish a small event (type,
+id, author) after they commit. Each user has their own channel: an event
+goes to its author's channel, and to the partner's channel too unless the
+row is private (a like's goes where its note's would), so a stream never
+reveals what the partner can't see.
+Clients react by re-fetching the item or calling /api/sync/.
+
+Events fan out through the broker configured in EVENT_BROKER. The default
+InProcessBroker only reaches streams served by the same process, so it
+needs the whole API (writes included) to run in a single ASGI process
+(notetaker/asgi.py); anything else needs a broker backend with the same
+publish()/subscribe() interface on top of a shared message bus.
+"""
+from abc import ABC, abstractmethod
+from collections import deque
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .models import Note, JournalEntry, NoteLike, User
+import asyncio
+import itertools
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """One stream's queue of events; iterate with `await subscription.get()`"""
+
+    def __init__(self, broker, channel, max_queue):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def _put(self, event):
+        # Runs on the subscriber's event loop
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: end the stream, the client reconnects and resyncs
+            logger.warning(f'Event stream on {self.channel} fell behind, closing it')
+            self.close()
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def deliver(self, event):
+        """Hand event to this subscription from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop already closed
+            self.close()
+
+    async def get(self):
+        """Next event, or None once the subscription has been closed"""
+        return await self.queue.get()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+class EventBroker(ABC):
+    """Interface for event fan-out backends"""
+
+    @abstractmethod
+    def publish(self, channel, event):
+        """Send event to channel's subscribers; returns it with its id"""
+
+    @abstractmethod
+    def subscribe(self, channel, last_event_id=None):
+        """Subscription to channel, starting with any buffered events after last_event_id"""
+
+    @abstractmethod
+    def unsubscribe(self, subscription):
+        """Stop delivering to subscription (Subscription.close() calls this)"""
+
+
+class InProcessBroker(EventBroker):
+    """
+    Fans events out to the streams of this process
+
+    Keeps the last `history` events per channel so a client reconnecting
+    with Last-Event-ID gets what it missed in between.
+    """
+
+    def __init__(self, history=50, max_queue=100):
+        self.history = history
+        self.max_queue = max_queue
+        self._ids = itertools.count(1)
+        self._channels = {}  # channel -> set of Subscriptions
+        self._recent = {}  # channel -> deque of recent events
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            event = dict(event, id=next(self._ids))
+            self._recent.setdefault(channel, deque(maxlen=self.history)).append(event)
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, channel, last_event_id=None):
+        subscription = Subscription(self, channel, self.max_queue)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+            missed = []
+            if last_event_id is not None:
+                missed = [event for event in self._recent.get(channel, ()) if event['id'] > last_event_id]
+        for event in missed[-self.max_queue:]:
+            subscription.queue.put_nowait(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Process-wide broker built from EVENT_BROKER / EVENT_BROKER_OPTIONS"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = import_string(getattr(settings, 'EVENT_BROKER', 'api.events.InProcessBroker'))
+                _broker = backend(**getattr(settings, 'EVENT_BROKER_OPTIONS', {}))
+    return _broker
+
+
+def format_event(event):
+    """Event as a Server-Sent Events message"""
+    data = {key: value for key, value in event.items() if key != 'id'}
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+def publish_to_users(event, user_ids):
+    """Publish event to the channels of user_ids (Nones left out), once the transaction commits"""
+    channels = [user_channel(user_id) for user_id in user_ids if user_id]
+
+    def publish():
+        broker = get_broker()
+        for channel in channels:
+            try:
+                broker.publish(channel, event)
+            except Exception as e:
+                logger.error(f'Error publishing {event["type"]} event to {channel}: {e}', exc_info=True)
+
+    transaction.on_commit(publish)
+
+
+def publish_to_couple(user, event, shared=True):
+    """Publish event to user's channel and, if shared, their partner's, once the transaction commits"""
+    publish_to_users(event, [user.pk, user.partner_id if shared else None])
+
+
+def _memo(origin):
+    """Lookups shared by the rows of one delete() (the origin it passes to post_delete)"""
+    return origin.__dict__.setdefault('_event_lookups', {}) if origin is not None else {}
+
+
+def _partner_id(instance, memo):
+    """
+    Partner id of instance's author, read off the author if it is loaded,
+    otherwise looked up once per author for memo
+    """
+    author_field = type(instance)._meta.get_field('author')
+    if author_field.is_cached(instance):
+        return author_field.get_cached_value(instance).partner_id
+    key = ('partner', instance.author_id)
+    if key not in memo:
+        memo[key] = User.objects.filter(pk=instance.author_id).values_list('partner_id', flat=True).first()
+    return memo[key]
+
+
+def _change_type(prefix, instance, created):
+    if created:
+        return f'{prefix}.created'
+    if instance.deletion_requested_by_id and not instance.deletion_approved_by_id:
+        return f'{prefix}.deletion_requested'
+    if instance.edit_requested_by_id and (instance.pending_title is not None or instance.pending_content is not None):
+        return f'{prefix}.edit_requested'
+    return f'{prefix}.updated'
+
+
+@receiver(pre_save, sender=Note)
+@receiver(pre_save, sender=JournalEntry)
+def remember_sharing(sender, instance, **kwargs):
+    # Needed in publish_change() to tell the partner an item was made private.
+    # Loaded and locked instances already carry it (SharingStateMixin,
+    # api/approvals.py); only the rest cost a query.
+    if not instance.pk:
+        instance._was_shared = None
+    elif getattr(instance, '_was_shared', None) is None:
+        instance._was_shared = sender.objects.filter(pk=instance.pk).values_list('is_shared', flat=True).first()
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=JournalEntry)
+def publish_change(sender, instance, created, **kwargs):
+    prefix = 'note' if sender is Note else 'journal'
+    event = {'type': _change_type(prefix, instance, created), 'object_id': instance.pk, 'author_id': instance.author_id}
+    if sender is JournalEntry:
+        event['date'] = str(instance.date)
+    partner_id = _partner_id(instance, {})
+    publish_to_users(event, [instance.author_id, partner_id if instance.is_shared else None])
+    if not instance.is_shared and getattr(instance, '_was_shared', None) and partner_id:
+        # Made private: it has to disappear from the partner's screen
+        publish_to_users(dict(event, type=f'{prefix}.unshared'), [partner_id])
+    # What the next save of this instance compares against
+    instance._was_shared = instance.is_shared
+
+
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=JournalEntry)
+def publish_delete(sender, instance, origin=None, **kwargs):
+    prefix = 'note' if sender is Note else 'journal'
+    partner_id = _partner_id(instance, _memo(origin)) if instance.is_shared else None
+    publish_to_users(
+        {'type': f'{prefix}.deleted', 'object_id': instance.pk, 'author_id': instance.author_id},
+        [instance.author_id, partner_id],
+    )
+
+
+@receiver(post_save, sender=NoteLike)
+@receiver(post_delete, sender=NoteLike)
+def publish_like(sender, instance, created=False, origin=None, **kwargs):
+    if isinstance(origin, Note) or (isinstance(origin, QuerySet) and origin.model is Note):
+        # Deleted along with its note, which has its own event
+        return
+    # Like the note itself: the author always, the partner only if it is shared
+    memo = _memo(origin)
+    key = ('note', instance.note_id)
+    if key not in memo:
+        memo[key] = Note.objects.filter(pk=instance.note_id).values_list(
+            'author_id', 'author__partner_id', 'is_shared'
+        ).first()
+    if memo[key] is None:
+        return
+    author_id, partner_id, is_shared = memo[key]
+    publish_to_users(
+        {'type': 'like.created' if created else 'like.deleted', 'object_id': instance.pk,
+         'note_id': instance.note_id, 'user_id': instance.user_id},
+        [author_id, partner_id if is_shared else None],
+    )
@@ -0,0 +1,109 @@
+"""
+Per-day journal aggregates for a calendar month (/api/journal/calendar/)
+
+A user has at most one entry per day (JournalEntry's unique author/date),
+so a month is one GROUP BY date query with a conditional aggregate per
+member of the couple: MAX() over a member's rows for a day is simply that
+member's entry. The partner's unshared entries are filtered out before
+grouping.
+
+Months are cached in the `lists` cache under the couple's JOURNAL state
+digest (see api/etags.py), which includes its version number, so any
+journal write drops them the same way it drops the cached journal lists.
+"""
+from datetime import date
+from django.conf import settings
+from django.db.models import Case, CharField, IntegerField, Max, Value, When
+from .couple import couple_for
+from .list_cache import JOURNAL
+from .models import JournalEntry
+from . import list_cache
+
+# Per member of the couple: aggregate alias suffix -> (column, output field)
+MEMBER_COLUMNS = {
+    'id': ('id', IntegerField()),
+    'mood': ('mood', CharField()),
+}
+
+
+def parse_month(value):
+    """date of the first day of a YYYY-MM month; ValueError if malformed"""
+    year, month = value.split('-')
+    if len(year) != 4 or len(month) != 2:
+        raise ValueError(value)
+    return date(int(year), int(month), 1)
+
+
+def _next_month(first):
+    return date(first.year + first.month // 12, first.month % 12 + 1, 1)
+
+
+def month_days(user, first):
+    """
+    {'YYYY-MM-DD': [{'id', 'author', 'mood', 'is_shared'}, ...]} for the days
+    of first's month with entries visible to user, the user's own entry first
+    """
+    couple = couple_for(user)
+    member_ids = couple.user_ids
+    aggregates = {
+        f'{suffix}_{member_id}': Max(Case(When(author_id=member_id, then=column), output_field=output_field))
+        for member_id in member_ids
+        for suffix, (column, output_field) in MEMBER_COLUMNS.items()
+    }
+    # As 1/0: PostgreSQL has no MAX() for booleans
+    aggregates.update({
+        f'shared_{member_id}': Max(Case(
+            When(author_id=member_id, is_shared=True, then=Value(1)),
+            When(author_id=member_id, then=Value(0)),
+            output_field=IntegerField(),
+        ))
+        for member_id in member_ids
+    })
+    rows = JournalEntry.objects.filter(
+        couple.visible(), date__gte=first, date__lt=_next_month(first)
+    ).order_by().values('date').annotate(**aggregates).order_by('date')
+
+    days = {}
+    for row in rows:
+        days[row['date'].isoformat()] = [
+            {
+                'id': row[f'id_{member_id}'],
+                'author': member_id,
+                'mood': row[f'mood_{member_id}'],
+                'is_shared': bool(row[f'shared_{member_id}']),
+            }
+            for member_id in member_ids
+            if row[f'id_{member_id}'] is not None
+        ]
+    return days
+
+
+def _key(user, first, state):
+    couple = list_cache.couple_id(user)
+    if state is None:
+        state = list_cache.get_version(JOURNAL, couple)
+    return f'calendar:{couple}:{state}:{user.pk}:{first:%Y-%m}'
+
+
+def get_month(user, first, state=None):
+    """
+    (payload, cache hit?) for first's month, served from the lists cache
+    when LIST_CACHE_ENABLED
+
+    state is the journal state digest the response's ETag is built from
+    (api.etags.request_state), kept in the cache key with the version.
+    """
+    if not list_cache.is_enabled():
+        return {'month': f'{first:%Y-%m}', 'days': month_days(user, first)}, False
+
+    cache = list_cache.get_cache()
+    key = _key(user, first, state)
+    payload = cache.get(key)
+    if payload is not None:
+        list_cache.stats.record('hits')
+        return payload, True
+
+    list_cache.stats.record('misses')
+    payload = {'month': f'{first:%Y-%m}', 'days': month_days(user, first)}
+    cache.set(key, payload, timeout=getattr(settings, 'LIST_CACHE_TIMEOUT', 300))
+    return payload, False
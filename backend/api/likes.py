@@ -0,0 +1,85 @@
+"""
+Note likes: race-free toggling and the denormalized Note.like_count
+
+toggle_like() deletes the user's like on a note and, only if there was
+none, inserts one, inside one transaction, so a like row and the count
+that goes with it are committed together. On SQLite the transaction
+starts with BEGIN IMMEDIATE (see api/sqlite_backend), which serializes
+concurrent toggles. On PostgreSQL a double tap can have both requests
+find nothing to delete; the second INSERT then fails on the note/user
+unique constraint once the first commits, and that one is turned into
+the unlike it would have been had the two run one after the other.
+
+Note.like_count is kept by the NoteLike post_save/post_delete receivers
+below with F() expressions, so it changes in the same statement order
+and transaction as the like itself, whichever code path writes it. Paths
+that skip signals (bulk_create, raw SQL) let it drift;
+reconcile_like_counts() (manage.py reconcile_like_counts) repairs that.
+"""
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, OuterRef, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Note, NoteLike
+from .write_retry import retry_on_lock
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _toggle(note, user):
+    with transaction.atomic():
+        deleted, _ = NoteLike.objects.filter(note=note, user=user).delete()
+        if deleted:
+            return False
+        try:
+            with transaction.atomic():
+                NoteLike.objects.create(note=note, user=user)
+        except IntegrityError:
+            # A concurrent toggle liked it between our DELETE and INSERT
+            logger.info(f'Concurrent like of note {note.pk} by {user.username}, unliking')
+            NoteLike.objects.filter(note=note, user=user).delete()
+            return False
+        return True
+
+
+def toggle_like(note, user):
+    """Like note as user, or unlike it if they already do; True if it is liked now"""
+    return retry_on_lock(router.db_for_write(NoteLike), _toggle, note, user)
+
+
+def _is_note_delete(origin):
+    return isinstance(origin, Note) or (isinstance(origin, QuerySet) and origin.model is Note)
+
+
+@receiver(post_save, sender=NoteLike)
+def count_like(sender, instance, created=False, **kwargs):
+    if created:
+        Note.objects.filter(pk=instance.note_id).update(like_count=F('like_count') + 1)
+
+
+@receiver(post_delete, sender=NoteLike)
+def uncount_like(sender, instance, origin=None, **kwargs):
+    if _is_note_delete(origin):
+        # Cascade from deleting the note itself
+        return
+    Note.objects.filter(pk=instance.note_id, like_count__gt=0).update(like_count=F('like_count') - 1)
+
+
+def reconcile_like_counts(fix=True):
+    """
+    [(note id, stored like_count, actual likes)] for notes whose like_count
+    has drifted from their NoteLike rows, corrected unless fix is False
+    """
+    actual = Coalesce(Subquery(
+        NoteLike.objects.filter(note=OuterRef('pk')).order_by().values('note').annotate(count=Count('pk')).values('count')
+    ), Value(0))
+    drifted = list(
+        Note.objects.annotate(actual=actual).exclude(like_count=F('actual')).values_list('pk', 'like_count', 'actual')
+    )
+    if fix and drifted:
+        # Counted again in the UPDATE, in case likes changed since
+        Note.objects.filter(pk__in=[note_id for note_id, _, _ in drifted]).update(like_count=actual)
+        logger.warning(f'Corrected like_count of {len(drifted)} notes')
+    return drifted
@@ -0,0 +1,221 @@
+"""
+Cached notes/journal list responses
+
+Serialized list payloads are stored in the `lists` cache (see CACHES in
+settings) under a key made of the couple's version number for that list,
+the requesting user and the full request URL. Any write to a note, like,
+journal entry or user bumps the couple's version (signal receivers in
+api/views.py), so stale payloads are never looked up again and age out of
+the cache through its LRU size cap. Views that have an ETag add the
+state digest it is built from to the key as well (see api/etags.py), so
+writes that skip the signals are picked up too. The cache must be shared by all
+worker processes (the default file cache is) for a bump made by one of
+them to reach the others. The same version numbers feed the
+ETags in api/etags.py (USERS has no cached list, only an ETag).
+"""
+from hashlib import sha1
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import transaction
+from django.dispatch import Signal
+from rest_framework.response import Response
+from .models import User
+import os
+import threading
+import time
+
+NOTES = 'notes'
+JOURNAL = 'journal'
+USERS = 'users'
+LIST_KINDS = (NOTES, JOURNAL, USERS)
+
+CACHE_ALIAS = 'lists'
+
+# Sent with couples=... once their versions have been bumped (api/long_poll.py)
+versions_bumped = Signal()
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache that evicts least recently used entries
+
+    Django's file cache culls a random sample once MAX_ENTRIES is reached;
+    this one refreshes an entry's mtime on every hit and culls the oldest.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except OSError:
+                pass
+        return value
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            return self.clear()
+        by_age = []
+        for fname in filelist:
+            try:
+                by_age.append((os.path.getmtime(fname), fname))
+            except OSError:
+                pass
+        by_age.sort()
+        for _, fname in by_age[:max(1, num_entries // self._cull_frequency)]:
+            self._delete(fname)
+
+
+class CacheStats:
+    """Hit/miss counters for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+            self.started_at = time.time()
+
+    def record(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'since': self.started_at,
+            }
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def is_enabled():
+    return getattr(settings, 'LIST_CACHE_ENABLED', True)
+
+
+def couple_id(user):
+    """Same for both partners: the sorted pair of user ids"""
+    return _couple_id(user.pk, user.partner_id)
+
+
+def _couple_id(user_id, partner_id):
+    if partner_id:
+        return '-'.join(str(pk) for pk in sorted((user_id, partner_id)))
+    return str(user_id)
+
+
+def _version_key(kind, couple):
+    return f'version:{kind}:{couple}'
+
+
+def get_version(kind, couple):
+    cache = get_cache()
+    key = _version_key(kind, couple)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so a version key that was evicted (or lost in
+        # a restart) can't come back as a number old payloads were stored under
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_versions(kinds, couple):
+    """{kind: get_version(kind, couple)}, in one cache read once they are set"""
+    keys = {_version_key(kind, couple): kind for kind in kinds}
+    stored = get_cache().get_many(keys)
+    return {kind: stored[key] if key in stored else get_version(kind, couple) for key, kind in keys.items()}
+
+
+def make_key(request, kind, state=None):
+    """
+    Cache key for this request's list payload; read before running the query
+
+    state is the digest of the rows behind the list that its ETag is built
+    from (see api/etags.py); without one the couple's version alone is used.
+    """
+    user = request.user
+    couple = couple_id(user)
+    if state is None:
+        state = get_version(kind, couple)
+    url = sha1(request.build_absolute_uri().encode()).hexdigest()
+    return f'list:{kind}:{couple}:{state}:{user.pk}:{url}'
+
+
+def _bump(kinds, couples):
+    cache = get_cache()
+    # A fresh clock value rather than incr(): the file cache's incr() is a
+    # read and a write, so two processes bumping at once could both write the
+    # same number and one of the bumps would be lost
+    version = time.time_ns()
+    cache.set_many({_version_key(kind, couple): version for kind in kinds for couple in couples}, timeout=None)
+    stats.record('invalidations')
+    versions_bumped.send(sender=None, couples=couples)
+
+
+def invalidate_user(user, kinds=LIST_KINDS):
+    """
+    Drop the cached lists of user's couple (and user on their own), once
+    the current transaction commits
+    """
+    couples = {couple_id(user), str(user.pk)}
+    transaction.on_commit(lambda: _bump(kinds, couples))
+
+
+def invalidate_user_id(user_id, kinds=LIST_KINDS):
+    """invalidate_user() for a user known by id, e.g. a row's author_id; one query for the partner"""
+    partner_id = User.objects.filter(pk=user_id).values_list('partner_id', flat=True).first()
+    couples = {_couple_id(user_id, partner_id), str(user_id)}
+    transaction.on_commit(lambda: _bump(kinds, couples))
+
+
+class CachedListMixin:
+    """
+    ListAPIView mixin serving list() from the lists cache
+
+    Set list_cache_kind to NOTES or JOURNAL, and list_cache_state to a
+    function(request, kind) returning the state digest the view's ETag uses
+    (api.etags.request_state). Responses carry an X-Cache header of HIT or
+    MISS.
+    """
+    list_cache_kind = None
+    list_cache_state = None
+
+    def list(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().list(request, *args, **kwargs)
+
+        cache = get_cache()
+        state = self.list_cache_state(request, self.list_cache_kind) if self.list_cache_state else None
+        key = make_key(request, self.list_cache_kind, state)
+        data = cache.get(key)
+        if data is not None:
+            stats.record('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        stats.record('misses')
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=getattr(settings, 'LIST_CACHE_TIMEOUT', 300))
+        response['X-Cache'] = 'MISS'
+        return response
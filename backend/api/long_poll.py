@@ -0,0 +1,163 @@
+"""
+Long-poll "wait for changes" for /api/changes/
+
+Clients pass the version numbers of the couple's lists they last saw and
+the request waits until one of them moves or LONG_POLL_TIMEOUT passes,
+then answers with the current versions and which lists changed. A client
+only re-fetches a list when it changed, instead of re-downloading it on a
+timer.
+
+A version is the list's state digest from api/etags.py (the couple's list
+cache version plus a row count/latest change aggregate read from the
+database), folded into an integer small enough for JavaScript. The digests
+are computed when the request comes in and once more when it answers.
+While it waits, only the couple's version numbers in the lists cache are
+re-read, every LONG_POLL_CHECK_INTERVAL seconds, which costs no database
+query; the cache is shared by every worker process, so their writes are
+noticed too. Writes committed in this process also send versions_bumped
+(api/list_cache.py), which wakes its waiters for that couple straight
+away. Writes that skip the signals (queryset .update()) don't move the
+versions; they show in the digests at the latest when the wait times out.
+
+Under WSGI each waiting request holds a worker thread; the ASGI entry
+point serves it from an async view (api/async_views.py) instead.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.dispatch import receiver
+from .etags import STATE_FUNCTIONS
+from .list_cache import NOTES, JOURNAL, USERS, versions_bumped
+from . import list_cache
+import asyncio
+import threading
+import time
+
+WATCHED_KINDS = (NOTES, JOURNAL, USERS)
+
+
+class ChangeNotifier:
+    """Wake-up callbacks of the requests in this process waiting on each couple"""
+
+    def __init__(self):
+        self._waiters = {}  # couple -> set of callbacks
+        self._lock = threading.Lock()
+
+    def add(self, couple, callback):
+        with self._lock:
+            self._waiters.setdefault(couple, set()).add(callback)
+
+    def remove(self, couple, callback):
+        with self._lock:
+            callbacks = self._waiters.get(couple)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._waiters[couple]
+
+    def notify(self, couples):
+        with self._lock:
+            callbacks = [callback for couple in couples for callback in self._waiters.get(couple, ())]
+        for callback in callbacks:
+            callback()
+
+
+notifier = ChangeNotifier()
+
+
+@receiver(versions_bumped)
+def wake_waiters(sender, couples, **kwargs):
+    notifier.notify(couples)
+
+
+def parse_since(params):
+    """{kind: version} the client last saw, for the kinds it passed; ValueError if malformed"""
+    return {kind: int(params[kind]) for kind in WATCHED_KINDS if params.get(kind)}
+
+
+def get_timeout(params):
+    """Seconds to wait: ?timeout= capped at LONG_POLL_TIMEOUT"""
+    limit = getattr(settings, 'LONG_POLL_TIMEOUT', 25)
+    try:
+        return max(0.0, min(float(params.get('timeout', limit)), limit))
+    except ValueError:
+        return limit
+
+
+def get_version(user, kind):
+    """kind's state digest for user as a non-negative integer below 2**52"""
+    return int(STATE_FUNCTIONS[kind](user)[:13], 16)
+
+
+def check(user, since):
+    """{'versions': {kind: version}, 'changed': [kinds whose version differs from since]}"""
+    versions = {kind: get_version(user, kind) for kind in WATCHED_KINDS}
+    # Versions are digests, so they are only ever compared for equality
+    changed = [kind for kind, version in since.items() if versions[kind] != version]
+    return {'versions': versions, 'changed': changed}
+
+
+def _moved(couple, versions):
+    return list_cache.get_versions(WATCHED_KINDS, couple) != versions
+
+
+def wait_for_changes(user, since, timeout):
+    """check() once something in since changed or timeout seconds passed, blocking the thread"""
+    couple = list_cache.couple_id(user)
+    interval = getattr(settings, 'LONG_POLL_CHECK_INTERVAL', 2)
+    woken = threading.Event()
+    notifier.add(couple, woken.set)
+    try:
+        # Read before the digests, so a bump in between is seen by one or the other
+        versions = list_cache.get_versions(WATCHED_KINDS, couple)
+        result = check(user, since)
+        if result['changed'] or not since:
+            return result
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            woken.wait(min(interval, remaining))
+            woken.clear()
+            if _moved(couple, versions):
+                break
+    finally:
+        notifier.remove(couple, woken.set)
+    return check(user, since)
+
+
+async def async_wait_for_changes(user, since, timeout):
+    """wait_for_changes() for the event loop"""
+    couple = list_cache.couple_id(user)
+    interval = getattr(settings, 'LONG_POLL_CHECK_INTERVAL', 2)
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+
+    def wake():
+        # Called from whichever thread committed the write
+        try:
+            loop.call_soon_threadsafe(woken.set)
+        except RuntimeError:
+            pass
+
+    notifier.add(couple, wake)
+    try:
+        versions = await sync_to_async(list_cache.get_versions)(WATCHED_KINDS, couple)
+        result = await sync_to_async(check)(user, since)
+        if result['changed'] or not since:
+            return result
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(woken.wait(), timeout=min(interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+            woken.clear()
+            if await sync_to_async(_moved)(couple, versions):
+                break
+    finally:
+        notifier.remove(couple, wake)
+    return await sync_to_async(check)(user, since)
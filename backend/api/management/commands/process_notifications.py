@@ -0,0 +1,95 @@
+"""
+Management command to deliver queued push notifications
+Run this via cron job every minute: python manage.py process_notifications
+or keep it running with: python manage.py process_notifications --loop
+(which purges old notifications hourly and stops cleanly on SIGTERM)
+"""
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from api.models import NotificationOutbox
+from api.notification_utils import process_notification_queue
+import logging
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending push notifications from the notification outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Maximum number of notifications delivered concurrently')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of due notifications claimed per batch')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll for new notifications')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to sleep between polls when the queue is empty (with --loop)')
+        parser.add_argument('--purge-after', type=int, default=7,
+                            help='Delete delivered/skipped/failed notifications older than this many days')
+        parser.add_argument('--purge-interval', type=float, default=3600.0,
+                            help='Seconds between purges of old notifications (with --loop)')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            processed, purged = self.run_loop(options)
+        else:
+            processed = self.drain(options['batch_size'], options['workers'])
+            purged = self.purge(options['purge_after'])
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Notifications: {processed} processed, {purged} old entries purged'
+            )
+        )
+
+    def run_loop(self, options):
+        """
+        Poll the outbox until SIGTERM/SIGINT, which stop the loop after the
+        current batch; old notifications are purged every --purge-interval
+        seconds and once more on the way out
+        """
+        stop = threading.Event()
+        
+        def request_stop(signum, frame):
+            logger.info(f'Received signal {signum}, stopping notification worker')
+            stop.set()
+        
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        
+        processed = purged = 0
+        next_purge = timezone.now()
+        while not stop.is_set():
+            close_old_connections()
+            if timezone.now() >= next_purge:
+                purged += self.purge(options['purge_after'])
+                next_purge = timezone.now() + timedelta(seconds=options['purge_interval'])
+            count = self.drain(options['batch_size'], options['workers'], stop)
+            processed += count
+            if not count:
+                stop.wait(options['interval'])
+        
+        purged += self.purge(options['purge_after'])
+        return processed, purged
+
+    def purge(self, days):
+        cutoff = timezone.now() - timedelta(days=days)
+        purged, _ = NotificationOutbox.objects.filter(
+            status__in=['sent', 'skipped', 'failed'], created_at__lt=cutoff
+        ).delete()
+        if purged:
+            logger.info(f'Purged {purged} old notification(s)')
+        return purged
+
+    def drain(self, batch_size, workers, stop=None):
+        processed = 0
+        while True:
+            count = process_notification_queue(batch_size=batch_size, workers=workers)
+            processed += count
+            if count < batch_size or (stop is not None and stop.is_set()):
+                return processed
@@ -0,0 +1,23 @@
+"""
+Management command to delete old sync tombstones
+Run daily from cron: python manage.py purge_tombstones
+Clients whose sync token is older than the retention period get a full sync instead.
+"""
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from api.sync import purge_tombstones, get_tombstone_retention
+
+
+class Command(BaseCommand):
+    help = 'Delete /api/sync/ tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Retention in days (default: SYNC_TOMBSTONE_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options['days']) if options['days'] else get_tombstone_retention()
+        purged = purge_tombstones(older_than)
+        self.stdout.write(
+            self.style.SUCCESS(f'Tombstones: {purged} older than {older_than.days} days purged')
+        )
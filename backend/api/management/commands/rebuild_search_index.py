@@ -0,0 +1,17 @@
+"""
+Management command to rebuild the note/journal full-text search index
+Run after restoring a database backup or if search results look stale: python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+from api.search import get_search_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for notes and journal entries'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        count = rebuild_index(backend)
+        self.stdout.write(
+            self.style.SUCCESS(f'Search index ({backend.name}): {count} documents indexed')
+        )
@@ -0,0 +1,21 @@
+"""
+Management command to repair drift in the denormalized Note.like_count
+Run from cron (e.g. weekly) or after bulk data changes: python manage.py reconcile_like_counts
+Use --dry-run to only report notes whose count differs from their likes.
+"""
+from django.core.management.base import BaseCommand
+from api.likes import reconcile_like_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount Note.like_count from the likes table and correct notes that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted notes without correcting them')
+
+    def handle(self, *args, **options):
+        drifted = reconcile_like_counts(fix=not options['dry_run'])
+        for note_id, stored, actual in drifted:
+            self.stdout.write(f'Note {note_id}: like_count {stored}, {actual} likes')
+        verb = 'found' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(f'Like counts: {len(drifted)} notes {verb}'))
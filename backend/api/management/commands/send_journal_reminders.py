@@ -1,66 +1,143 @@
 """
 Management command to send journal reminder notifications
 Run this via cron job every minute: python manage.py send_journal_reminders
+or keep it resident with: python manage.py send_journal_reminders --daemon
 """
+from datetime import timedelta
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 from django.utils import timezone
-from api.models import UserProfile, PushSubscription
-from api.notification_utils import send_push_notification
+from api.models import UserProfile
+from api.notification_utils import send_due_journal_reminders
+import heapq
 import logging
+import signal
+import threading
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = 'Send journal reminder notifications to users whose reminder time matches current time'
+    help = 'Send journal reminder notifications to users whose reminder is due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true',
+                            help='Stay running and sleep until the next reminder is due')
+        parser.add_argument('--refresh-interval', type=float, default=30.0,
+                            help='Seconds between checks for changed reminder settings (with --daemon)')
+        parser.add_argument('--refresh-overlap', type=float, default=60.0,
+                            help='Seconds each check looks back past the previous one, for slow commits (with --daemon)')
+        parser.add_argument('--full-refresh-interval', type=float, default=3600.0,
+                            help='Seconds between reloads of the whole schedule (with --daemon)')
 
     def handle(self, *args, **options):
-        now = timezone.now()
-        current_time = now.time()
-        
-        # Get all users who have journal reminders enabled
-        profiles = UserProfile.objects.filter(
-            notifications_enabled=True,
-            notify_journal_reminder=True
-        )
+        if options['daemon']:
+            self.run_daemon(options['refresh_interval'], options['refresh_overlap'], options['full_refresh_interval'])
+            return
         
-        sent_count = 0
-        skipped_count = 0
-        
-        for profile in profiles:
-            # Check if reminder time matches current time (within 1 minute window)
-            reminder_time = profile.journal_reminder_time
-            time_diff = abs(
-                (current_time.hour * 60 + current_time.minute) - 
-                (reminder_time.hour * 60 + reminder_time.minute)
-            )
-            
-            # Send reminder if time matches (within 1 minute window)
-            if time_diff <= 1:
-                # Get user's push subscriptions
-                subscriptions = PushSubscription.objects.filter(user=profile.user)
-                
-                if subscriptions.exists():
-                    title = '📔 Time to Write Your Journal'
-                    body = "Don't forget to add today's journal entry! 💕"
-                    
-                    for subscription in subscriptions:
-                        if send_push_notification(
-                            subscription,
-                            title,
-                            body,
-                            data={'reminder_type': 'journal'},
-                            notification_type='journal_reminder'
-                        ):
-                            sent_count += 1
-                            logger.info(f'Journal reminder sent to {profile.user.username}')
-                else:
-                    skipped_count += 1
-                    logger.debug(f'No push subscriptions for {profile.user.username}, skipping reminder')
+        sent_count, skipped_count = send_due_journal_reminders()
         
         self.stdout.write(
             self.style.SUCCESS(
-                f'Journal reminders: {sent_count} sent, {skipped_count} skipped (no subscriptions)'
+                f'Journal reminders: {sent_count} sent, {skipped_count} skipped (no subscriptions or too late)'
             )
         )
 
+    def run_daemon(self, refresh_interval, refresh_overlap=60.0, full_refresh_interval=3600.0):
+        """
+        Keep a heap of upcoming reminder times and sleep until the earliest
+        one (or the next settings refresh), instead of starting a new process
+        every minute. Profiles changed since the last refresh are picked up
+        through UserProfile.updated_at, and the whole schedule is reloaded
+        every full_refresh_interval seconds in case one was missed;
+        SIGTERM/SIGINT stop the loop after the current batch.
+        """
+        stop = threading.Event()
+        
+        def request_stop(signum, frame):
+            logger.info(f'Received signal {signum}, stopping journal reminder daemon')
+            stop.set()
+        
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        
+        self.reset_schedule(refresh_overlap)
+        self.refresh_schedule()
+        self.stdout.write(f'Journal reminder daemon started, {len(self.scheduled)} reminder(s) scheduled')
+        
+        total_sent = 0
+        next_refresh = timezone.now()
+        next_full_refresh = next_refresh + timedelta(seconds=full_refresh_interval)
+        while not stop.is_set():
+            close_old_connections()
+            now = timezone.now()
+            
+            if now >= next_full_refresh:
+                self.reset_schedule(refresh_overlap)
+                self.refresh_schedule()
+                next_full_refresh = now + timedelta(seconds=full_refresh_interval)
+                next_refresh = now + timedelta(seconds=refresh_interval)
+            elif now >= next_refresh:
+                self.refresh_schedule()
+                next_refresh = now + timedelta(seconds=refresh_interval)
+            
+            sent_count = self.send_due(now)
+            total_sent += sent_count
+            
+            wake_at = next_refresh
+            if self.heap and self.heap[0][0] < wake_at:
+                wake_at = self.heap[0][0]
+            stop.wait(max((wake_at - timezone.now()).total_seconds(), 0))
+        
+        self.stdout.write(self.style.SUCCESS(f'Journal reminder daemon stopped, {total_sent} reminder(s) sent'))
+
+    def reset_schedule(self, refresh_overlap=60.0):
+        """Forget the schedule; the next refresh_schedule() loads it from scratch"""
+        self.heap = []
+        self.scheduled = {}  # profile id -> next reminder time, for skipping stale heap entries
+        self.last_seen = None
+        self.refresh_overlap = timedelta(seconds=refresh_overlap)
+
+    def refresh_schedule(self, profile_ids=None):
+        """Load next reminder times for all profiles changed since the last refresh (or the given ones)"""
+        profiles = UserProfile.objects.all()
+        if profile_ids is not None:
+            profiles = profiles.filter(id__in=profile_ids)
+        elif self.last_seen is not None:
+            # updated_at is set before the row is committed, so a save that
+            # commits after the last refresh can carry an earlier time: look back
+            profiles = profiles.filter(updated_at__gte=self.last_seen - self.refresh_overlap)
+        else:
+            profiles = profiles.filter(next_journal_reminder_at__isnull=False)
+        
+        for profile_id, next_at, updated_at in profiles.values_list('id', 'next_journal_reminder_at', 'updated_at'):
+            if profile_ids is None and (self.last_seen is None or updated_at > self.last_seen):
+                self.last_seen = updated_at
+            if next_at is None:
+                self.scheduled.pop(profile_id, None)
+            elif self.scheduled.get(profile_id) != next_at:
+                self.scheduled[profile_id] = next_at
+                heapq.heappush(self.heap, (next_at, profile_id))
+        
+        # Drop superseded entries once they pile up
+        if len(self.heap) > 2 * len(self.scheduled) + 100:
+            self.heap = [(next_at, profile_id) for profile_id, next_at in self.scheduled.items()]
+            heapq.heapify(self.heap)
+
+    def pop_due(self, now):
+        due_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            next_at, profile_id = heapq.heappop(self.heap)
+            if self.scheduled.get(profile_id) == next_at:
+                due_ids.append(profile_id)
+        return due_ids
+
+    def send_due(self, now):
+        """Send the reminders due at now, if the heap has any; returns how many were sent"""
+        due_ids = self.pop_due(now)
+        if not due_ids:
+            return 0
+        sent_count, skipped_count = send_due_journal_reminders(now)
+        logger.info(f'Journal reminders: {sent_count} sent, {skipped_count} skipped')
+        self.refresh_schedule(profile_ids=due_ids)
+        return sent_count
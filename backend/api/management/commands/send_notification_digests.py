@@ -0,0 +1,19 @@
+"""
+Management command to send the daily notification digests
+Run once a day from cron: python manage.py send_notification_digests
+Only users with notification_digest on have notifications held for it.
+"""
+from django.core.management.base import BaseCommand
+from api.notification_utils import send_notification_digests
+
+
+class Command(BaseCommand):
+    help = 'Send each digest user one push summing up the notifications held for them'
+
+    def handle(self, *args, **options):
+        sent_count, skipped_count = send_notification_digests()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Notification digests: {sent_count} sent, {skipped_count} skipped (nothing enabled or no subscriptions)'
+            )
+        )
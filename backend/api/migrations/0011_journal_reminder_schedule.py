@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:23
+
+from datetime import datetime, timedelta, timezone
+from django.db import migrations, models
+
+
+def schedule_existing_reminders(apps, schema_editor):
+    UserProfile = apps.get_model('api', 'UserProfile')
+    now = datetime.now(timezone.utc)
+    for profile in UserProfile.objects.filter(notifications_enabled=True, notify_journal_reminder=True):
+        next_at = datetime.combine(now.date(), profile.journal_reminder_time, tzinfo=timezone.utc)
+        if next_at <= now:
+            next_at += timedelta(days=1)
+        UserProfile.objects.filter(pk=profile.pk).update(next_journal_reminder_at=next_at)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_journal_reminder_at',
+            field=models.DateTimeField(blank=True, help_text='When the last journal reminder was sent', null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='next_journal_reminder_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the next journal reminder is due (empty if reminders are off)', null=True),
+        ),
+        migrations.RunPython(schedule_existing_reminders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:25
+
+from collections import Counter
+from html import unescape
+from django.db import migrations, models
+from django.utils.html import strip_tags
+import re
+import unicodedata
+
+
+FTS_TABLE = 'api_search_fts'
+MAX_TERM_LENGTH = 100
+
+# Text extraction and tokenizing as api.search did when this migration was
+# written, copied so later changes there can't change what it does
+_BLOCK_TAG_RE = re.compile(r'<\s*(br|/p|/div|/li|/h[1-6]|/blockquote|/tr)\b[^>]*>', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\w+')
+
+
+def html_to_text(html):
+    if not html:
+        return ''
+    text = strip_tags(_BLOCK_TAG_RE.sub(' ', html))
+    return _WHITESPACE_RE.sub(' ', unescape(text)).strip()
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [word[:MAX_TERM_LENGTH] for word in _WORD_RE.findall(text)]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Create the FTS5 table where the SQLite build supports it, then index
+    existing notes and entries into whichever index is in use
+    """
+    connection = schema_editor.connection
+    alias = connection.alias
+    SearchTerm = apps.get_model('api', 'SearchTerm')
+    use_fts = False
+    if connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "title, body, kind UNINDEXED, object_id UNINDEXED, "
+                    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+                )
+            use_fts = True
+        except Exception:
+            # SQLite built without FTS5 - use the SearchTerm table
+            pass
+    
+    terms = []
+    with connection.cursor() as cursor:
+        for kind, model_name in (('note', 'Note'), ('journal', 'JournalEntry')):
+            rows = apps.get_model('api', model_name).objects.using(alias).values_list('pk', 'title', 'content')
+            for object_id, title, content in rows.iterator():
+                title, body = html_to_text(title), html_to_text(content)
+                if use_fts:
+                    cursor.execute(
+                        f'INSERT INTO {FTS_TABLE} (title, body, kind, object_id) VALUES (%s, %s, %s, %s)',
+                        [title, body, kind, object_id]
+                    )
+                    continue
+                for field, text in (('title', title), ('body', body)):
+                    for term, frequency in Counter(tokenize(text)).items():
+                        terms.append(SearchTerm(
+                            kind=kind, object_id=object_id, field=field, term=term, frequency=frequency
+                        ))
+    SearchTerm.objects.using(alias).bulk_create(terms, batch_size=500)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_journal_reminder_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('field', models.CharField(max_length=10)),
+                ('term', models.CharField(max_length=100)),
+                ('frequency', models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='searchterm_kind_term_idx'), models.Index(fields=['kind', 'object_id'], name='searchterm_kind_object_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
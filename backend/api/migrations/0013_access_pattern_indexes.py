@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['author', '-updated_at', '-id'], name='note_author_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pushsubscription',
+            index=models.Index(fields=['user', '-created_at'], name='pushsub_user_created_idx'),
+        ),
+    ]
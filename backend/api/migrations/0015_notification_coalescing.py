@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='count',
+            field=models.PositiveIntegerField(default=1, help_text='Notifications merged into this one'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='notification_digest',
+            field=models.BooleanField(default=False, help_text='Collect partner notifications into one daily digest instead of sending them as they happen'),
+        ),
+        migrations.AlterField(
+            model_name='notificationoutbox',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('skipped', 'Skipped'), ('failed', 'Failed'), ('digest', 'Held for digest')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='notificationoutbox',
+            index=models.Index(fields=['recipient', 'status', 'notification_type'], name='outbox_recipient_open_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+# GIN index over search_vector() per searchable model (PostgreSQL only)
+SEARCH_INDEXES = (
+    ('Note', 'note_search_idx'),
+    ('JournalEntry', 'journal_search_idx'),
+)
+
+
+def search_vector():
+    """
+    api.search.search_vector() as it was when this migration was written:
+    title as A, content as B, 'simple' configuration. Queries must build
+    the same expression for PostgreSQL to use the indexes, so a change
+    there needs a new migration rather than an edit here.
+    """
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector('title', weight='A', config='simple') + SearchVector('content', weight='B', config='simple')
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+    
+    for model_name, index_name in SEARCH_INDEXES:
+        schema_editor.add_index(apps.get_model('api', model_name), GinIndex(search_vector(), name=index_name))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for _, index_name in SEARCH_INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(condition=models.Q(('is_shared', True)), fields=['author', '-date', '-created_at', '-id'], name='journal_author_shared_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(condition=models.Q(('is_shared', True)), fields=['author', '-updated_at', '-id'], name='note_author_shared_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_existing_likes(apps, schema_editor):
+    Note = apps.get_model('api', 'Note')
+    NoteLike = apps.get_model('api', 'NoteLike')
+    likes = NoteLike.objects.filter(note=OuterRef('pk')).order_by().values('note').annotate(count=Count('pk')).values('count')
+    Note.objects.update(like_count=Coalesce(Subquery(likes), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_shared_and_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of likes, kept by api/likes.py'),
+        ),
+        migrations.RunPython(count_existing_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_note_like_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='parent_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,26 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from .write_retry import RetryOnLockMixin
 
 
-class User(AbstractUser):
+class SharingStateMixin:
+    """
+    Keeps is_shared as last read from or written to the database in
+    _was_shared, so a save can tell the item was made private without
+    re-reading the row (api/events.py)
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # None when is_shared was deferred
+        instance._was_shared = instance.__dict__.get('is_shared')
+        return instance
+
+
+class User(RetryOnLockMixin, AbstractUser):
     email = models.EmailField(unique=True)
     partner_code = models.CharField(max_length=20, unique=True, null=True, blank=True)
     partner = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='partnered_with')
@@ -12,7 +29,7 @@ class User(AbstractUser):
         return self.username
 
 
-class PartnerRequest(models.Model):
+class PartnerRequest(RetryOnLockMixin, models.Model):
     requester = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_requests')
     requested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_requests')
     status = models.CharField(max_length=20, choices=[
@@ -23,7 +40,7 @@ class PartnerRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
-class Note(models.Model):
+class Note(SharingStateMixin, RetryOnLockMixin, models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notes')
@@ -36,15 +53,25 @@ class Note(models.Model):
     edit_approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='edit_approvals', help_text='User who approved the edit')
     pending_title = models.CharField(max_length=200, blank=True, null=True, help_text='Pending title change')
     pending_content = models.TextField(blank=True, null=True, help_text='Pending content change')
+    like_count = models.PositiveIntegerField(default=0, help_text='Number of likes, kept by api/likes.py')
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # One author's notes in cursor pagination order (see api/querysets.py)
+            models.Index(fields=['author', '-updated_at', '-id'], name='note_author_updated_idx'),
+            # The partner's arm of a list only reads shared notes
+            models.Index(
+                fields=['author', '-updated_at', '-id'], condition=models.Q(is_shared=True),
+                name='note_author_shared_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.title
 
 
-class NoteLike(models.Model):
+class NoteLike(RetryOnLockMixin, models.Model):
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='likes')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='note_likes')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -57,7 +84,7 @@ class NoteLike(models.Model):
         return f"{self.user.username} likes {self.note.title}"
 
 
-class JournalEntry(models.Model):
+class JournalEntry(SharingStateMixin, RetryOnLockMixin, models.Model):
     title = models.CharField(max_length=200, blank=True)
     content = models.TextField()
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='journal_entries')
@@ -76,12 +103,21 @@ class JournalEntry(models.Model):
     class Meta:
         ordering = ['-date', '-created_at']
         unique_together = ['author', 'date']
+        indexes = [
+            # Entries changed since a sync token (see api/sync.py)
+            models.Index(fields=['author', 'updated_at'], name='journal_author_updated_idx'),
+            # The partner's arm of a list, in list order, only reads shared entries
+            models.Index(
+                fields=['author', '-date', '-created_at', '-id'], condition=models.Q(is_shared=True),
+                name='journal_author_shared_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.author.username} - {self.date}"
 
 
-class PushSubscription(models.Model):
+class PushSubscription(RetryOnLockMixin, models.Model):
     """Store Web Push API subscriptions for sending notifications"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='push_subscriptions')
     endpoint = models.URLField(max_length=500)
@@ -93,12 +129,16 @@ class PushSubscription(models.Model):
     class Meta:
         unique_together = ['user', 'endpoint']
         ordering = ['-created_at']
+        indexes = [
+            # A user's devices in Meta.ordering, for notification fan-out
+            models.Index(fields=['user', '-created_at'], name='pushsub_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.endpoint[:50]}..."
 
 
-class UserProfile(models.Model):
+class UserProfile(RetryOnLockMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(blank=True)
     birthday = models.DateField(null=True, blank=True)
@@ -139,9 +179,133 @@ class UserProfile(models.Model):
     notify_journal_updated = models.BooleanField(default=True, help_text='Notify when partner updates a journal entry')
     notify_journal_deletion_requested = models.BooleanField(default=True, help_text='Notify when partner requests to delete a journal entry')
     notify_journal_reminder = models.BooleanField(default=True, help_text='Enable nightly journal reminder notifications')
+    notification_digest = models.BooleanField(default=False, help_text='Collect partner notifications into one daily digest instead of sending them as they happen')
     journal_reminder_time = models.TimeField(default='21:00:00', help_text='Time for nightly journal reminder (24-hour format)')
+    next_journal_reminder_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text='When the next journal reminder is due (empty if reminders are off)')
+    last_journal_reminder_at = models.DateTimeField(null=True, blank=True, help_text='When the last journal reminder was sent')
     
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
+    
+    def save(self, *args, **kwargs):
+        self.next_journal_reminder_at = self.schedule_journal_reminder()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'next_journal_reminder_at'}
+        super().save(*args, **kwargs)
+    
+    def get_journal_reminder_time(self):
+        reminder_time = self.journal_reminder_time
+        if isinstance(reminder_time, str):
+            # Unsaved instances still hold the string default
+            reminder_time = time.fromisoformat(reminder_time)
+        return reminder_time
+    
+    def schedule_journal_reminder(self):
+        """
+        Next reminder time to store, keeping the current one if it still
+        matches the settings (so unrelated profile edits don't push today's
+        reminder to tomorrow)
+        """
+        if not (self.notifications_enabled and self.notify_journal_reminder):
+            return None
+        current = self.next_journal_reminder_at
+        if current and current.astimezone(dt_timezone.utc).time() == self.get_journal_reminder_time():
+            return current
+        return self.compute_next_journal_reminder()
+    
+    def compute_next_journal_reminder(self, after=None):
+        """
+        First reminder time (UTC, like the reminder time itself) strictly
+        after `after` and after the last reminder sent, or None if journal
+        reminders are off
+        """
+        if not (self.notifications_enabled and self.notify_journal_reminder):
+            return None
+        after = after or timezone.now()
+        if self.last_journal_reminder_at and self.last_journal_reminder_at > after:
+            after = self.last_journal_reminder_at
+        after = after.astimezone(dt_timezone.utc)
+        next_at = datetime.combine(after.date(), self.get_journal_reminder_time(), tzinfo=dt_timezone.utc)
+        if next_at <= after:
+            next_at += timedelta(days=1)
+        return next_at
+
+
+class NotificationOutbox(RetryOnLockMixin, models.Model):
+    """Push notifications queued by API requests and delivered by the process_notifications command"""
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='queued_notifications')
+    sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='sent_notifications')
+    notification_type = models.CharField(max_length=50)
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+        ('digest', 'Held for digest'),
+    ], default='pending')
+    count = models.PositiveIntegerField(default=1, help_text='Notifications merged into this one')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, help_text='Not picked up by the worker before this time')
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+            # Unsent notifications to merge a new one into (see send_notification_to_partner)
+            models.Index(fields=['recipient', 'status', 'notification_type'], name='outbox_recipient_open_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.notification_type} -> {self.recipient_id} ({self.status})"
+
+
+class SearchTerm(RetryOnLockMixin, models.Model):
+    """Inverted index for note/journal search, used when SQLite FTS5 isn't available (see api/search.py)"""
+    kind = models.CharField(max_length=20)  # 'note' or 'journal'
+    object_id = models.BigIntegerField()
+    field = models.CharField(max_length=10)  # 'title' or 'body'
+    term = models.CharField(max_length=100)
+    frequency = models.PositiveIntegerField(default=1)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='searchterm_kind_term_idx'),
+            models.Index(fields=['kind', 'object_id'], name='searchterm_kind_object_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} {self.field} {self.term}"
+
+
+class Tombstone(RetryOnLockMixin, models.Model):
+    """Record of a hard-deleted note, journal entry or like, for /api/sync/ (see api/sync.py)"""
+    kind = models.CharField(max_length=20, choices=[
+        ('note', 'Note'),
+        ('journal_entry', 'Journal entry'),
+        ('note_like', 'Note like')
+    ])
+    object_id = models.BigIntegerField()
+    # Author of the deleted note/entry, or the user who liked; the couple of
+    # this user is who gets told about the deletion
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    # Note of a deleted like, whose like_count changed with it
+    parent_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['deleted_at']
+        indexes = [
+            models.Index(fields=['owner', 'deleted_at'], name='tombstone_owner_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} deleted {self.deleted_at}"
@@ -0,0 +1,105 @@
+"""
+Cached notification routing per recipient
+
+Whether, how and where a notification is delivered depends on the
+recipient's UserProfile (notifications on, digest mode, the notify_* flags)
+and their push subscriptions. get_route() loads all of it in one query
+and caches the resolved NotificationRoute in the NOTIFICATION_ROUTE_CACHE
+cache. Saving or deleting a UserProfile or PushSubscription drops the
+cached route once the transaction commits.
+
+Routes are written by the web processes and read by process_notifications,
+so the cache must be shared between them (the default `routes` file cache
+is). With a per-process cache such as locmem the worker would keep
+delivering by a stale route - to a removed subscription, or a type the
+recipient turned off - for up to NOTIFICATION_ROUTE_CACHE_TIMEOUT seconds.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import User, UserProfile, PushSubscription
+
+# notification_type -> UserProfile flag turning it on/off
+NOTIFICATION_TYPE_FLAGS = {
+    'note_created': 'notify_note_created',
+    'note_updated': 'notify_note_updated',
+    'note_liked': 'notify_note_liked',
+    'note_deletion_requested': 'notify_note_deletion_requested',
+    'journal_created': 'notify_journal_created',
+    'journal_updated': 'notify_journal_updated',
+    'journal_deletion_requested': 'notify_journal_deletion_requested',
+    'journal_reminder': 'notify_journal_reminder',
+}
+
+PROFILE_FIELDS = ('id', 'notifications_enabled', 'notification_digest') + tuple(NOTIFICATION_TYPE_FLAGS.values())
+SUBSCRIPTION_FIELDS = ('id', 'endpoint', 'p256dh', 'auth')
+
+
+class NotificationRoute:
+    """Everything needed to route a notification to one recipient"""
+
+    def __init__(self, user_id, profile=None, subscriptions=()):
+        self.user_id = user_id
+        self.has_profile = profile is not None
+        profile = profile or {}
+        self.notifications_enabled = bool(profile.get('notifications_enabled'))
+        self.digest = bool(profile.get('notification_digest'))
+        self.disabled_types = frozenset(
+            notification_type for notification_type, flag in NOTIFICATION_TYPE_FLAGS.items()
+            if not profile.get(flag, True)
+        )
+        self.subscriptions = list(subscriptions)
+
+    def allows(self, notification_type):
+        """Whether the recipient wants notification_type delivered at all"""
+        return self.has_profile and self.notifications_enabled and notification_type not in self.disabled_types
+
+
+def get_cache():
+    return caches[getattr(settings, 'NOTIFICATION_ROUTE_CACHE', 'routes')]
+
+
+def _key(user_id):
+    return f'notification_route:{user_id}'
+
+
+def load_route(user_id):
+    """NotificationRoute for user_id straight from the database, in one query"""
+    rows = User.objects.filter(pk=user_id).values(
+        *(f'profile__{field}' for field in PROFILE_FIELDS),
+        *(f'push_subscriptions__{field}' for field in SUBSCRIPTION_FIELDS),
+    ).order_by('-push_subscriptions__created_at')
+    profile = None
+    subscriptions = []
+    for row in rows:
+        if row['profile__id'] is not None:
+            profile = {field: row[f'profile__{field}'] for field in PROFILE_FIELDS}
+        if row['push_subscriptions__id'] is not None:
+            subscriptions.append(PushSubscription(
+                user_id=user_id, **{field: row[f'push_subscriptions__{field}'] for field in SUBSCRIPTION_FIELDS}
+            ))
+    return NotificationRoute(user_id, profile, subscriptions)
+
+
+def get_route(user_id):
+    """Cached NotificationRoute for user_id"""
+    cache = get_cache()
+    route = cache.get(_key(user_id))
+    if route is None:
+        route = load_route(user_id)
+        cache.set(_key(user_id), route, getattr(settings, 'NOTIFICATION_ROUTE_CACHE_TIMEOUT', 300))
+    return route
+
+
+def invalidate_route(user_id):
+    transaction.on_commit(lambda: get_cache().delete(_key(user_id)))
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=PushSubscription)
+@receiver(post_delete, sender=PushSubscription)
+def invalidate_cached_route(sender, instance, **kwargs):
+    invalidate_route(instance.user_id)
@@ -1,112 +1,87 @@
 """
 Notification utility functions for sending push notifications
 """
+from datetime import timedelta
 from django.conf import settings
-from .models import PushSubscription, UserProfile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import PushSubscription, UserProfile, NotificationOutbox
+from .notification_routing import get_route
+from .push_client import WEBPUSH_AVAILABLE, WebPushException, get_push_client
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
-import base64
+import random
+import threading
 
 logger = logging.getLogger(__name__)
 
-# Fix for pywebpush 1.14.0 bug with cryptography >=43.0.0
-# The bug is in pywebpush/__init__.py line 203: ec.generate_private_key(ec.SECP256R1, ...)
-# Should be: ec.generate_private_key(ec.SECP256R1(), ...)
-# We'll monkey patch the problematic function
-try:
-    import pywebpush
-    from cryptography.hazmat.primitives.asymmetric import ec
-    from cryptography.hazmat.backends import default_backend
-    
-    # Monkey patch the buggy line in pywebpush
-    # The bug is in WebPusher.encode() method
-    if hasattr(pywebpush, 'WebPusher'):
-        WebPusher = pywebpush.WebPusher
-        original_encode = WebPusher.encode
-        
-        def patched_encode(self, data, content_encoding='aesgcm'):
-            """Patched encode method to fix ec.SECP256R1 bug"""
-            # Import the modules needed
-            from cryptography.hazmat.primitives.asymmetric import ec as ec_module
-            from cryptography.hazmat.backends import default_backend as backend_module
-            
-            # Monkey patch ec.generate_private_key to fix the bug
-            original_generate = ec_module.generate_private_key
-            
-            def fixed_generate_private_key(curve, backend=None):
-                # If curve is a class instead of instance, instantiate it
-                if isinstance(curve, type):
-                    curve = curve()
-                return original_generate(curve, backend)
-            
-            # Temporarily replace the function
-            ec_module.generate_private_key = fixed_generate_private_key
-            
-            try:
-                result = original_encode(self, data, content_encoding)
-                return result
-            finally:
-                # Restore original function
-                ec_module.generate_private_key = original_generate
-        
-        # Replace the encode method
-        WebPusher.encode = patched_encode
-except Exception as e:
-    # If patching fails, log and continue
-    logger.warning(f'Could not patch pywebpush: {e}')
+# Maximum concurrent sends when fanning out to one user's devices
+PUSH_FANOUT_WORKERS = getattr(settings, 'PUSH_FANOUT_WORKERS', 8)
 
-try:
-    from pywebpush import webpush, WebPushException
-    WEBPUSH_AVAILABLE = True
-except ImportError:
-    WEBPUSH_AVAILABLE = False
-    logger.warning('pywebpush not installed. Web Push notifications will not work.')
+# Push service responses meaning the subscription is gone for good
+PRUNE_STATUS_CODES = (404, 410)
+# Push service responses worth retrying later
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+PUSH_REQUEST_TIMEOUT = 10  # seconds
 
-try:
-    from py_vapid import Vapid
-    VAPID_AVAILABLE = True
-except ImportError:
-    VAPID_AVAILABLE = False
-    Vapid = None
-    logger.warning('py-vapid not installed. VAPID key handling may not work correctly.')
+# notification_type -> (emoji, what the sender did once, ... n times), used to
+# merge several notifications of one type into one push and for digests
+NOTIFICATION_SUMMARIES = {
+    'note_created': ('💕', 'wrote a new note', 'wrote {count} new notes'),
+    'note_updated': ('✏️', 'updated a note', 'updated {count} notes'),
+    'note_liked': ('❤️', 'liked a note', 'liked {count} notes'),
+    'note_deletion_requested': ('🗑️', 'wants to delete a note', 'wants to delete {count} notes'),
+    'journal_created': ('📔', 'wrote a journal entry', 'wrote {count} journal entries'),
+    'journal_updated': ('✏️', 'updated a journal entry', 'updated {count} journal entries'),
+    'journal_deletion_requested': ('🗑️', 'wants to delete a journal entry', 'wants to delete {count} journal entries'),
+}
 
+PushResult = namedtuple('PushResult', ['subscription', 'success', 'status_code', 'prune', 'retryable', 'error'])
 
-def _get_vapid_object():
-    """
-    Create Vapid object from VAPID keys for pywebpush
-    pywebpush can accept Vapid object directly
-    """
-    if not VAPID_AVAILABLE or Vapid is None:
-        raise ImportError('py-vapid not available. Install it with: pip install py-vapid')
+
+def _endpoint_type(endpoint):
+    return 'Apple' if 'apple.com' in endpoint else 'Google' if 'googleapis.com' in endpoint else 'Other'
+
+
+def _build_payload(subscription, title, body, data, notification_type):
+    # For Safari/Chrome compatibility, we send the payload as JSON string
+    # Use unique tag per notification to allow multiple consecutive notifications
+    note_id_from_data = data.get('note_id') if data else None
+    tag_suffix = f"-{note_id_from_data}-{subscription.id}" if note_id_from_data else f"-{subscription.id}"
+    tag = f"love-notes-{notification_type or 'default'}{tag_suffix}"
+    payload = {
+        "title": title,
+        "body": body,
+        "icon": "/icon-192.svg",
+        "badge": "/icon-192.svg",
+        "tag": tag,
+        "requireInteraction": False,
+    }
     
-    try:
-        # py-vapid's from_string() only needs private_key
-        # Public key is derived from private key automatically
-        vapid = Vapid.from_string(private_key=settings.VAPID_PRIVATE_KEY)
-        return vapid
-    except Exception as e:
-        logger.error(f'Error creating Vapid object: {e}', exc_info=True)
-        raise
+    if data:
+        payload["data"] = data
+    return json.dumps(payload)
 
 
-def send_push_notification(subscription, title, body, data=None, notification_type=None):
+def _push_to_subscription(subscription, title, body, data=None, notification_type=None):
     """
-    Send a push notification using Web Push API
+    Encrypt and send one push message, returning a PushResult
     
-    Args:
-        subscription: PushSubscription object
-        title: Notification title
-        body: Notification body
-        data: Optional data payload
+    Doesn't touch the database, so it is safe to run on worker threads;
+    pruning is left to the caller.
     """
     if not WEBPUSH_AVAILABLE:
         logger.warning('Web Push not available - pywebpush not installed')
-        return False
+        return PushResult(subscription, False, None, False, False, 'pywebpush not installed')
     
     if not settings.VAPID_PUBLIC_KEY or not settings.VAPID_PRIVATE_KEY:
         logger.warning('VAPID keys not configured')
-        return False
+        return PushResult(subscription, False, None, False, False, 'VAPID keys not configured')
     
+    endpoint_type = _endpoint_type(subscription.endpoint)
     try:
         subscription_info = {
             "endpoint": subscription.endpoint,
@@ -116,59 +91,121 @@ def send_push_notification(subscription, title, body, data=None, notification_ty
             }
         }
         
-        vapid_claims = {
-            "sub": settings.VAPID_CLAIM_EMAIL
-        }
-        
-        # Create notification payload
-        # For Safari/Chrome compatibility, we send the payload as JSON string
-        # Use unique tag per notification to allow multiple consecutive notifications
-        note_id_from_data = data.get('note_id') if data else None
-        tag_suffix = f"-{note_id_from_data}-{subscription.id}" if note_id_from_data else f"-{subscription.id}"
-        tag = f"love-notes-{notification_type or 'default'}{tag_suffix}"
-        payload = {
-            "title": title,
-            "body": body,
-            "icon": "/icon-192.svg",
-            "badge": "/icon-192.svg",
-            "tag": tag,
-            "requireInteraction": False,
-        }
-        
-        if data:
-            payload["data"] = data
-        
         # Send push notification
-        # Try passing private key as string first (base64url format)
-        # pywebpush should handle base64url format directly
-        webpush(
-            subscription_info=subscription_info,
-            data=json.dumps(payload),
-            vapid_private_key=settings.VAPID_PRIVATE_KEY,
-            vapid_claims=vapid_claims,
-            ttl=86400  # 24 hours TTL for push notifications
+        # The client parses the VAPID key once and reuses signed headers per push service
+        client = get_push_client(settings.VAPID_PRIVATE_KEY, settings.VAPID_CLAIM_EMAIL, pool_size=PUSH_FANOUT_WORKERS)
+        response = client.send(
+            subscription_info,
+            _build_payload(subscription, title, body, data, notification_type),
+            ttl=86400,  # 24 hours TTL for push notifications
+            timeout=PUSH_REQUEST_TIMEOUT,
         )
         
-        endpoint_type = 'Apple' if 'apple.com' in subscription.endpoint else 'Google' if 'googleapis.com' in subscription.endpoint else 'Other'
-        logger.info(f'Push notification sent successfully to {endpoint_type} endpoint for {subscription.user.username}: {subscription.endpoint[:50]}...')
-        return True
+        logger.info(f'Push notification sent successfully to {endpoint_type} endpoint for user {subscription.user_id}: {subscription.endpoint[:50]}...')
+        return PushResult(subscription, True, response.status_code, False, False, None)
         
     except WebPushException as e:
         logger.error(f'Web Push error: {e}')
-        # If subscription is invalid, delete it
-        if e.response and e.response.status_code == 410:
-            logger.info(f'Deleting invalid subscription for {subscription.user.username}')
-            subscription.delete()
-        return False
+        status_code = e.response.status_code if e.response is not None else None
+        return PushResult(
+            subscription, False, status_code,
+            status_code in PRUNE_STATUS_CODES,
+            status_code is None or status_code in RETRY_STATUS_CODES,
+            str(e)
+        )
     except Exception as e:
-        endpoint_type = 'Apple' if 'apple.com' in subscription.endpoint else 'Google' if 'googleapis.com' in subscription.endpoint else 'Other'
+        # Connection errors, timeouts etc. - worth another try later
         logger.error(f'Error sending push notification to {endpoint_type} endpoint ({subscription.endpoint[:50]}...): {e}', exc_info=True)
-        return False
+        return PushResult(subscription, False, None, False, True, str(e))
+
+
+def send_push_batch(subscriptions, title, body, data=None, notification_type=None):
+    """
+    Send the same notification to several subscriptions in parallel
+    
+    Returns one PushResult per subscription, in the same order. Results with
+    prune=True belong to subscriptions the push service has dropped; pass
+    the results to prune_subscriptions() to delete them.
+    """
+    subscriptions = list(subscriptions)
+    if len(subscriptions) <= 1:
+        return [_push_to_subscription(sub, title, body, data, notification_type) for sub in subscriptions]
+    
+    with ThreadPoolExecutor(max_workers=min(len(subscriptions), PUSH_FANOUT_WORKERS)) as executor:
+        return list(executor.map(
+            lambda sub: _push_to_subscription(sub, title, body, data, notification_type),
+            subscriptions
+        ))
+
+
+def prune_subscriptions(results):
+    """Delete the subscriptions that push services reported as gone"""
+    prune_ids = [result.subscription.id for result in results if result.prune]
+    if prune_ids:
+        logger.info(f'Deleting {len(prune_ids)} invalid push subscription(s)')
+        PushSubscription.objects.filter(id__in=prune_ids).delete()
+    return len(prune_ids)
+
+
+def send_push_notification(subscription, title, body, data=None, notification_type=None):
+    """
+    Send a push notification using Web Push API
+    
+    Args:
+        subscription: PushSubscription object
+        title: Notification title
+        body: Notification body
+        data: Optional data payload
+    """
+    result = _push_to_subscription(subscription, title, body, data, notification_type)
+    prune_subscriptions([result])
+    return result.success
+
+
+def summarize(notification_type, count):
+    """Emoji and phrase for count notifications of one type, e.g. ('❤️', 'liked 12 notes')"""
+    emoji, one, many = NOTIFICATION_SUMMARIES.get(
+        notification_type, ('💌', 'sent a notification', 'sent {count} notifications')
+    )
+    return emoji, one if count == 1 else many.format(count=count)
+
+
+def _merge_into_queued(recipient, sender, notification_type, status, body, data):
+    """
+    Fold a notification into an unsent outbox row with the same recipient,
+    sender and type; returns that row, or None if there is none to merge into
+    """
+    queued = NotificationOutbox.objects.filter(
+        recipient=recipient, sender=sender, notification_type=notification_type, status=status, attempts=0,
+    ).order_by('-created_at').first()
+    if queued is None:
+        return None
+    count = queued.count + 1
+    emoji, summary = summarize(notification_type, count)
+    title = f'{emoji} {sender.username} {summary}'
+    # attempts=0: once a worker has claimed the row it is too late to change it
+    merged = NotificationOutbox.objects.filter(pk=queued.pk, status=status, attempts=0, count=queued.count).update(
+        count=count, title=title, body=body, data=data,
+    )
+    if not merged:
+        return None
+    queued.count, queued.title, queued.body, queued.data = count, title, body, data
+    return queued
 
 
 def send_notification_to_partner(user, notification_type, title, body, note_id=None, journal_date=None, recipient_user=None):
     """
-    Send notification to user's partner if they have notifications enabled
+    Queue a notification for user's partner
+    
+    Only the outbox row is written here so the API request doesn't wait on
+    push services; preference checks and delivery happen in
+    deliver_notification(), run by the process_notifications command.
+    
+    With NOTIFICATION_COALESCE_WINDOW set, new rows wait that many seconds
+    before they are due, and further notifications of the same type from
+    the same sender are merged into them until a worker picks them up
+    ("❤️ alex liked 12 notes"). Recipients with notification_digest on get their notifications
+    held for the daily digest (send_notification_digests) instead.
     
     Args:
         user: User who triggered the notification (author) - used to find partner
@@ -185,71 +222,365 @@ def send_notification_to_partner(user, notification_type, title, body, note_id=N
     
     if not target_user:
         logger.warning(f'No target user found for notification "{title}" from {user.username}')
-        return
+        return None
+    
+    data = {}
+    if note_id:
+        data['note_id'] = note_id
+    if journal_date:
+        data['journal_date'] = journal_date
+    
+    eager = getattr(settings, 'NOTIFICATION_QUEUE_EAGER', False)
+    window = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 0)
+    digest = get_route(target_user.pk).digest
+    status = 'digest' if digest else 'pending'
     
     try:
-        partner_profile = UserProfile.objects.filter(user=target_user).first()
-        if not partner_profile:
-            logger.warning(f'No profile found for target user {target_user.username} for notification "{title}"')
-            return
-        if not partner_profile.notifications_enabled:
-            logger.info(f'Notifications disabled for {target_user.username}, skipping notification "{title}"')
-            return
-        
-        # Check if this notification type is enabled
-        notification_enabled = {
-            'note_created': partner_profile.notify_note_created,
-            'note_updated': partner_profile.notify_note_updated,
-            'note_liked': partner_profile.notify_note_liked,
-            'note_deletion_requested': partner_profile.notify_note_deletion_requested,
-            'journal_created': partner_profile.notify_journal_created,
-            'journal_updated': partner_profile.notify_journal_updated,
-            'journal_deletion_requested': partner_profile.notify_journal_deletion_requested,
-            'journal_reminder': partner_profile.notify_journal_reminder,
-        }.get(notification_type, True)
-        
-        logger.info(f'Notification check for {target_user.username}: type={notification_type}, enabled={notification_enabled}, notify_note_liked={partner_profile.notify_note_liked}')
+        if digest or (window and not eager):
+            item = _merge_into_queued(target_user, user, notification_type, status, body, data)
+            if item is not None:
+                logger.info(f'Merged {notification_type} notification for {target_user.username} ({item.count} so far)')
+                return item
+        item = NotificationOutbox.objects.create(
+            recipient=target_user,
+            sender=user,
+            notification_type=notification_type,
+            title=title,
+            body=body,
+            data=data,
+            status=status,
+            next_attempt_at=timezone.now() + timedelta(seconds=0 if eager else window),
+        )
+    except Exception as e:
+        logger.error(f'Error queueing notification for {target_user.username}: {e}', exc_info=True)
+        return None
+    
+    if eager and not digest:
+        # Deliver once the row is committed, on a background thread rather
+        # than holding up the request (or an ASGI server's thread pool)
+        transaction.on_commit(lambda: _get_eager_executor().submit(_process_in_thread, item))
+    return item
+
+
+class RetryNotification(Exception):
+    """Delivery failed in a way that may succeed on a later attempt"""
+
+
+def deliver_notification(item):
+    """
+    Deliver a queued notification to all of the recipient's push subscriptions
+    
+    Returns 'sent', 'skipped' when the recipient has notifications (or this
+    type) turned off or has no subscriptions, or 'failed' when every
+    subscription was rejected for good. Raises RetryNotification when every
+    attempt failed but some may succeed later (timeouts, 429/5xx).
+    """
+    target_user = item.recipient
+    notification_type = item.notification_type
+    title = item.title
+    
+    # Profile flags and subscriptions, cached per recipient (see api/notification_routing.py)
+    route = get_route(target_user.pk)
+    if not route.has_profile:
+        logger.warning(f'No profile found for target user {target_user.username} for notification "{title}"')
+        return 'skipped'
+    if not route.notifications_enabled:
+        logger.info(f'Notifications disabled for {target_user.username}, skipping notification "{title}"')
+        return 'skipped'
+    
+    if not route.allows(notification_type):
+        logger.info(f'Notification type {notification_type} disabled for {target_user.username}, skipping')
+        return 'skipped'
+    
+    subscriptions = route.subscriptions
+    if not subscriptions:
+        logger.warning(f'No push subscriptions found for {target_user.username}. Notification "{title}" not sent.')
+        return 'skipped'
+    
+    logger.info(f'Sending notification "{title}" to {target_user.username}, found {len(subscriptions)} subscriptions')
+    
+    results = send_push_batch(subscriptions, title, item.body, item.data, notification_type=notification_type)
+    prune_subscriptions(results)
+    
+    sent_count = sum(1 for result in results if result.success)
+    for idx, result in enumerate(results, 1):
+        endpoint_type = _endpoint_type(result.subscription.endpoint)
+        if result.success:
+            logger.info(f'  ✅ Successfully sent to subscription {idx} ({endpoint_type})')
+        else:
+            logger.warning(f'  ❌ Failed to send to subscription {idx} ({endpoint_type}): {result.error}')
+    
+    logger.info(f'Notification "{title}" sent to {sent_count}/{len(subscriptions)} subscriptions for {target_user.username}')
+    if not sent_count:
+        if any(result.retryable for result in results):
+            raise RetryNotification(f'All {len(subscriptions)} subscription(s) failed')
+        return 'failed'
+    return 'sent'
+
+
+def process_notification(item):
+    """
+    Deliver one outbox item and record the outcome
+    
+    Failed deliveries are rescheduled with exponential backoff (plus jitter)
+    until NOTIFICATION_MAX_ATTEMPTS is reached, then marked failed.
+    """
+    try:
+        status = deliver_notification(item)
+    except Exception as e:
+        max_attempts = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+        if item.attempts >= max_attempts:
+            logger.error(f'Giving up on notification {item.id} after {item.attempts} attempts: {e}')
+            item.status = 'failed'
+        else:
+            base_delay = getattr(settings, 'NOTIFICATION_RETRY_BACKOFF', 30)
+            delay = base_delay * (2 ** max(item.attempts - 1, 0))
+            delay += random.uniform(0, delay / 2)
+            logger.warning(f'Notification {item.id} failed (attempt {item.attempts}), retrying in {delay:.0f}s: {e}')
+            item.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        item.last_error = str(e)
+        item.save(update_fields=['status', 'next_attempt_at', 'last_error'])
+        return item.status
+    
+    item.status = status
+    item.sent_at = timezone.now() if status == 'sent' else None
+    item.save(update_fields=['status', 'sent_at'])
+    return status
+
+
+def claim_due_notifications(limit):
+    """
+    Claim up to limit due outbox items for this worker
+    
+    Each item is claimed with a conditional UPDATE that bumps attempts and
+    pushes next_attempt_at out by a lease, so concurrent workers never pick
+    up the same item and items held by a crashed worker become due again
+    once the lease expires.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'NOTIFICATION_CLAIM_LEASE', 300))
+    candidates = NotificationOutbox.objects.filter(
+        status='pending', next_attempt_at__lte=now
+    ).values_list('id', 'attempts', 'next_attempt_at')[:limit]
+    
+    claimed_ids = []
+    for item_id, attempts, next_attempt_at in candidates:
+        claimed = NotificationOutbox.objects.filter(
+            id=item_id, status='pending', attempts=attempts, next_attempt_at=next_attempt_at
+        ).update(attempts=attempts + 1, next_attempt_at=now + lease)
+        if claimed:
+            claimed_ids.append(item_id)
+    return list(NotificationOutbox.objects.filter(id__in=claimed_ids).select_related('recipient'))
+
+
+_eager_executor = None
+_eager_executor_lock = threading.Lock()
+
+
+def _get_eager_executor():
+    global _eager_executor
+    with _eager_executor_lock:
+        if _eager_executor is None:
+            _eager_executor = ThreadPoolExecutor(max_workers=PUSH_FANOUT_WORKERS, thread_name_prefix='push')
+    return _eager_executor
+
+
+def _process_in_thread(item):
+    try:
+        return process_notification(item)
+    finally:
+        close_old_connections()
+
+
+def process_notification_queue(batch_size=100, workers=4):
+    """
+    Claim and deliver one batch of due notifications
+    
+    Deliveries run on a pool of at most `workers` threads so one slow push
+    service doesn't hold up the rest of the batch. Returns the number of
+    items processed.
+    """
+    items = claim_due_notifications(batch_size)
+    if not items:
+        return 0
+    if workers <= 1:
+        for item in items:
+            process_notification(item)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_process_in_thread, items))
+    return len(items)
+
+
+def send_due_journal_reminders(now=None):
+    """
+    Send journal reminders that are due at `now`
+    
+    Uses the indexed UserProfile.next_journal_reminder_at, so only due
+    profiles are loaded (with their subscriptions, in two queries). Each
+    profile is claimed by moving next_journal_reminder_at to the following
+    day with a conditional UPDATE before anything is sent; overlapping runs
+    therefore can't double-send, and a delayed run still picks up everything
+    that came due in the meantime. Reminders more than
+    JOURNAL_REMINDER_GRACE minutes late are rescheduled without sending.
+    
+    Returns (sent, skipped) counts of profiles.
+    """
+    now = now or timezone.now()
+    grace = timedelta(minutes=getattr(settings, 'JOURNAL_REMINDER_GRACE', 120))
+    title = '📔 Time to Write Your Journal'
+    body = "Don't forget to add today's journal entry! 💕"
+    
+    due_profiles = UserProfile.objects.filter(
+        next_journal_reminder_at__lte=now,
+        notifications_enabled=True,
+        notify_journal_reminder=True,
+    ).select_related('user').prefetch_related('user__push_subscriptions')
+    
+    sent_count = 0
+    skipped_count = 0
+    for profile in due_profiles:
+        scheduled_at = profile.next_journal_reminder_at
+        profile.last_journal_reminder_at = now
+        next_at = profile.compute_next_journal_reminder(after=max(now, scheduled_at))
+        claimed = UserProfile.objects.filter(
+            pk=profile.pk, next_journal_reminder_at=scheduled_at
+        ).update(next_journal_reminder_at=next_at, last_journal_reminder_at=now)
+        if not claimed:
+            # Another run got here first
+            continue
         
-        if not notification_enabled:
-            logger.info(f'Notification type {notification_type} disabled for {target_user.username}, skipping')
-            return
+        if now - scheduled_at > grace:
+            skipped_count += 1
+            logger.warning(f'Journal reminder for {profile.user.username} due at {scheduled_at} is too late, skipping')
+            continue
         
-        # Get target user's push subscriptions
-        subscriptions = PushSubscription.objects.filter(user=target_user)
+        subscriptions = list(profile.user.push_subscriptions.all())
+        if not subscriptions:
+            skipped_count += 1
+            logger.debug(f'No push subscriptions for {profile.user.username}, skipping reminder')
+            continue
         
-        # Log for debugging - show all subscriptions
-        logger.info(f'Sending notification "{title}" to {target_user.username} (triggered by {user.username}), found {subscriptions.count()} subscriptions')
+        results = send_push_batch(
+            subscriptions, title, body,
+            data={'reminder_type': 'journal'},
+            notification_type='journal_reminder'
+        )
+        prune_subscriptions(results)
+        if any(result.success for result in results):
+            sent_count += 1
+            logger.info(f'Journal reminder sent to {profile.user.username}')
+    
+    return sent_count, skipped_count
+
+
+def _join(phrases):
+    return phrases[0] if len(phrases) == 1 else f'{", ".join(phrases[:-1])} and {phrases[-1]}'
+
+
+def _digest_body(items):
+    """e.g. "alex wrote 3 new notes and liked 5 notes" (one sentence per sender)"""
+    counts = defaultdict(lambda: defaultdict(int))
+    for item in items:
+        sender = item.sender.username if item.sender else 'Your partner'
+        counts[sender][item.notification_type] += item.count
+    return ' '.join(
+        f'{sender} {_join([summarize(notification_type, count)[1] for notification_type, count in types.items()])}.'
+        for sender, types in counts.items()
+    )
+
+
+def _claim_held(items):
+    """
+    Claim held digest rows one at a time for this run
+
+    Like claim_due_notifications(), each row is claimed with a conditional
+    UPDATE that bumps attempts and pushes next_attempt_at out by a lease;
+    the rows stay held until they are sent, and come back to the next run
+    if this one dies. Returns only the rows claimed here (another run may
+    have taken some), re-read so counts merged into them before the claim
+    are included.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'NOTIFICATION_CLAIM_LEASE', 300))
+    claimed_ids = [
+        item.id for item in items
+        if NotificationOutbox.objects.filter(
+            id=item.id, status='digest', attempts=item.attempts, next_attempt_at=item.next_attempt_at
+        ).update(attempts=item.attempts + 1, next_attempt_at=now + lease)
+    ]
+    if not claimed_ids:
+        return []
+    return list(
+        NotificationOutbox.objects.filter(id__in=claimed_ids).select_related('sender', 'recipient').order_by('created_at')
+    )
+
+
+def _release_held(items):
+    """
+    Hand claimed digest rows back to the next digest run, or mark them
+    failed once they have been tried NOTIFICATION_MAX_ATTEMPTS times
+    """
+    max_attempts = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+    ids = [item.id for item in items]
+    NotificationOutbox.objects.filter(id__in=ids, attempts__gte=max_attempts).update(status='failed')
+    NotificationOutbox.objects.filter(id__in=ids, status='digest').update(next_attempt_at=timezone.now())
+
+
+def send_notification_digests():
+    """
+    Send each digest recipient one push summing up the notifications held
+    for them (status 'digest') since the last digest
+    
+    Held rows are claimed one by one before anything is sent, so
+    overlapping runs can't send a row twice; only the rows claimed by this
+    run go into the digest. They are marked sent once a push got through.
+    If none did, or the recipient has no subscriptions, they are handed
+    back and go into the next digest instead. Types the recipient has
+    turned off in the meantime are left out (marked skipped).
+    
+    Returns (sent, skipped) counts of recipients.
+    """
+    # Rows never claimed, or whose claim was released or has run out
+    unclaimed = Q(attempts=0) | Q(next_attempt_at__lte=timezone.now())
+    held = defaultdict(list)
+    for item in NotificationOutbox.objects.filter(unclaimed, status='digest').select_related('sender', 'recipient').order_by('created_at'):
+        held[item.recipient_id].append(item)
+    
+    sent_count = 0
+    skipped_count = 0
+    for recipient_id, items in held.items():
+        items = _claim_held(items)
+        if not items:
+            # Another run got here first
+            continue
         
-        # Log each subscription endpoint for debugging
-        for idx, sub in enumerate(subscriptions, 1):
-            endpoint_type = 'Apple' if 'apple.com' in sub.endpoint else 'Google' if 'googleapis.com' in sub.endpoint else 'Other'
-            logger.info(f'  Subscription {idx}: {endpoint_type} - {sub.endpoint[:60]}...')
+        route = get_route(recipient_id)
+        turned_off = [item.id for item in items if not route.allows(item.notification_type)]
+        if turned_off:
+            NotificationOutbox.objects.filter(id__in=turned_off).update(status='skipped')
+        items = [item for item in items if item.id not in turned_off]
+        if not items:
+            skipped_count += 1
+            continue
+        if not route.subscriptions:
+            _release_held(items)
+            skipped_count += 1
+            continue
         
-        # Send push notification to all subscriptions if they exist
-        if subscriptions.exists():
-            data = {}
-            if note_id:
-                data['note_id'] = note_id
-            if journal_date:
-                data['journal_date'] = journal_date
-            
-            sent_count = 0
-            failed_count = 0
-            for idx, subscription in enumerate(subscriptions, 1):
-                endpoint_type = 'Apple' if 'apple.com' in subscription.endpoint else 'Google' if 'googleapis.com' in subscription.endpoint else 'Other'
-                logger.info(f'  Attempting to send to subscription {idx} ({endpoint_type})...')
-                
-                if send_push_notification(subscription, title, body, data, notification_type=notification_type):
-                    sent_count += 1
-                    logger.info(f'  ✅ Successfully sent to subscription {idx} ({endpoint_type})')
-                else:
-                    failed_count += 1
-                    logger.warning(f'  ❌ Failed to send to subscription {idx} ({endpoint_type})')
-            
-            logger.info(f'Notification "{title}" sent to {sent_count}/{subscriptions.count()} subscriptions for {target_user.username} (failed: {failed_count})')
+        results = send_push_batch(
+            route.subscriptions, '💌 Your daily digest', _digest_body(items),
+            data={'digest': True},
+            notification_type='digest'
+        )
+        prune_subscriptions(results)
+        if any(result.success for result in results):
+            NotificationOutbox.objects.filter(id__in=[item.id for item in items]).update(status='sent', sent_at=timezone.now())
+            sent_count += 1
+            logger.info(f'Notification digest of {len(items)} item(s) sent to {items[0].recipient.username}')
         else:
-            logger.warning(f'No push subscriptions found for {target_user.username}. Notification "{title}" not sent.')
-        
-    except Exception as e:
-        logger.error(f'Error sending notification to partner: {e}', exc_info=True)
-
+            logger.warning(f'Notification digest for {items[0].recipient.username} failed, keeping it for the next run')
+            _release_held(items)
+            skipped_count += 1
+    
+    return sent_count, skipped_count
@@ -0,0 +1,37 @@
+"""
+Cursor (keyset) pagination for the notes and journal list endpoints
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Keyset pagination that only kicks in when the client asks for it.
+
+    Requests without ``cursor`` or ``page_size`` keep getting the full list,
+    so existing clients are unaffected. Pages are positioned on the ordering
+    value of the last row rather than an offset, which keeps them stable
+    while new rows are being inserted.
+    """
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'API_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 200)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class NoteCursorPagination(OptionalCursorPagination):
+    # Matches Note.Meta.ordering; id breaks ties between equal timestamps
+    ordering = ('-updated_at', '-id')
+
+
+class JournalEntryCursorPagination(OptionalCursorPagination):
+    # Matches JournalEntry.Meta.ordering
+    ordering = ('-date', '-created_at', '-id')
@@ -0,0 +1,160 @@
+"""
+Long-lived Web Push client
+
+Parses the VAPID private key once, caches signed VAPID headers per push
+service and keeps one pooled HTTP session per push service, instead of
+redoing all of that inside pywebpush.webpush() for every message.
+"""
+from urllib.parse import urlparse
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pywebpush
+    from pywebpush import WebPusher, WebPushException
+    import requests
+    WEBPUSH_AVAILABLE = True
+except ImportError:
+    WEBPUSH_AVAILABLE = False
+    WebPushException = None
+    logger.warning('pywebpush not installed. Web Push notifications will not work.')
+
+try:
+    from py_vapid import Vapid
+    VAPID_AVAILABLE = True
+except ImportError:
+    VAPID_AVAILABLE = False
+    Vapid = None
+    logger.warning('py-vapid not installed. VAPID key handling may not work correctly.')
+
+
+if WEBPUSH_AVAILABLE:
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    class _CurveInstanceEC:
+        """
+        Stand-in for the `ec` module as seen from inside pywebpush
+
+        pywebpush 1.14.0 calls ec.generate_private_key(ec.SECP256R1, ...) with
+        the curve class instead of an instance, which newer cryptography
+        releases reject. Rebinding pywebpush's module reference once (rather
+        than swapping ec.generate_private_key in and out around every call)
+        keeps the fix thread-safe and leaves cryptography itself untouched.
+        """
+        def __getattr__(self, name):
+            return getattr(ec, name)
+
+        @staticmethod
+        def generate_private_key(curve, backend=None):
+            # If curve is a class instead of instance, instantiate it
+            if isinstance(curve, type):
+                curve = curve()
+            return ec.generate_private_key(curve, backend)
+
+    pywebpush.ec = _CurveInstanceEC()
+
+
+def _origin(endpoint):
+    url = urlparse(endpoint)
+    return f'{url.scheme}://{url.netloc}'
+
+
+class PushClient:
+    """
+    Sends Web Push messages signed with one VAPID key
+
+    Thread-safe; create one per process (see get_push_client()) and share it.
+    """
+    # pywebpush signs VAPID tokens for 12 hours; push services reject
+    # anything longer than 24
+    VAPID_TOKEN_LIFETIME = 12 * 60 * 60
+    # Re-sign this long before the cached token expires
+    VAPID_REFRESH_MARGIN = 10 * 60
+
+    def __init__(self, private_key, claim_email, pool_size=8):
+        if not VAPID_AVAILABLE or Vapid is None:
+            raise ImportError('py-vapid not available. Install it with: pip install py-vapid')
+        # py-vapid's from_string() only needs private_key
+        # Public key is derived from private key automatically
+        self.vapid = Vapid.from_string(private_key=private_key)
+        self.claim_email = claim_email
+        self.pool_size = pool_size
+        self._vapid_headers = {}  # origin -> (expires_at, headers)
+        self._sessions = {}  # origin -> requests.Session
+        self._lock = threading.Lock()
+
+    def vapid_headers(self, endpoint):
+        """Signed VAPID headers for the push service hosting endpoint, cached until shortly before expiry"""
+        origin = _origin(endpoint)
+        now = time.time()
+        cached = self._vapid_headers.get(origin)
+        if cached and cached[0] - self.VAPID_REFRESH_MARGIN > now:
+            return cached[1]
+
+        expires_at = int(now) + self.VAPID_TOKEN_LIFETIME
+        headers = self.vapid.sign({
+            'sub': self.claim_email,
+            'aud': origin,
+            'exp': expires_at,
+        })
+        with self._lock:
+            self._vapid_headers[origin] = (expires_at, headers)
+        return headers
+
+    def session(self, endpoint):
+        """Shared keep-alive session for the push service hosting endpoint"""
+        origin = _origin(endpoint)
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(urlparse(endpoint).scheme + '://', adapter)
+                self._sessions[origin] = session
+        return session
+
+    def send(self, subscription_info, data, ttl=0, timeout=None, curl=False):
+        """
+        Encrypt data for subscription_info and POST it to the push service
+
+        Raises WebPushException for any response other than 2xx (same as
+        pywebpush.webpush()). With curl=True nothing is sent and the
+        equivalent curl command is returned, which is handy for benchmarks.
+        """
+        endpoint = subscription_info['endpoint']
+        # WebPusher.send() adds the ttl header to the dict it's given
+        headers = dict(self.vapid_headers(endpoint))
+        response = WebPusher(
+            subscription_info, requests_session=self.session(endpoint)
+        ).send(data, headers, ttl=ttl, timeout=timeout, curl=curl)
+        if not curl and response.status_code > 202:
+            raise WebPushException("Push failed: {} {}\nResponse body:{}".format(
+                response.status_code, response.reason, response.text),
+                response=response)
+        return response
+
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_push_client(private_key, claim_email, pool_size=8):
+    """
+    Process-wide PushClient for the given VAPID key
+
+    Built on first use and reused afterwards; a new client is only created
+    if the key or claim email changes.
+    """
+    global _client, _client_key
+    key = (private_key, claim_email)
+    if _client is not None and _client_key == key:
+        return _client
+    with _client_lock:
+        if _client is None or _client_key != key:
+            _client = PushClient(private_key, claim_email, pool_size=pool_size)
+            _client_key = key
+    return _client
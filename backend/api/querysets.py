@@ -0,0 +1,80 @@
+"""
+Index-friendly querysets for the couple-visible list endpoints
+
+A list shows the user's own rows plus the partner's shared rows. Written
+as one `author = me OR (author = partner AND is_shared)` filter, SQLite
+can't read the rows in list order from an index: it collects every
+matching row (computing the like-count subqueries for each one) and sorts
+them in a temp B-tree before a page can be cut off. Split into one arm
+per author and combined with UNION ALL, each arm is a single range of an
+(author, <ordering>) index that is already in order, so SQLite merges the
+two streams and stops as soon as the page is full.
+"""
+from .couple import couple_for
+
+
+class AuthorUnionQuerySet:
+    """
+    UNION ALL of per-author querysets that reads like one queryset
+
+    Implements the part of the QuerySet API that the list views, search
+    filtering and CursorPagination use: filter(), exclude(), order_by(),
+    slicing, iteration and count(). Every arm must select the same columns
+    (same annotations/select_related), which visible_to() guarantees;
+    the first arm's prefetch_related lookups apply to the combined rows.
+    """
+
+    def __init__(self, arms, ordering=None):
+        self.arms = list(arms)
+        self.model = self.arms[0].model
+        self.ordering = tuple(ordering or self.model._meta.ordering)
+
+    def _clone(self, arms=None, ordering=None):
+        return AuthorUnionQuerySet(arms or self.arms, ordering or self.ordering)
+
+    def all(self):
+        return self._clone()
+
+    def filter(self, *args, **kwargs):
+        return self._clone(arms=[arm.filter(*args, **kwargs) for arm in self.arms])
+
+    def exclude(self, *args, **kwargs):
+        return self._clone(arms=[arm.exclude(*args, **kwargs) for arm in self.arms])
+
+    def order_by(self, *fields):
+        return self._clone(ordering=fields)
+
+    def count(self):
+        return sum(arm.count() for arm in self.arms)
+
+    def exists(self):
+        return any(arm.exists() for arm in self.arms)
+
+    def combined(self):
+        """The single SQL query: arms UNION ALL'd, ordered as a whole"""
+        if len(self.arms) == 1:
+            return self.arms[0].order_by(*self.ordering)
+        # Compound-statement arms may not carry their own ORDER BY
+        first, *rest = [arm.order_by() for arm in self.arms]
+        return first.union(*rest, all=True).order_by(*self.ordering)
+
+    def __getitem__(self, k):
+        return self.combined()[k]
+
+    def __iter__(self):
+        return iter(self.combined())
+
+    def __len__(self):
+        return len(self.combined())
+
+
+def visible_to(queryset, user):
+    """
+    Rows of queryset visible to user, as an AuthorUnionQuerySet: own rows
+    plus the partner's shared rows
+    """
+    partner = couple_for(user).partner
+    arms = [queryset.filter(author=user)]
+    if partner:
+        arms.append(queryset.filter(author=partner, is_shared=True))
+    return AuthorUnionQuerySet(arms)
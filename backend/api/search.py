@@ -0,0 +1,448 @@
+"""
+Full-text search for notes and journal entries
+
+Notes and entries hold rich-text HTML, so the index stores HTML-stripped
+title/body text. On SQLite builds with FTS5 the index is the
+api_search_fts virtual table (ranked with bm25, snippets from FTS5); on
+PostgreSQL it is a GIN index over a tsvector of the rows themselves;
+elsewhere it falls back to an inverted index in the SearchTerm table. The
+FTS5 and SearchTerm indexes are kept in sync by post_save/post_delete
+signals and can be rebuilt with `python manage.py rebuild_search_index`.
+"""
+from collections import Counter, namedtuple
+from html import escape, unescape
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.html import strip_tags
+from .models import Note, JournalEntry, SearchTerm
+import logging
+import math
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'api_search_fts'
+
+# Text search configuration of the PostgreSQL index: no stemming or stop
+# words, so prefix queries behave like the other backends'
+POSTGRES_SEARCH_CONFIG = 'simple'
+
+# Index kind for each searchable model
+SEARCH_KINDS = {
+    Note: 'note',
+    JournalEntry: 'journal',
+}
+
+# search_type query parameter -> indexed fields
+SEARCH_FIELDS = {
+    'title': ('title',),
+    'content': ('body',),
+    'both': ('title', 'body'),
+}
+
+TITLE_WEIGHT = 10.0
+SNIPPET_WORDS = 16
+MAX_TERM_LENGTH = 100
+
+# Highlight markers; the snippet text is HTML-escaped before they become <mark> tags
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_BLOCK_TAG_RE = re.compile(r'<\s*(br|/p|/div|/li|/h[1-6]|/blockquote|/tr)\b[^>]*>', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\w+')
+
+SearchHit = namedtuple('SearchHit', ['object_id', 'rank', 'title', 'snippet'])
+
+
+def html_to_text(html):
+    """Plain text of rich-text HTML, with block boundaries kept as spaces"""
+    if not html:
+        return ''
+    text = strip_tags(_BLOCK_TAG_RE.sub(' ', html))
+    return _WHITESPACE_RE.sub(' ', unescape(text)).strip()
+
+
+def tokenize(text):
+    """Lowercased, accent-folded words (matches FTS5's unicode61 remove_diacritics tokenizer)"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [word[:MAX_TERM_LENGTH] for word in _WORD_RE.findall(text)]
+
+
+def search_vector():
+    """
+    Weighted tsvector of a note/entry row: title as A, content as B
+
+    The GIN indexes from migration 0016 are built over a copy of exactly
+    this expression, which PostgreSQL needs to match to use them; changing
+    it needs a migration that rebuilds them. HTML tags in
+    the content are skipped by PostgreSQL's parser.
+    """
+    return (
+        SearchVector('title', weight='A', config=POSTGRES_SEARCH_CONFIG)
+        + SearchVector('content', weight='B', config=POSTGRES_SEARCH_CONFIG)
+    )
+
+
+def _document(instance):
+    return html_to_text(instance.title), html_to_text(instance.content)
+
+
+def _render_marks(text):
+    """Escape text for HTML and turn highlight markers into <mark> tags"""
+    return escape(text).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _ids_subquery(queryset):
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    return sql, list(params)
+
+
+class FTS5SearchBackend:
+    """SQLite FTS5 index in the api_search_fts virtual table"""
+    name = 'fts5'
+    tokenize = staticmethod(tokenize)
+
+    def index(self, kind, object_id, title, body):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE kind = %s AND object_id = %s', [kind, object_id])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (title, body, kind, object_id) VALUES (%s, %s, %s, %s)',
+                [title, body, kind, object_id]
+            )
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE kind = %s AND object_id = %s', [kind, object_id])
+
+    def clear(self, kind):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE kind = %s', [kind])
+
+    def _match_expression(self, terms, fields):
+        # Every term must match (implicit AND); each is a quoted prefix query
+        columns = ' '.join(fields)
+        return '{%s} : (%s)' % (columns, ' '.join(f'"{term}"*' for term in terms))
+
+    def search(self, kind, terms, queryset, fields, limit):
+        ids_sql, ids_params = _ids_subquery(queryset)
+        sql = (
+            f'SELECT object_id, bm25({FTS_TABLE}, %s, 1.0) AS rank, '
+            f'highlight({FTS_TABLE}, 0, %s, %s), '
+            f'snippet({FTS_TABLE}, 1, %s, %s, %s, %s) '
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND kind = %s AND object_id IN ({ids_sql}) '
+            f'ORDER BY rank'
+        )
+        params = [
+            TITLE_WEIGHT, _MARK_START, _MARK_END,
+            _MARK_START, _MARK_END, '…', SNIPPET_WORDS,
+            self._match_expression(terms, fields), kind, *ids_params,
+        ]
+        if limit:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        # bm25() is lower-is-better; report higher-is-better like the fallback
+        return [
+            SearchHit(object_id, -rank, _render_marks(title), _render_marks(snippet))
+            for object_id, rank, title, snippet in rows
+        ]
+
+    def search_ids(self, kind, terms, queryset, fields):
+        ids_sql, ids_params = _ids_subquery(queryset)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT object_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND kind = %s '
+                f'AND object_id IN ({ids_sql})',
+                [self._match_expression(terms, fields), kind, *ids_params]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class InvertedIndexSearchBackend:
+    """Term -> document index in the SearchTerm table, ranked with tf-idf"""
+    name = 'inverted_index'
+    tokenize = staticmethod(tokenize)
+
+    def __init__(self, term_model=SearchTerm):
+        self.term_model = term_model
+
+    def index(self, kind, object_id, title, body):
+        self.remove(kind, object_id)
+        rows = []
+        for field, text in (('title', title), ('body', body)):
+            for term, frequency in Counter(tokenize(text)).items():
+                rows.append(self.term_model(
+                    kind=kind, object_id=object_id, field=field, term=term, frequency=frequency
+                ))
+        self.term_model.objects.bulk_create(rows)
+
+    def remove(self, kind, object_id):
+        self.term_model.objects.filter(kind=kind, object_id=object_id).delete()
+
+    def clear(self, kind):
+        self.term_model.objects.filter(kind=kind).delete()
+
+    def _scores(self, kind, terms, queryset, fields):
+        """object_id -> score for documents matching every term (as a prefix)"""
+        visible_ids = queryset.order_by().values('pk')
+        total = max(queryset.count(), 1)
+        scores = None
+        for term in terms:
+            matches = self.term_model.objects.filter(
+                kind=kind, field__in=fields,
+                # Range instead of startswith so the (kind, term) index is used
+                term__gte=term, term__lt=term + '\uffff',
+                object_id__in=visible_ids,
+            ).values_list('object_id', 'field', 'frequency')
+            term_scores = {}
+            for object_id, field, frequency in matches:
+                weight = TITLE_WEIGHT if field == 'title' else 1.0
+                term_scores[object_id] = term_scores.get(object_id, 0) + weight * frequency
+            if not term_scores:
+                return {}
+            idf = math.log(1 + total / len(term_scores))
+            if scores is None:
+                scores = {object_id: score * idf for object_id, score in term_scores.items()}
+            else:
+                scores = {
+                    object_id: scores[object_id] + score * idf
+                    for object_id, score in term_scores.items() if object_id in scores
+                }
+            if not scores:
+                return {}
+        return scores or {}
+
+    def _highlight(self, text, terms, window=None):
+        words = text.split(' ')
+        matches = [
+            any(token.startswith(term) for token in tokenize(word) for term in terms)
+            for word in words
+        ]
+        start, end = 0, len(words)
+        if window and len(words) > window:
+            first = matches.index(True) if True in matches else 0
+            start = max(0, min(first - window // 4, len(words) - window))
+            end = start + window
+        marked = [
+            f'{_MARK_START}{word}{_MARK_END}' if matched else word
+            for word, matched in zip(words[start:end], matches[start:end])
+        ]
+        snippet = ' '.join(marked)
+        if start > 0:
+            snippet = '…' + snippet
+        if end < len(words):
+            snippet += '…'
+        return _render_marks(snippet)
+
+    def search(self, kind, terms, queryset, fields, limit):
+        scores = self._scores(kind, terms, queryset, fields)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        if limit:
+            ranked = ranked[:limit]
+        documents = {
+            row['pk']: row for row in
+            queryset.model.objects.filter(pk__in=[object_id for object_id, _ in ranked]).values('pk', 'title', 'content')
+        }
+        hits = []
+        for object_id, score in ranked:
+            document = documents.get(object_id)
+            if document is None:
+                continue
+            hits.append(SearchHit(
+                object_id, score,
+                self._highlight(html_to_text(document['title']), terms),
+                self._highlight(html_to_text(document['content']), terms, window=SNIPPET_WORDS),
+            ))
+        return hits
+
+    def search_ids(self, kind, terms, queryset, fields):
+        return list(self._scores(kind, terms, queryset, fields))
+
+
+class PostgresSearchBackend:
+    """
+    PostgreSQL full-text search over search_vector() of the rows themselves
+
+    Nothing is stored besides the GIN index PostgreSQL maintains, so
+    index(), remove() and clear() have nothing to do. search_type becomes
+    a weight restriction in the tsquery (title -> A, content -> B), letting
+    the one index serve all three.
+    """
+    name = 'postgres'
+    maintained_by_database = True
+    FIELD_WEIGHTS = {('title',): 'A', ('body',): 'B'}
+    # [D, C, B, A]: a title match counts TITLE_WEIGHT times a content match
+    RANK_WEIGHTS = [0.1, 0.1, 0.1, 0.1 * TITLE_WEIGHT]
+
+    def tokenize(self, text):
+        # The 'simple' configuration lowercases but keeps accents
+        return [word[:MAX_TERM_LENGTH] for word in _WORD_RE.findall(text.lower())]
+
+    def index(self, kind, object_id, title, body):
+        pass
+
+    def remove(self, kind, object_id):
+        pass
+
+    def clear(self, kind):
+        pass
+
+    def _query(self, terms, fields):
+        # Every term must match (AND), each as a prefix; terms are \w+ so safe in tsquery syntax
+        weight = self.FIELD_WEIGHTS.get(tuple(fields), '')
+        return SearchQuery(
+            ' & '.join(f'{term}:*{weight}' for term in terms), search_type='raw', config=POSTGRES_SEARCH_CONFIG
+        )
+
+    def _matching(self, terms, queryset, fields):
+        query = self._query(terms, fields)
+        return queryset.annotate(search_vector=search_vector()).filter(search_vector=query), query
+
+    def search(self, kind, terms, queryset, fields, limit):
+        matching, query = self._matching(terms, queryset, fields)
+        # ts_headline doesn't know the weights; highlight every term anywhere
+        highlight = SearchQuery(
+            ' | '.join(f'{term}:*' for term in terms), search_type='raw', config=POSTGRES_SEARCH_CONFIG
+        )
+        headline_options = {
+            'config': POSTGRES_SEARCH_CONFIG, 'start_sel': _MARK_START, 'stop_sel': _MARK_END,
+        }
+        rows = matching.annotate(
+            rank=SearchRank(F('search_vector'), query, weights=self.RANK_WEIGHTS),
+            title_headline=SearchHeadline('title', highlight, highlight_all=True, **headline_options),
+            snippet=SearchHeadline(
+                'content', highlight, max_words=SNIPPET_WORDS, min_words=SNIPPET_WORDS // 2,
+                **headline_options
+            ),
+        ).order_by('-rank', '-pk').values_list('pk', 'rank', 'title_headline', 'snippet')
+        if limit:
+            rows = rows[:limit]
+        # Headlines are cut from the HTML; strip the tags, keeping the markers
+        return [
+            SearchHit(object_id, rank, _render_marks(html_to_text(title)), _render_marks(html_to_text(snippet)))
+            for object_id, rank, title, snippet in rows
+        ]
+
+    def search_ids(self, kind, terms, queryset, fields):
+        matching, _ = self._matching(terms, queryset, fields)
+        return list(matching.values_list('pk', flat=True))
+
+
+_fts5_tables = {}
+
+
+def fts5_available():
+    """Whether the current database has the api_search_fts table (SQLite with FTS5)"""
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name not in _fts5_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts5_tables[name] = cursor.fetchone() is not None
+    return _fts5_tables[name]
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if fts5_available():
+        return FTS5SearchBackend()
+    return InvertedIndexSearchBackend()
+
+
+def index_instance(instance):
+    kind = SEARCH_KINDS[type(instance)]
+    title, body = _document(instance)
+    get_search_backend().index(kind, instance.pk, title, body)
+
+
+def index_instances(instances):
+    """Index notes/entries saved without signals (bulk_create)"""
+    backend = get_search_backend()
+    for instance in instances:
+        title, body = _document(instance)
+        backend.index(SEARCH_KINDS[type(instance)], instance.pk, title, body)
+
+
+def remove_instance(instance):
+    get_search_backend().remove(SEARCH_KINDS[type(instance)], instance.pk)
+
+
+def rebuild_index(backend=None, sources=None):
+    """
+    Re-index every note and journal entry; returns the number of documents indexed
+
+    sources is a list of (kind, model) pairs, for callers (migrations) that
+    need to pass their own model classes.
+    """
+    backend = backend or get_search_backend()
+    sources = sources or [(kind, model) for model, kind in SEARCH_KINDS.items()]
+    if getattr(backend, 'maintained_by_database', False):
+        return sum(model.objects.count() for _, model in sources)
+    count = 0
+    for kind, model in sources:
+        backend.clear(kind)
+        for object_id, title, content in model.objects.values_list('pk', 'title', 'content').iterator():
+            backend.index(kind, object_id, html_to_text(title), html_to_text(content))
+            count += 1
+    return count
+
+
+def search(queryset, query, search_type='both', limit=20):
+    """
+    Ranked search within queryset (the notes/entries the user may see)
+
+    Returns SearchHits, best first. `title` and `snippet` are HTML-escaped
+    text with matches wrapped in <mark>.
+    """
+    backend = get_search_backend()
+    terms = backend.tokenize(query or '')
+    if not terms:
+        return []
+    kind = SEARCH_KINDS[queryset.model]
+    fields = SEARCH_FIELDS.get(search_type, SEARCH_FIELDS['both'])
+    return backend.search(kind, terms, queryset, fields, limit)
+
+
+def search_ids(queryset, query, search_type='both'):
+    """Ids of every document in queryset matching query, unranked"""
+    backend = get_search_backend()
+    terms = backend.tokenize(query or '')
+    if not terms:
+        return []
+    kind = SEARCH_KINDS[queryset.model]
+    fields = SEARCH_FIELDS.get(search_type, SEARCH_FIELDS['both'])
+    return backend.search_ids(kind, terms, queryset, fields)
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=JournalEntry)
+def update_search_index(sender, instance, **kwargs):
+    try:
+        # In a savepoint, so a database error rolls back only the index
+        # write and leaves the save's transaction usable (PostgreSQL aborts
+        # the whole transaction otherwise)
+        with transaction.atomic():
+            index_instance(instance)
+    except Exception as e:
+        # Never fail a save because of the search index; rebuild_search_index repairs it
+        logger.error(f'Error indexing {sender.__name__} {instance.pk} for search: {e}', exc_info=True)
+
+
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=JournalEntry)
+def remove_from_search_index(sender, instance, **kwargs):
+    try:
+        with transaction.atomic():
+            remove_instance(instance)
+    except Exception as e:
+        logger.error(f'Error removing {sender.__name__} {instance.pk} from search index: {e}', exc_info=True)
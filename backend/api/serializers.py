@@ -1,23 +1,115 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
+from django.utils.text import Truncator
 from .models import User, Note, JournalEntry, PartnerRequest, UserProfile, NoteLike, PushSubscription
+from .search import html_to_text
 
 
-class UserSerializer(serializers.ModelSerializer):
+def _query_param_set(request, name):
+    """Comma-separated query parameter as a set of names; None if absent"""
+    if request is None:
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    if name not in params:
+        return None
+    return {part.strip() for part in params[name].split(',') if part.strip()}
+
+
+def requested_fields(request):
+    """Field names picked with ?fields= on a read request; None when all fields are wanted"""
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None
+    return _query_param_set(request, 'fields')
+
+
+def requested_expansions(request):
+    """Related fields named in ?expand= (only meaningful alongside ?fields=)"""
+    return _query_param_set(request, 'expand') or set()
+
+
+def wants_summary(request):
+    """Whether a read request asked for the compact representation (?view=summary)"""
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return False
+    params = getattr(request, 'query_params', request.GET)
+    return params.get('view') == 'summary'
+
+
+def preview_text(html):
+    """HTML-stripped text of html, cut to SUMMARY_PREVIEW_LENGTH characters"""
+    return Truncator(html_to_text(html)).chars(getattr(settings, 'SUMMARY_PREVIEW_LENGTH', 140))
+
+
+class SparseFieldsMixin:
+    """
+    Field selection for the top-level serializer of a read request
+
+    ?fields=id,title,author keeps only the named fields. With ?fields=
+    given, the related users listed in expandable_fields come out as their
+    ids unless they are also named in ?expand=. Without ?fields= the
+    representation is unchanged. Selection can also be passed directly as
+    fields=/expand= keyword arguments.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._selected_fields = set(fields) if fields is not None else None
+        self._expanded_fields = set(expand) if expand is not None else None
+
+    def _is_top_level(self):
+        # Either the root serializer or the child of a root many=True list
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_field_selection(self):
+        """(selected, expanded) field names; selected is None when all fields are wanted"""
+        if not self._is_top_level():
+            return None, set()
+        request = self.context.get('request')
+        selected = self._selected_fields
+        if selected is None:
+            selected = requested_fields(request)
+        expanded = self._expanded_fields
+        if expanded is None:
+            expanded = requested_expansions(request)
+        return selected, expanded
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected, expanded = self.get_field_selection()
+        if selected is None:
+            return fields
+        for name in list(fields):
+            if name not in selected:
+                del fields[name]
+            elif name in self.expandable_fields and name not in expanded:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     partner = serializers.SerializerMethodField()
+    expandable_fields = ('partner',)
     
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'partner_code', 'partner')
     
     def get_partner(self, obj):
-        if obj.partner:
-            return {
-                'id': obj.partner.id,
-                'username': obj.partner.username,
-                'email': obj.partner.email,
-            }
-        return None
+        if not obj.partner_id:
+            return None
+        # Members of the request's couple (api/couple.py) have their partner loaded already
+        request = self.context.get('request')
+        couple = getattr(getattr(request, 'user', None), 'couple', None)
+        partner = couple.partner_of(obj.pk) if couple and couple.includes(obj.pk) else None
+        partner = partner or obj.partner
+        return {
+            'id': partner.id,
+            'username': partner.username,
+            'email': partner.email,
+        }
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -54,15 +146,27 @@ class NoteLikeSerializer(serializers.ModelSerializer):
         read_only_fields = ('user', 'created_at')
 
 
-class NoteSerializer(serializers.ModelSerializer):
+class SyncNoteLikeSerializer(NoteLikeSerializer):
+    """Likes sent on their own by /api/sync/, so they carry their note's id"""
+    class Meta(NoteLikeSerializer.Meta):
+        fields = NoteLikeSerializer.Meta.fields + ('note',)
+        read_only_fields = NoteLikeSerializer.Meta.read_only_fields + ('note',)
+
+
+# Related users on notes and journal entries, nested in full by default
+RELATED_USER_FIELDS = ('author', 'deletion_requested_by', 'deletion_approved_by', 'edit_requested_by', 'edit_approved_by')
+
+
+class NoteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     deletion_requested_by = UserSerializer(read_only=True)
     deletion_approved_by = UserSerializer(read_only=True)
     edit_requested_by = UserSerializer(read_only=True)
     edit_approved_by = UserSerializer(read_only=True)
     likes = serializers.SerializerMethodField()
-    like_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(read_only=True)
     is_liked_by_current_user = serializers.SerializerMethodField()
+    expandable_fields = RELATED_USER_FIELDS
     
     class Meta:
         model = Note
@@ -79,17 +183,12 @@ class NoteSerializer(serializers.ModelSerializer):
             # Handle case where NoteLike table doesn't exist yet (migration not run)
             return []
     
-    def get_like_count(self, obj):
-        try:
-            return obj.likes.count()
-        except Exception:
-            # Handle case where NoteLike table doesn't exist yet (migration not run)
-            return 0
-    
     def get_is_liked_by_current_user(self, obj):
         try:
             request = self.context.get('request')
             if request and request.user.is_authenticated:
+                if hasattr(obj, 'annotated_is_liked'):
+                    return obj.annotated_is_liked
                 return obj.likes.filter(user=request.user).exists()
         except Exception:
             # Handle case where NoteLike table doesn't exist yet (migration not run)
@@ -97,12 +196,34 @@ class NoteSerializer(serializers.ModelSerializer):
         return False
 
 
-class JournalEntrySerializer(serializers.ModelSerializer):
+class NoteSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact note for title lists (?view=summary): a short plain-text preview
+    instead of the HTML content, user ids instead of nested users, no likes
+    """
+    preview = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(read_only=True)
+    is_liked_by_current_user = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Note
+        fields = ('id', 'title', 'preview', 'author', 'created_at', 'updated_at', 'is_shared',
+                  'deletion_requested_by', 'edit_requested_by', 'like_count', 'is_liked_by_current_user')
+        read_only_fields = fields
+
+    def get_preview(self, obj):
+        return preview_text(obj.content)
+
+    get_is_liked_by_current_user = NoteSerializer.get_is_liked_by_current_user
+
+
+class JournalEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     deletion_requested_by = UserSerializer(read_only=True)
     deletion_approved_by = UserSerializer(read_only=True)
     edit_requested_by = UserSerializer(read_only=True)
     edit_approved_by = UserSerializer(read_only=True)
+    expandable_fields = RELATED_USER_FIELDS
     
     class Meta:
         model = JournalEntry
@@ -112,6 +233,20 @@ class JournalEntrySerializer(serializers.ModelSerializer):
         read_only_fields = ('author', 'created_at', 'updated_at')
 
 
+class JournalEntrySummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Compact journal entry for calendars and lists (?view=summary), see NoteSummarySerializer"""
+    preview = serializers.SerializerMethodField()
+
+    class Meta:
+        model = JournalEntry
+        fields = ('id', 'title', 'preview', 'author', 'date', 'created_at', 'updated_at', 'mood', 'is_shared',
+                  'deletion_requested_by', 'edit_requested_by')
+        read_only_fields = fields
+
+    def get_preview(self, obj):
+        return preview_text(obj.content)
+
+
 class PartnerRequestSerializer(serializers.ModelSerializer):
     requester = UserSerializer(read_only=True)
     requested = UserSerializer(read_only=True)
@@ -126,7 +261,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = '__all__'
-        read_only_fields = ('user', 'updated_at')
+        read_only_fields = ('user', 'updated_at', 'next_journal_reminder_at', 'last_journal_reminder_at')
 
 
 class PartnerProfileSerializer(serializers.ModelSerializer):
@@ -0,0 +1 @@
+# SQLite database backend with WAL and write transactions (see base.py)
@@ -0,0 +1,149 @@
+"""
+Delta sync support for /api/sync/
+
+A sync token is a signed, opaque timestamp. A client that sends one gets
+only the notes, journal entries and likes created or changed since then,
+plus the ids of everything deleted since then (from Tombstone rows written
+by the post_delete receivers below, since hard deletes leave nothing else
+behind) and a new token. A like or unlike counts as a change of its note,
+whose like_count moved. Likes deleted along with their note get no
+tombstones of their own: the note's tells the client to drop them too.
+
+Timestamps come from auto_now fields that are set before the row is
+committed, so a new token is dated SYNC_TOKEN_OVERLAP seconds in the past:
+a row written concurrently with a sync shows up again in the next one
+rather than never. Clients apply changes as upserts, so repeats are
+harmless.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import User, Note, JournalEntry, NoteLike, Tombstone
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = 'api.sync'
+
+# Tombstone kind and the owner of each deletable model
+TOMBSTONE_KINDS = {
+    Note: ('note', 'author_id'),
+    JournalEntry: ('journal_entry', 'author_id'),
+    NoteLike: ('note_like', 'user_id'),
+}
+
+# Field holding the parent (the note of a like), kept on its tombstones
+TOMBSTONE_PARENTS = {
+    NoteLike: 'note_id',
+}
+
+
+class InvalidSyncToken(Exception):
+    pass
+
+
+def get_token_overlap():
+    return timedelta(seconds=getattr(settings, 'SYNC_TOKEN_OVERLAP', 5))
+
+
+def get_tombstone_retention():
+    return timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 90))
+
+
+def make_token(user, now=None):
+    """Token for changes after now (minus the overlap), tied to user and their current partner"""
+    since = (now or timezone.now()) - get_token_overlap()
+    return signing.dumps({'u': user.pk, 'p': user.partner_id, 't': since.timestamp()}, salt=TOKEN_SALT)
+
+
+def parse_token(token, user):
+    """
+    Time a token was issued for, or None if the client has to start over
+    with a full sync (partner changed, or tombstones from then may have
+    been purged). Raises InvalidSyncToken for tokens that aren't ours.
+    """
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        raise InvalidSyncToken('Invalid sync token')
+    if payload.get('u') != user.pk:
+        raise InvalidSyncToken('Sync token belongs to another user')
+    since = datetime.fromtimestamp(payload['t'], tz=dt_timezone.utc)
+    if payload.get('p') != user.partner_id:
+        return None
+    if since < timezone.now() - get_tombstone_retention():
+        return None
+    return since
+
+
+def couple_q(user, field):
+    users = [user.pk]
+    if user.partner_id:
+        users.append(user.partner_id)
+    return Q(**{f'{field}__in': users})
+
+
+def changed_notes(notes, user, since):
+    """notes changed since `since`, a like or unlike counting as a change of its note"""
+    liked = NoteLike.objects.filter(created_at__gte=since).values('note_id')
+    unliked = Tombstone.objects.filter(
+        couple_q(user, 'owner'), kind=TOMBSTONE_KINDS[NoteLike][0], deleted_at__gte=since
+    ).values('parent_id')
+    return notes.filter(Q(updated_at__gte=since) | Q(pk__in=liked) | Q(pk__in=unliked))
+
+
+def deleted_since(user, since):
+    """kind -> ids deleted (or no longer visible to user) since `since`"""
+    deleted = {kind: [] for kind, _ in TOMBSTONE_KINDS.values()}
+    tombstones = Tombstone.objects.filter(couple_q(user, 'owner'), deleted_at__gte=since)
+    for kind, object_id in tombstones.values_list('kind', 'object_id'):
+        deleted[kind].append(object_id)
+
+    if user.partner_id:
+        # The partner's rows that were made private are gone as far as user is concerned
+        for model in (Note, JournalEntry):
+            kind = TOMBSTONE_KINDS[model][0]
+            deleted[kind].extend(model.objects.filter(
+                author_id=user.partner_id, is_shared=False, updated_at__gte=since
+            ).values_list('id', flat=True))
+    return deleted
+
+
+def purge_tombstones(older_than=None):
+    """Delete tombstones older than the retention period; tokens that old get a full sync"""
+    cutoff = timezone.now() - (older_than or get_tombstone_retention())
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
+
+
+def _is_delete_of(origin, model):
+    return isinstance(origin, model) or (isinstance(origin, QuerySet) and origin.model is model)
+
+
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=JournalEntry)
+@receiver(post_delete, sender=NoteLike)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    if _is_delete_of(origin, User):
+        # Cascade from deleting the account itself: a tombstone would point at
+        # the user being deleted, and the partner's next sync starts over anyway
+        return
+    if sender is NoteLike and _is_delete_of(origin, Note):
+        # Cascade from deleting the note, whose tombstone covers its likes
+        return
+    kind, owner_field = TOMBSTONE_KINDS[sender]
+    parent_field = TOMBSTONE_PARENTS.get(sender)
+    try:
+        # Savepoint: a failed insert mustn't abort the delete's transaction
+        with transaction.atomic():
+            Tombstone.objects.create(
+                kind=kind, object_id=instance.pk, owner_id=getattr(instance, owner_field),
+                parent_id=getattr(instance, parent_field) if parent_field else None,
+            )
+    except Exception as e:
+        logger.error(f'Error recording tombstone for {sender.__name__} {instance.pk}: {e}', exc_info=True)
@@ -0,0 +1,1203 @@
+"""
+Tests for the api app
+Run with: python manage.py test api
+
+Run them on each database profile (see DATABASE_PROFILE in settings); on
+PostgreSQL the test database is test_<POSTGRES_DB>, so the user needs the
+CREATEDB privilege:
+    DATABASE_PROFILE=postgres python manage.py test api
+A throwaway PostgreSQL for that:
+    docker run --rm -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres:16
+    DATABASE_PROFILE=postgres POSTGRES_USER=postgres POSTGRES_PASSWORD=postgres python manage.py test api
+"""
+from datetime import date, time as dt_time, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, close_old_connections, connection, transaction
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from unittest import skipUnless
+from django.urls import path
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from . import approvals, async_views, bulk, events, likes, list_cache, long_poll, notification_routing, notification_utils, search, sync
+from .list_cache import NOTES
+from .management.commands.send_journal_reminders import Command as JournalReminderCommand
+from .models import JournalEntry, Note, NoteLike, NotificationOutbox, PushSubscription, Tombstone, User, UserProfile
+from .push_client import PushClient, WebPushException, get_push_client
+from .querysets import visible_to
+from .views import get_note_queryset
+import base64
+import json
+import tempfile
+import threading
+import time
+
+# Registering and logging in dominate the run time with the real hasher
+FAST_PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-default'},
+    'lists': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-lists'},
+    'routes': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-routes'},
+}
+
+
+def make_couple():
+    alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345!')
+    bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345!')
+    alice.partner = bob
+    alice.save(update_fields=['partner'])
+    bob.partner = alice
+    bob.save(update_fields=['partner'])
+    return alice, bob
+
+
+def client_for(user):
+    """An API client authenticated as user with a JWT access token"""
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    return client
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
+class CoupleTestCase(TestCase):
+    """A connected couple, alice and bob, with a client for each"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.alice, self.bob = make_couple()
+        self.alice_client = client_for(self.alice)
+        self.bob_client = client_for(self.bob)
+
+
+@override_settings(LIST_CACHE_ENABLED=False)
+class ListQueryCountTests(CoupleTestCase):
+    """The list endpoints run the same number of queries for N and 2N rows"""
+
+    rows = 5
+
+    def setUp(self):
+        super().setUp()
+        self.next_day = date(2024, 1, 1)
+
+    def add_notes(self):
+        for author, partner in ((self.alice, self.bob), (self.bob, self.alice)):
+            # bulk_create skips the like_count receivers, so the count is set here
+            notes = Note.objects.bulk_create([
+                Note(title=f'Note {i}', content='<p>Hello</p>', author=author, like_count=1,
+                     deletion_requested_by=partner, edit_requested_by=partner, pending_title='Pending')
+                for i in range(self.rows)
+            ])
+            NoteLike.objects.bulk_create([NoteLike(note=note, user=partner) for note in notes])
+
+    def add_journal_entries(self):
+        entries = []
+        for _ in range(self.rows):
+            for author, partner in ((self.alice, self.bob), (self.bob, self.alice)):
+                entries.append(JournalEntry(
+                    title='Day', content='<p>Dear diary</p>', author=author, date=self.next_day,
+                    deletion_requested_by=partner, edit_requested_by=partner,
+                ))
+            self.next_day += timedelta(days=1)
+        JournalEntry.objects.bulk_create(entries)
+
+    def assertConstantQueries(self, client, url, add_rows):
+        add_rows()
+        with CaptureQueriesContext(connection) as first:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        add_rows()
+        with self.assertNumQueries(len(first)):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def results(self, response):
+        data = response.json()
+        return data['results'] if isinstance(data, dict) else data
+
+    def test_notes_list(self):
+        response = self.assertConstantQueries(self.alice_client, '/api/notes/', self.add_notes)
+        self.assertEqual(len(self.results(response)), 4 * self.rows)
+
+    def test_partner_notes_list(self):
+        response = self.assertConstantQueries(self.bob_client, '/api/notes/', self.add_notes)
+        notes = self.results(response)
+        self.assertEqual(len(notes), 4 * self.rows)
+        self.assertTrue(all(note['like_count'] == 1 for note in notes))
+
+    def test_journal_list(self):
+        response = self.assertConstantQueries(self.alice_client, '/api/journal/', self.add_journal_entries)
+        self.assertEqual(len(self.results(response)), 4 * self.rows)
+
+    def test_partner_journal_list(self):
+        response = self.assertConstantQueries(self.bob_client, '/api/journal/', self.add_journal_entries)
+        self.assertEqual(len(self.results(response)), 4 * self.rows)
+
+
+class CoupleCacheQueryTests(CoupleTestCase):
+    """Authenticated requests load the couple in one query, or none with COUPLE_CACHE_TIMEOUT"""
+
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.create(user=self.alice)
+        UserProfile.objects.create(user=self.bob)
+
+    @override_settings(COUPLE_CACHE_TIMEOUT=0)
+    def test_without_cache_every_request_loads_the_user(self):
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                self.assertEqual(self.alice_client.get('/api/auth/me/').status_code, 200)
+
+    @override_settings(COUPLE_CACHE_TIMEOUT=300)
+    def test_cached_user_saves_a_query(self):
+        with self.assertNumQueries(2):
+            self.alice_client.get('/api/auth/me/')
+        with self.assertNumQueries(1):
+            response = self.alice_client.get('/api/auth/me/')
+        self.assertEqual(response.json()['partner']['username'], 'bob')
+
+    @override_settings(COUPLE_CACHE_TIMEOUT=300)
+    def test_profile_save_drops_the_cached_user(self):
+        self.alice_client.get('/api/auth/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.profile.bio = 'Hello'
+            self.alice.profile.save()
+        with self.assertNumQueries(2):
+            self.alice_client.get('/api/auth/me/')
+
+
+class ListCacheInvalidationTests(CoupleTestCase):
+    """Writes by either partner drop the couple's cached lists"""
+
+    def test_partner_note_invalidates_cached_list(self):
+        self.assertEqual(self.alice_client.get('/api/notes/')['X-Cache'], 'MISS')
+        self.assertEqual(self.alice_client.get('/api/notes/')['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            note = Note.objects.create(title='From bob', content='<p>Hi</p>', author=self.bob)
+        response = self.alice_client.get('/api/notes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([item['id'] for item in response.json()], [note.pk])
+
+    def test_like_invalidates_cached_list(self):
+        note = Note.objects.create(title='From alice', content='<p>Hi</p>', author=self.alice)
+        self.alice_client.get('/api/notes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            NoteLike.objects.create(note=note, user=self.bob)
+        response = self.alice_client.get('/api/notes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0]['like_count'], 1)
+
+
+class EtagCacheConsistencyTests(CoupleTestCase):
+    """A cached body is only served under the ETag of the rows it was built from"""
+
+    def test_update_skipping_signals_rebuilds_list(self):
+        note = Note.objects.create(title='Before', content='<p>Hi</p>', author=self.alice)
+        first = self.alice_client.get('/api/notes/')
+        self.assertEqual(self.alice_client.get('/api/notes/')['X-Cache'], 'HIT')
+        # No post_save, so the list version isn't bumped
+        Note.objects.filter(pk=note.pk).update(title='After', updated_at=timezone.now())
+        response = self.alice_client.get('/api/notes/')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0]['title'], 'After')
+        self.assertEqual(self.alice_client.get('/api/notes/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_update_skipping_signals_rebuilds_calendar(self):
+        entry = JournalEntry.objects.create(content='<p>Day</p>', author=self.alice, date=date(2024, 3, 5), mood='calm')
+        url = '/api/journal/calendar/?month=2024-03'
+        self.alice_client.get(url)
+        self.assertEqual(self.alice_client.get(url)['X-Cache'], 'HIT')
+        JournalEntry.objects.filter(pk=entry.pk).update(mood='happy', updated_at=timezone.now())
+        response = self.alice_client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('happy', response.content.decode())
+
+
+@override_settings(LONG_POLL_CHECK_INTERVAL=0.05)
+class LongPollTests(CoupleTestCase):
+    """/api/changes/ notices writes made anywhere, including ones no signal announced here"""
+
+    def versions(self):
+        response = self.alice_client.get('/api/changes/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['versions']
+
+    def test_unchanged_lists_time_out(self):
+        versions = self.versions()
+        response = self.alice_client.get('/api/changes/', {**versions, 'timeout': 0.2})
+        self.assertEqual(response.json(), {'versions': versions, 'changed': []})
+
+    def test_waiting_doesnt_query_the_database(self):
+        versions = self.versions()
+        with CaptureQueriesContext(connection) as one_check:
+            long_poll.check(self.alice, versions)
+        # The digests when the wait starts and when it times out; in between only the cache is read
+        with self.assertNumQueries(2 * len(one_check)):
+            result = long_poll.wait_for_changes(self.alice, versions, timeout=0.3)
+        self.assertEqual(result['changed'], [])
+
+    def test_write_from_another_process_is_noticed(self):
+        versions = self.versions()
+        # As another worker's write looks from here: the shared versions move, no versions_bumped in this process
+        bump = threading.Timer(0.1, list_cache._bump, args=([NOTES], {list_cache.couple_id(self.bob)}))
+        with mock.patch.object(long_poll.notifier, 'notify') as notify:
+            bump.start()
+            started = time.monotonic()
+            result = long_poll.wait_for_changes(self.alice, versions, timeout=5)
+            bump.join()
+        notify.assert_called_once()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(result['changed'], ['notes'])
+        self.assertEqual(result['versions']['journal'], versions['journal'])
+
+    def test_update_skipping_signals_is_noticed_at_timeout(self):
+        note = Note.objects.create(title='Hi', content='', author=self.bob)
+        versions = self.versions()
+        Note.objects.filter(pk=note.pk).update(title='Hello', updated_at=timezone.now())
+        result = long_poll.wait_for_changes(self.alice, versions, timeout=0.2)
+        self.assertEqual(result['changed'], ['notes'])
+
+
+@override_settings(SYNC_TOKEN_OVERLAP=0)
+class SyncTests(CoupleTestCase):
+    """/api/sync/ deltas carry deletions and like count changes"""
+
+    def sync(self, token=None):
+        response = self.alice_client.get('/api/sync/', {'token': token} if token else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_deleted_note(self):
+        note = Note.objects.create(title='Hi', content='', author=self.bob)
+        NoteLike.objects.create(note=note, user=self.alice)
+        token = self.sync()['token']
+        note_id = note.pk
+        note.delete()
+        delta = self.sync(token)
+        self.assertEqual(delta['notes'], [])
+        # The note's likes go with it
+        self.assertEqual(delta['deleted'], {'notes': [note_id], 'journal_entries': [], 'note_likes': []})
+        self.assertEqual(list(Tombstone.objects.values_list('kind', flat=True)), ['note'])
+
+    def test_like_changes(self):
+        note = Note.objects.create(title='Hi', content='', author=self.alice)
+        token = self.sync()['token']
+        self.bob_client.post(f'/api/notes/{note.pk}/like/')
+        delta = self.sync(token)
+        self.assertEqual([(item['id'], item['like_count']) for item in delta['notes']], [(note.pk, 1)])
+        like_id = delta['note_likes'][0]['id']
+
+        self.bob_client.post(f'/api/notes/{note.pk}/like/')
+        delta = self.sync(delta['token'])
+        self.assertEqual([(item['id'], item['like_count']) for item in delta['notes']], [(note.pk, 0)])
+        self.assertEqual(delta['deleted']['note_likes'], [like_id])
+
+    def test_unchanged(self):
+        Note.objects.create(title='Hi', content='', author=self.alice)
+        delta = self.sync(self.sync()['token'])
+        self.assertEqual((delta['notes'], delta['note_likes']), ([], []))
+
+
+class SharingEventTests(CoupleTestCase):
+    """Making an item private tells the partner, without re-reading is_shared on save"""
+
+    def save_unshared(self, note):
+        note.is_shared = False
+        with mock.patch.object(events, 'publish_to_users') as publish, CaptureQueriesContext(connection) as queries:
+            note.save()
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "api_note"."is_shared"')])
+        return [call.args[0]['type'] for call in publish.call_args_list]
+
+    def test_loaded_note_made_private(self):
+        note = Note.objects.create(title='Hi', content='', author=self.alice)
+        self.assertEqual(self.save_unshared(Note.objects.get(pk=note.pk)), ['note.updated', 'note.unshared'])
+
+    def test_created_note_made_private(self):
+        note = Note.objects.create(title='Hi', content='', author=self.alice)
+        self.assertEqual(self.save_unshared(note), ['note.updated', 'note.unshared'])
+        # Already private: nothing to take back from the partner
+        self.assertEqual(self.save_unshared(note), ['note.updated'])
+
+    def test_locked_state_is_used(self):
+        note = Note.objects.create(title='Hi', content='', author=self.alice, is_shared=False)
+        stale = Note.objects.get(pk=note.pk)
+        Note.objects.filter(pk=note.pk).update(is_shared=True)
+        with mock.patch.object(events, 'publish_to_users') as publish:
+            approvals.edit(stale, {'title': 'Hello', 'is_shared': False})
+        self.assertIn('note.unshared', [call.args[0]['type'] for call in publish.call_args_list])
+
+
+class EventRecipientTests(CoupleTestCase):
+    """Events reach the partner only for what they can see, without loading users row by row"""
+
+    def recipients(self, func, *args, **kwargs):
+        with mock.patch.object(events, 'publish_to_users') as publish:
+            func(*args, **kwargs)
+        return [(call.args[0]['type'], [user_id for user_id in call.args[1] if user_id]) for call in publish.call_args_list]
+
+    def test_like_on_private_note(self):
+        note = Note.objects.create(title='Mine', content='', author=self.alice, is_shared=False)
+        self.assertEqual(self.recipients(NoteLike.objects.create, note=note, user=self.alice),
+                         [('like.created', [self.alice.pk])])
+
+    def test_like_on_shared_note(self):
+        note = Note.objects.create(title='Ours', content='', author=self.alice)
+        self.assertEqual(self.recipients(NoteLike.objects.create, note=note, user=self.bob),
+                         [('like.created', [self.alice.pk, self.bob.pk])])
+
+    def test_note_delete_sends_no_like_events(self):
+        note = Note.objects.create(title='Ours', content='', author=self.alice)
+        NoteLike.objects.create(note=note, user=self.bob)
+        self.assertEqual(self.recipients(note.delete), [('note.deleted', [self.alice.pk, self.bob.pk])])
+
+    def test_one_partner_lookup_per_delete(self):
+        Note.objects.bulk_create([Note(title=f'Note {i}', content='', author=self.alice) for i in range(3)])
+        origin = Note.objects.filter(author=self.alice)
+        notes = list(origin)
+        with self.assertNumQueries(1):
+            for note in notes:
+                events.publish_delete(Note, note, origin=origin)
+
+    def test_loaded_author_is_used(self):
+        note = Note.objects.create(title='Ours', content='', author=self.alice)
+        with self.assertNumQueries(0):
+            events.publish_change(Note, note, created=False)
+
+
+class LikeToggleTests(CoupleTestCase):
+    """toggle_like keeps like rows and Note.like_count in step; reconcile_like_counts repairs drift"""
+
+    def setUp(self):
+        super().setUp()
+        self.note = Note.objects.create(title='Shared', content='<p>Hi</p>', author=self.alice, is_shared=True)
+
+    def assertLikes(self, count):
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.like_count, count)
+        self.assertEqual(NoteLike.objects.filter(note=self.note).count(), count)
+
+    def test_double_toggle(self):
+        self.assertTrue(likes.toggle_like(self.note, self.bob))
+        self.assertLikes(1)
+        self.assertFalse(likes.toggle_like(self.note, self.bob))
+        self.assertLikes(0)
+
+    def test_toggles_by_both_partners_are_counted(self):
+        likes.toggle_like(self.note, self.alice)
+        likes.toggle_like(self.note, self.bob)
+        self.assertLikes(2)
+
+    def test_like_inserted_concurrently_becomes_an_unlike(self):
+        create = NoteLike.objects.create
+
+        def liked_elsewhere(**kwargs):
+            # Another request's like commits between this toggle's DELETE and INSERT
+            create(**kwargs)
+            return create(**kwargs)
+
+        with mock.patch.object(NoteLike.objects, 'create', side_effect=liked_elsewhere), \
+                self.assertLogs('api.likes', 'INFO'):
+            self.assertFalse(likes.toggle_like(self.note, self.bob))
+        self.assertLikes(0)
+
+    def drift(self):
+        # bulk_create skips the like_count receivers
+        NoteLike.objects.bulk_create([NoteLike(note=self.note, user=self.bob)])
+        other = Note.objects.create(title='Other', content='<p>Hi</p>', author=self.alice, like_count=3)
+        return other
+
+    def test_reconcile_dry_run_reports_only(self):
+        other = self.drift()
+        out = StringIO()
+        call_command('reconcile_like_counts', '--dry-run', stdout=out)
+        self.assertIn(f'Note {self.note.pk}: like_count 0, 1 likes', out.getvalue())
+        self.assertIn(f'Note {other.pk}: like_count 3, 0 likes', out.getvalue())
+        self.assertIn('2 notes found', out.getvalue())
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.like_count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        other = self.drift()
+        out = StringIO()
+        with self.assertLogs('api.likes', 'WARNING'):
+            call_command('reconcile_like_counts', stdout=out)
+        self.assertIn('2 notes corrected', out.getvalue())
+        self.assertLikes(1)
+        other.refresh_from_db()
+        self.assertEqual(other.like_count, 0)
+        self.assertEqual(likes.reconcile_like_counts(), [])
+
+
+def _failing_query(*args, **kwargs):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT * FROM api_no_such_table')
+
+
+class ReceiverErrorTests(CoupleTestCase):
+    """A database error in a best-effort receiver leaves the write's transaction usable"""
+
+    def test_search_index_error(self):
+        with self.assertLogs('api.search', 'ERROR'), mock.patch.object(search, 'index_instance', _failing_query):
+            with transaction.atomic():
+                note = Note.objects.create(title='Hi', content='', author=self.alice)
+                self.assertEqual(Note.objects.filter(pk=note.pk).count(), 1)
+        self.assertTrue(Note.objects.filter(pk=note.pk).exists())
+
+    def test_tombstone_error(self):
+        note = Note.objects.create(title='Hi', content='', author=self.alice)
+        with self.assertLogs('api.sync', 'ERROR'), mock.patch.object(sync.Tombstone.objects, 'create', _failing_query):
+            with transaction.atomic():
+                note.delete()
+                self.assertFalse(Note.objects.filter(title='Hi').exists())
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class EventStreamTests(CoupleTestCase):
+
+    def test_not_available_under_wsgi(self):
+        token = RefreshToken.for_user(self.alice).access_token
+        response = self.client.get(f'/api/events/?access_token={token}')
+        self.assertEqual(response.status_code, 501)
+
+
+class BulkImportTests(CoupleTestCase):
+    """Imports are all or nothing, and don't hold a transaction while the upload is read"""
+
+    def note(self, title='Hi', **fields):
+        return json.dumps({'type': 'note', 'title': title, 'content': '<p>Hello</p>', **fields})
+
+    def entry(self, day='2024-03-05'):
+        return json.dumps({'type': 'journal_entry', 'content': '<p>Day</p>', 'date': day})
+
+    def post(self, lines):
+        return self.alice_client.post('/api/import/', '\n'.join(lines), content_type=bulk.CONTENT_TYPE)
+
+    def test_import(self):
+        response = self.post([self.note(), '', self.note(is_shared=False, author='bob'), self.entry()])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'notes': 1, 'journal_entries': 1, 'skipped': 1})
+
+    def test_malformed_lines(self):
+        response = self.post([self.note(), '{"type": "note"', '[1, 2]', self.note(title='x' * 300)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['line'] for error in response.json()['lines']], [2, 3, 4])
+        self.assertFalse(Note.objects.exists())
+
+    def test_partial_failure(self):
+        JournalEntry.objects.create(content='', author=self.alice, date=date(2024, 3, 5))
+        response = self.post([self.note(), self.entry('2024-03-04'), self.entry('2024-03-05')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['lines'][0]['line'], 3)
+        self.assertFalse(Note.objects.exists())
+        self.assertEqual(JournalEntry.objects.count(), 1)
+
+    def test_conflict_while_reading(self):
+        savepoints = list(connection.savepoint_ids)
+
+        def lines():
+            yield self.note()
+            yield self.entry()
+            # Still reading: no transaction of the import's is open yet
+            self.assertEqual(connection.savepoint_ids, savepoints)
+            # Another of alice's devices writes an entry for the same day meanwhile
+            JournalEntry.objects.create(content='', author=self.alice, date=date(2024, 3, 5))
+
+        with self.assertRaises(IntegrityError):
+            bulk.import_records(self.alice, lines())
+        self.assertFalse(Note.objects.exists())
+
+
+# The routes api/urls.py picks under ASYNC_READ_VIEWS (it reads the setting at import)
+class AsyncUrls:
+    urlpatterns = [
+        path('api/notes/', async_views.note_list_create_view),
+        path('api/journal/', async_views.journal_list_create_view),
+        path('api/journal/by-date/', async_views.journal_by_date_view),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncReadViewTests(CoupleTestCase):
+    """The async read views answer like the DRF views, errors included"""
+
+    async def get(self, url, **headers):
+        token = RefreshToken.for_user(self.alice).access_token
+        return await AsyncClient().get(url, headers={'Authorization': f'Bearer {token}', **headers})
+
+    async def test_notes_list(self):
+        note = await Note.objects.acreate(title='Hi', content='', author=self.bob)
+        response = await self.get('/api/notes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()], [note.pk])
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual((await self.get('/api/notes/', **{'If-None-Match': response['ETag']})).status_code, 304)
+
+    async def test_bad_cursor(self):
+        for url in ('/api/notes/?cursor=garbage', '/api/journal/?cursor=zzz'):
+            response = await self.get(url)
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    async def test_journal_by_date(self):
+        entry = await JournalEntry.objects.acreate(content='', author=self.bob, date=date(2024, 3, 5))
+        response = await self.get('/api/journal/by-date/?date=2024-03-05')
+        self.assertEqual([item['id'] for item in response.json()], [entry.pk])
+        for bad in ('bad', '2024-02-30'):
+            self.assertEqual((await self.get(f'/api/journal/by-date/?date={bad}')).status_code, 400)
+
+    async def test_unauthenticated(self):
+        self.assertEqual((await AsyncClient().get('/api/notes/')).status_code, 401)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+class AccessPatternIndexTests(CoupleTestCase):
+    """The list queries are served in order from the access-pattern indexes, without a sort"""
+
+    def setUp(self):
+        super().setUp()
+        Note.objects.bulk_create([Note(title=f'Note {i}', content='', author=self.alice) for i in range(20)])
+        PushSubscription.objects.create(user=self.bob, endpoint='https://push.example.com/bob', p256dh='k', auth='a')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset, index):
+        plan = self.plan(queryset)
+        self.assertIn(f'USING INDEX {index}', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_notes_page(self):
+        notes = visible_to(get_note_queryset(self.alice), self.alice).order_by('-updated_at', '-id')[:50]
+        self.assertUsesIndex(notes, 'note_author_updated_idx')
+
+    def test_journal_page(self):
+        entries = visible_to(JournalEntry.objects.all(), self.alice).order_by('-date', '-created_at', '-id')[:50]
+        self.assertUsesIndex(entries, 'journal_author_shared_idx')
+
+    def test_push_subscriptions(self):
+        self.assertUsesIndex(PushSubscription.objects.filter(user=self.bob), 'pushsub_user_created_idx')
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).decode('utf8').strip('=')
+
+
+class PushClientTests(SimpleTestCase):
+    """PushClient signs VAPID headers once per push service and reuses its connections"""
+
+    def setUp(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        key = ec.generate_private_key(ec.SECP256R1())
+        self.private_key = _b64(key.private_numbers().private_value.to_bytes(32, 'big'))
+        browser_key = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+        self.keys = {'p256dh': _b64(browser_key), 'auth': _b64(b'test-auth-secret')}
+        self.client = PushClient(self.private_key, 'mailto:test@example.com')
+
+    def subscription(self, endpoint):
+        return {'endpoint': endpoint, 'keys': self.keys}
+
+    def test_vapid_headers_signed_once_per_push_service(self):
+        with mock.patch.object(self.client.vapid, 'sign', wraps=self.client.vapid.sign) as sign:
+            for endpoint in ('https://fcm.googleapis.com/fcm/send/a', 'https://fcm.googleapis.com/fcm/send/b',
+                             'https://web.push.apple.com/c'):
+                # curl=True stops right before the HTTP request
+                self.client.send(self.subscription(endpoint), '{"title": "Hi"}', ttl=60, curl=True)
+        self.assertEqual(sign.call_count, 2)
+        self.assertEqual([call.args[0]['aud'] for call in sign.call_args_list],
+                         ['https://fcm.googleapis.com', 'https://web.push.apple.com'])
+
+    def test_session_shared_per_push_service(self):
+        session = self.client.session('https://fcm.googleapis.com/fcm/send/a')
+        self.assertIs(self.client.session('https://fcm.googleapis.com/fcm/send/b'), session)
+        self.assertIsNot(self.client.session('https://web.push.apple.com/c'), session)
+
+    def test_one_client_per_key(self):
+        client = get_push_client(self.private_key, 'mailto:test@example.com')
+        self.assertIs(get_push_client(self.private_key, 'mailto:test@example.com'), client)
+
+
+class FakePushClient:
+    """Stands in for PushClient, answering every send with status"""
+
+    def __init__(self, status=201):
+        self.status = status
+        self.sent = []
+
+    def send(self, subscription_info, data, **kwargs):
+        self.sent.append(subscription_info['endpoint'])
+        response = SimpleNamespace(status_code=self.status, reason='', text='')
+        if self.status > 202:
+            raise WebPushException(f'Push failed: {self.status}', response=response)
+        return response
+
+
+@override_settings(VAPID_PUBLIC_KEY='public', VAPID_PRIVATE_KEY='private', NOTIFICATION_RETRY_BACKOFF=30)
+class NotificationDeliveryTests(CoupleTestCase):
+    """deliver_notification/process_notification against a mocked push service"""
+
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.create(user=self.bob, notifications_enabled=True)
+        self.subscription = PushSubscription.objects.create(
+            user=self.bob, endpoint='https://push.example.com/bob', p256dh='key', auth='secret',
+        )
+        self.item = NotificationOutbox.objects.create(
+            recipient=self.bob, sender=self.alice, notification_type='note_created',
+            title='💕 alice wrote a new note', body='Hello', attempts=1,
+        )
+
+    def push(self, status):
+        client = FakePushClient(status)
+        return mock.patch.object(notification_utils, 'get_push_client', return_value=client)
+
+    def test_created_response_is_sent(self):
+        with self.push(201):
+            self.assertEqual(notification_utils.process_notification(self.item), 'sent')
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'sent')
+        self.assertIsNotNone(self.item.sent_at)
+
+    def test_gone_subscription_is_deleted(self):
+        with self.push(410), self.assertLogs('api.notification_utils', 'WARNING'):
+            self.assertEqual(notification_utils.deliver_notification(self.item), 'failed')
+        self.assertFalse(PushSubscription.objects.filter(pk=self.subscription.pk).exists())
+
+    def test_server_error_is_rescheduled_with_backoff(self):
+        self.item.attempts = 2
+        before = timezone.now()
+        with self.push(503), self.assertLogs('api.notification_utils', 'WARNING'):
+            self.assertEqual(notification_utils.process_notification(self.item), 'pending')
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'pending')
+        self.assertTrue(self.item.last_error)
+        # 30s doubled once, plus up to half of that again as jitter
+        self.assertGreaterEqual(self.item.next_attempt_at, before + timedelta(seconds=60))
+        self.assertLessEqual(self.item.next_attempt_at, timezone.now() + timedelta(seconds=90))
+        self.assertTrue(PushSubscription.objects.filter(pk=self.subscription.pk).exists())
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=3)
+    def test_server_error_on_last_attempt_fails(self):
+        self.item.attempts = 3
+        with self.push(503), self.assertLogs('api.notification_utils', 'ERROR'):
+            self.assertEqual(notification_utils.process_notification(self.item), 'failed')
+
+    def test_queued_notification_is_due_straight_away(self):
+        item = notification_utils.send_notification_to_partner(self.alice, 'note_created', 'Hi', 'Hello')
+        self.assertLessEqual(item.next_attempt_at, timezone.now())
+        self.assertEqual([claimed.pk for claimed in notification_utils.claim_due_notifications(10)], [self.item.pk, item.pk])
+
+    def test_claim_takes_due_items_only(self):
+        NotificationOutbox.objects.create(
+            recipient=self.bob, sender=self.alice, notification_type='note_created', title='Later',
+            next_attempt_at=timezone.now() + timedelta(minutes=5),
+        )
+        claimed = notification_utils.claim_due_notifications(10)
+        self.assertEqual([item.pk for item in claimed], [self.item.pk])
+        self.assertEqual(claimed[0].attempts, 2)
+        self.assertGreater(claimed[0].next_attempt_at, timezone.now())
+        self.assertEqual(notification_utils.claim_due_notifications(10), [])
+
+
+@override_settings(VAPID_PUBLIC_KEY='public', VAPID_PRIVATE_KEY='private')
+class NotificationDigestTests(CoupleTestCase):
+    """send_notification_digests only sends (and marks sent) the rows it claimed"""
+
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.create(user=self.bob, notifications_enabled=True, notification_digest=True)
+        PushSubscription.objects.create(user=self.bob, endpoint='https://push.example.com/bob', p256dh='key', auth='secret')
+        self.items = [
+            NotificationOutbox.objects.create(
+                recipient=self.bob, sender=self.alice, notification_type='note_liked',
+                title='❤️ alice liked a note', status='digest',
+            )
+            for _ in range(3)
+        ]
+
+    def test_digest_sent(self):
+        client = FakePushClient(201)
+        with mock.patch.object(notification_utils, 'get_push_client', return_value=client):
+            self.assertEqual(notification_utils.send_notification_digests(), (1, 0))
+        self.assertEqual(len(client.sent), 1)
+        self.assertEqual(NotificationOutbox.objects.filter(status='sent').count(), 3)
+
+    def send(self, status):
+        client = FakePushClient(status)
+        with mock.patch.object(notification_utils, 'get_push_client', return_value=client), \
+                self.assertLogs('api.notification_utils', 'INFO'):
+            return notification_utils.send_notification_digests(), client
+
+    def test_failed_digest_is_kept_for_the_next_run(self):
+        self.assertEqual(self.send(503)[0], (0, 1))
+        self.assertEqual(NotificationOutbox.objects.filter(status='digest').count(), 3)
+        self.assertEqual(self.send(201)[0], (1, 0))
+        self.assertEqual(NotificationOutbox.objects.filter(status='sent').count(), 3)
+
+    def test_kept_without_subscriptions(self):
+        PushSubscription.objects.all().delete()
+        self.assertEqual(notification_utils.send_notification_digests(), (0, 1))
+        self.assertEqual(NotificationOutbox.objects.filter(status='digest').count(), 3)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_failed_after_max_attempts(self):
+        self.send(503)
+        self.send(503)
+        self.assertEqual(NotificationOutbox.objects.filter(status='failed').count(), 3)
+
+    def test_turned_off_types_are_left_out(self):
+        UserProfile.objects.filter(user=self.bob).update(notify_note_liked=False)
+        NotificationOutbox.objects.create(
+            recipient=self.bob, sender=self.alice, notification_type='note_created', title='💕 alice wrote a note', status='digest',
+        )
+        _, client = self.send(201)
+        self.assertEqual(len(client.sent), 1)
+        self.assertEqual(NotificationOutbox.objects.filter(status='skipped').count(), 3)
+        self.assertEqual(NotificationOutbox.objects.filter(status='sent').count(), 1)
+
+    def test_claim_skips_rows_taken_by_another_run(self):
+        items = list(NotificationOutbox.objects.filter(status='digest'))
+        # Another run claims one of them after this one read the held rows
+        NotificationOutbox.objects.filter(pk=self.items[0].pk).update(attempts=1, next_attempt_at=timezone.now() + timedelta(minutes=5))
+        NotificationOutbox.objects.filter(pk=self.items[1].pk).update(count=4)
+        claimed = notification_utils._claim_held(items)
+        self.assertEqual([item.pk for item in claimed], [self.items[1].pk, self.items[2].pk])
+        self.assertEqual(claimed[0].count, 4)
+        self.assertEqual(notification_utils._digest_body(claimed), 'alice liked 5 notes.')
+        # Claimed rows aren't picked up again while the claim lasts
+        self.assertEqual(notification_utils.send_notification_digests(), (0, 0))
+
+
+@override_settings(VAPID_PUBLIC_KEY='public', VAPID_PRIVATE_KEY='private', JOURNAL_REMINDER_GRACE=120)
+class JournalReminderTests(CoupleTestCase):
+    """next_journal_reminder_at scheduling and send_due_journal_reminders"""
+
+    def setUp(self):
+        super().setUp()
+        self.profile = UserProfile.objects.create(user=self.alice, notifications_enabled=True)
+        PushSubscription.objects.create(user=self.alice, endpoint='https://push.example.com/alice', p256dh='key', auth='secret')
+        self.client_mock = FakePushClient(201)
+
+    def make_due(self, minutes_ago):
+        """Run time minutes_ago minutes after the scheduled reminder"""
+        due_at = self.profile.next_journal_reminder_at
+        return due_at + timedelta(minutes=minutes_ago), due_at
+
+    def send(self, now):
+        with mock.patch.object(notification_utils, 'get_push_client', return_value=self.client_mock):
+            return notification_utils.send_due_journal_reminders(now)
+
+    def test_save_schedules_next_reminder(self):
+        next_at = self.profile.next_journal_reminder_at
+        self.assertEqual(next_at.time(), dt_time(21, 0))
+        self.assertGreater(next_at, timezone.now())
+        self.assertLessEqual(next_at, timezone.now() + timedelta(days=1))
+
+    def test_unrelated_edit_keeps_schedule(self):
+        # A reminder that's due but not sent yet isn't pushed to tomorrow
+        due_at = self.profile.next_journal_reminder_at - timedelta(days=1)
+        UserProfile.objects.filter(pk=self.profile.pk).update(next_journal_reminder_at=due_at)
+        self.profile.refresh_from_db()
+        self.profile.notify_note_created = False
+        self.profile.save()
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.next_journal_reminder_at, due_at)
+
+    def test_settings_change_reschedules(self):
+        self.profile.journal_reminder_time = dt_time(7, 30)
+        self.profile.save()
+        self.assertEqual(self.profile.next_journal_reminder_at.time(), dt_time(7, 30))
+        self.profile.notify_journal_reminder = False
+        self.profile.save()
+        self.assertIsNone(self.profile.next_journal_reminder_at)
+
+    def test_due_reminder_is_sent_once(self):
+        now, due_at = self.make_due(1)
+        self.assertEqual(self.send(now), (1, 0))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.last_journal_reminder_at, now)
+        self.assertEqual(self.profile.next_journal_reminder_at, due_at + timedelta(days=1))
+        # A second (or overlapping) run finds nothing due
+        self.assertEqual(self.send(now), (0, 0))
+        self.assertEqual(len(self.client_mock.sent), 1)
+
+    def test_not_due_yet(self):
+        now, due_at = self.make_due(-5)
+        self.assertEqual(self.send(now), (0, 0))
+        self.assertEqual(self.client_mock.sent, [])
+
+    def test_claim_lost_to_another_run_is_not_sent(self):
+        now, due_at = self.make_due(1)
+        compute = UserProfile.compute_next_journal_reminder
+
+        def claimed_elsewhere(profile, after=None):
+            # Another run moves the reminder on between this run's read and its claim
+            UserProfile.objects.filter(pk=profile.pk).update(next_journal_reminder_at=due_at + timedelta(days=1))
+            return compute(profile, after=after)
+
+        with mock.patch.object(UserProfile, 'compute_next_journal_reminder', autospec=True, side_effect=claimed_elsewhere):
+            self.assertEqual(self.send(now), (0, 0))
+        self.assertEqual(self.client_mock.sent, [])
+        self.profile.refresh_from_db()
+        self.assertIsNone(self.profile.last_journal_reminder_at)
+
+    def test_reminder_past_grace_is_rescheduled_without_sending(self):
+        now, due_at = self.make_due(121)
+        with self.assertLogs('api.notification_utils', 'WARNING'):
+            self.assertEqual(self.send(now), (0, 1))
+        self.assertEqual(self.client_mock.sent, [])
+        self.profile.refresh_from_db()
+        self.assertGreater(self.profile.next_journal_reminder_at, now)
+
+    def test_reminder_within_grace_is_sent(self):
+        now, due_at = self.make_due(119)
+        self.assertEqual(self.send(now), (1, 0))
+
+    def test_without_subscriptions_is_skipped(self):
+        PushSubscription.objects.all().delete()
+        now, due_at = self.make_due(1)
+        self.assertEqual(self.send(now), (0, 1))
+        self.profile.refresh_from_db()
+        self.assertGreater(self.profile.next_journal_reminder_at, now)
+
+
+@override_settings(VAPID_PUBLIC_KEY='public', VAPID_PRIVATE_KEY='private')
+class JournalReminderDaemonTests(CoupleTestCase):
+    """The send_journal_reminders --daemon schedule: refreshes, stale heap entries and sending"""
+
+    def setUp(self):
+        super().setUp()
+        self.profile = UserProfile.objects.create(user=self.alice, notifications_enabled=True)
+        PushSubscription.objects.create(user=self.alice, endpoint='https://push.example.com/alice', p256dh='key', auth='secret')
+        self.command = JournalReminderCommand()
+        self.command.reset_schedule(refresh_overlap=60)
+        self.command.refresh_schedule()
+
+    def test_initial_refresh_loads_scheduled_profiles(self):
+        self.assertEqual(self.command.scheduled, {self.profile.pk: self.profile.next_journal_reminder_at})
+        self.assertEqual(self.command.last_seen, self.profile.updated_at)
+
+    def commit_late(self, user, seconds_before_last_seen):
+        """A profile saved before the last refresh but only committed after it"""
+        profile = UserProfile.objects.create(user=user, notifications_enabled=True)
+        UserProfile.objects.filter(pk=profile.pk).update(
+            updated_at=self.command.last_seen - timedelta(seconds=seconds_before_last_seen)
+        )
+        return profile
+
+    def test_overlap_picks_up_late_commits(self):
+        profile = self.commit_late(self.bob, 30)
+        self.command.refresh_schedule()
+        self.assertEqual(self.command.scheduled[profile.pk], profile.next_journal_reminder_at)
+
+    def test_full_refresh_picks_up_commits_older_than_the_overlap(self):
+        profile = self.commit_late(self.bob, 600)
+        self.command.refresh_schedule()
+        self.assertNotIn(profile.pk, self.command.scheduled)
+        self.command.reset_schedule(refresh_overlap=60)
+        self.command.refresh_schedule()
+        self.assertIn(profile.pk, self.command.scheduled)
+
+    def test_turned_off_reminders_are_dropped(self):
+        self.profile.notify_journal_reminder = False
+        self.profile.save()
+        self.command.refresh_schedule()
+        self.assertEqual(self.command.scheduled, {})
+        self.assertEqual(self.command.pop_due(self.profile.updated_at + timedelta(days=2)), [])
+
+    def test_superseded_heap_entries_are_skipped(self):
+        first = self.profile.next_journal_reminder_at
+        later = first + timedelta(hours=1)
+        UserProfile.objects.filter(pk=self.profile.pk).update(next_journal_reminder_at=later, updated_at=timezone.now())
+        self.command.refresh_schedule()
+        self.assertEqual(len(self.command.heap), 2)
+        self.assertEqual(self.command.pop_due(first), [])
+        self.assertEqual(self.command.pop_due(later), [self.profile.pk])
+        self.assertEqual(self.command.heap, [])
+
+    def test_send_due_sends_and_reschedules(self):
+        now = timezone.now()
+        due_at = now - timedelta(minutes=1)
+        UserProfile.objects.filter(pk=self.profile.pk).update(next_journal_reminder_at=due_at, updated_at=now)
+        self.command.refresh_schedule()
+        self.assertEqual(self.command.send_due(now - timedelta(minutes=2)), 0)
+        client = FakePushClient(201)
+        with mock.patch.object(notification_utils, 'get_push_client', return_value=client), \
+                self.assertLogs('api.management.commands.send_journal_reminders', 'INFO'):
+            self.assertEqual(self.command.send_due(now), 1)
+        self.assertEqual(client.sent, ['https://push.example.com/alice'])
+        self.profile.refresh_from_db()
+        self.assertGreater(self.profile.next_journal_reminder_at, now)
+        self.assertEqual(self.command.scheduled, {self.profile.pk: self.profile.next_journal_reminder_at})
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
+class ConcurrentClaimTests(TransactionTestCase):
+    """Workers claiming at the same time never get the same outbox row"""
+
+    workers = 4
+    rows = 40
+
+    def test_concurrent_claims_are_disjoint(self):
+        alice, bob = make_couple()
+        NotificationOutbox.objects.bulk_create([
+            NotificationOutbox(recipient=bob, sender=alice, notification_type='note_liked', title=f'Like {i}')
+            for i in range(self.rows)
+        ])
+        barrier = threading.Barrier(self.workers)
+        claimed = [None] * self.workers
+
+        def claim(index):
+            try:
+                barrier.wait()
+                claimed[index] = [item.pk for item in notification_utils.claim_due_notifications(self.rows)]
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=claim, args=(index,)) for index in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        all_claimed = [pk for ids in claimed for pk in ids]
+        self.assertEqual(len(all_claimed), len(set(all_claimed)))
+        self.assertEqual(len(all_claimed), self.rows)
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
+class ConcurrentLikeTests(TransactionTestCase):
+    """Simultaneous toggles of one like leave the count matching the rows"""
+
+    toggles = 4
+
+    def test_concurrent_toggles(self):
+        alice, bob = make_couple()
+        note = Note.objects.create(title='Shared', content='<p>Hi</p>', author=alice, is_shared=True)
+        barrier = threading.Barrier(self.toggles)
+        errors = []
+
+        def toggle():
+            try:
+                barrier.wait()
+                likes.toggle_like(note, bob)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=toggle) for _ in range(self.toggles)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        note.refresh_from_db()
+        # An even number of toggles, run one after the other, ends unliked
+        self.assertEqual(NoteLike.objects.filter(note=note).count(), 0)
+        self.assertEqual(note.like_count, 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Lock retries are for SQLite')
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=FAST_PASSWORD_HASHERS, WRITE_RETRY_BACKOFF=0.1)
+class WriteRetryTests(TransactionTestCase):
+    """Writers blocked by another connection's write transaction retry instead of failing"""
+
+    writers = 3
+    hold_seconds = 0.5
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345!')
+
+    def run_writers(self):
+        """Hold the write lock in one thread while others save; returns the writers' errors"""
+        locked = threading.Event()
+        errors = []
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    # BEGIN IMMEDIATE: the write lock is held from here until commit
+                    PushSubscription.objects.create(user=self.user, endpoint='https://push.example.com/holder', p256dh='k', auth='a')
+                    locked.set()
+                    threading.Event().wait(self.hold_seconds)
+            finally:
+                close_old_connections()
+
+        def write(index):
+            try:
+                locked.wait()
+                with connection.cursor() as cursor:
+                    # Give up on the lock quickly so the retries are what gets the write through
+                    cursor.execute('PRAGMA busy_timeout = 20')
+                PushSubscription.objects.create(user=self.user, endpoint=f'https://push.example.com/{index}', p256dh='k', auth='a')
+            except OperationalError as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=hold)] + [
+            threading.Thread(target=write, args=(index,)) for index in range(self.writers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_locked_writes_are_retried(self):
+        with self.assertLogs('api.write_retry', 'WARNING'):
+            errors = self.run_writers()
+        self.assertEqual(errors, [])
+        self.assertEqual(PushSubscription.objects.filter(user=self.user).count(), self.writers + 1)
+
+    @override_settings(WRITE_RETRY_ATTEMPTS=1)
+    def test_without_retries_locked_writes_fail(self):
+        errors = self.run_writers()
+        self.assertEqual(len(errors), self.writers)
+        self.assertTrue(all('locked' in str(error) for error in errors))
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=FAST_PASSWORD_HASHERS)
+class ApiEndToEndTests(TestCase):
+    """A couple walking through the API: register, connect, notes, likes, journal, sync and more"""
+
+    password = 'Kiss-me-quick-42'
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.today = date.today().isoformat()
+        self.a = self.register('alex')
+        self.b = self.register('sam')
+        code = self.expect(self.b.get('/api/auth/me/'), 200)['partner_code']
+        self.expect(self.a.post('/api/auth/connect-partner/', {'partner_code': code}, format='json'), 200)
+
+    def register(self, name):
+        client = APIClient()
+        self.expect(client.post('/api/auth/register/', {
+            'username': name, 'email': f'{name}@example.com', 'password': self.password, 'password2': self.password,
+        }, format='json'), 201)
+        data = self.expect(client.post('/api/auth/login/', {'username': name, 'password': self.password}, format='json'), 200)
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {data['access']}")
+        return client
+
+    def expect(self, response, status_code):
+        self.assertEqual(response.status_code, status_code, None if response.streaming else response.content[:200])
+        return response.json() if response.get('Content-Type', '').startswith('application/json') else response
+
+    def add_note(self, client=None, **fields):
+        fields = {'title': 'Picnic on Sunday', 'content': '<p>Bring the <b>strawberries</b></p>', **fields}
+        return self.expect((client or self.a).post('/api/notes/', fields, format='json'), 201)
+
+    def add_entry(self):
+        return self.expect(self.b.post('/api/journal/', {
+            'content': '<p>Best day ever</p>', 'date': self.today, 'mood': 'happy',
+        }, format='json'), 201)
+
+    def test_connected(self):
+        me = self.expect(self.a.get('/api/auth/me/'), 200)
+        self.assertEqual(me['partner']['username'], 'sam')
+
+    def test_notes(self):
+        self.add_note()
+        self.add_note(title='Secret', content='x', is_shared=False)
+        seen_by_partner = self.expect(self.b.get('/api/notes/'), 200)
+        self.assertEqual([note['title'] for note in seen_by_partner], ['Picnic on Sunday'])
+        page = self.expect(self.a.get('/api/notes/?page_size=1'), 200)
+        self.assertEqual(len(page['results']), 1)
+        self.assertTrue(page['next'])
+
+    def test_sparse_fields(self):
+        note = self.add_note()
+        summary = self.expect(self.b.get('/api/notes/?view=summary'), 200)
+        self.assertEqual(summary[0]['preview'], 'Bring the strawberries')
+        sparse = self.expect(self.b.get('/api/notes/?fields=id,author'), 200)
+        self.assertEqual(sparse[0], {'id': note['id'], 'author': note['author']['id']})
+
+    def test_like(self):
+        note = self.add_note()
+        liked = self.expect(self.b.post(f"/api/notes/{note['id']}/like/"), 200)
+        self.assertTrue(liked['is_liked'])
+        note = self.expect(self.a.get(f"/api/notes/{note['id']}/"), 200)
+        self.assertEqual(note['like_count'], 1)
+        self.assertFalse(note['is_liked_by_current_user'])
+
+    def test_etag(self):
+        self.add_note()
+        etag = self.a.get('/api/notes/')['ETag']
+        self.expect(self.a.get('/api/notes/', HTTP_IF_NONE_MATCH=etag), 304)
+
+    def test_note_search(self):
+        note = self.add_note()
+        found = self.expect(self.b.get('/api/notes/search/?q=strawb'), 200)
+        self.assertEqual([hit['item']['id'] for hit in found['results']], [note['id']])
+        self.assertIn('<mark>', found['results'][0]['snippet'])
+        titles = self.expect(self.b.get('/api/notes/search/?q=strawb&search_type=title'), 200)
+        self.assertEqual(titles['results'], [])
+        listed = self.expect(self.b.get('/api/notes/?search=picnic'), 200)
+        self.assertEqual(len(listed), 1)
+
+    def test_journal(self):
+        entry = self.add_entry()
+        by_date = self.expect(self.a.get(f'/api/journal/by-date/?date={self.today}'), 200)
+        self.assertEqual([item['id'] for item in by_date], [entry['id']])
+        self.expect(self.a.get('/api/journal/by-date/?date=bad'), 400)
+        found = self.expect(self.a.get('/api/journal/search/?q=best'), 200)
+        self.assertEqual(len(found['results']), 1)
+
+    def test_calendar(self):
+        self.add_entry()
+        month = self.expect(self.a.get(f'/api/journal/calendar/?month={self.today[:7]}'), 200)
+        self.assertEqual(month['days'][self.today][0]['mood'], 'happy')
+
+    def test_sync(self):
+        self.add_note()
+        self.add_note(title='Secret', content='x', is_shared=False)
+        self.add_entry()
+        full = self.expect(self.a.get('/api/sync/'), 200)
+        self.assertTrue(full['reset'])
+        self.assertEqual((len(full['notes']), len(full['journal_entries'])), (2, 1))
+        delta = self.expect(self.a.get(f"/api/sync/?token={full['token']}"), 200)
+        self.assertFalse(delta['reset'])
+        note = next(note for note in full['notes'] if note['is_shared'])
+        self.expect(self.a.delete(f"/api/notes/{note['id']}/"), 200)
+        self.expect(self.b.delete(f"/api/notes/{note['id']}/"), 200)
+        delta = self.expect(self.a.get(f"/api/sync/?token={delta['token']}"), 200)
+        self.assertEqual(delta['deleted']['notes'], [note['id']])
+
+    def test_long_poll(self):
+        versions = self.expect(self.a.get('/api/changes/'), 200)['versions']
+        self.add_note(self.b, title='Hi', content='x')
+        changed = self.expect(self.a.get(f"/api/changes/?notes={versions['notes']}&timeout=1"), 200)
+        self.assertEqual(changed['changed'], ['notes'])
+
+    def test_export_import(self):
+        self.add_note()
+        response = self.expect(self.a.get('/api/export/'), 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[0])['type'], 'export')
+        own_notes = [line for line in lines if json.loads(line)['type'] == 'note']
+        self.expect(self.a.post('/api/import/', '\n'.join(own_notes), content_type='application/x-ndjson'), 201)
+        self.assertEqual(len(self.expect(self.a.get('/api/notes/'), 200)), 2)
+
+    def test_two_step_delete(self):
+        note = self.add_note()
+        requested = self.expect(self.a.delete(f"/api/notes/{note['id']}/"), 200)
+        self.assertTrue(requested['deletion_requested'])
+        self.expect(self.b.delete(f"/api/notes/{note['id']}/"), 200)
+        self.expect(self.a.get(f"/api/notes/{note['id']}/"), 404)
@@ -1,10 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+if settings.ASYNC_READ_VIEWS:
+    # GET handled by async views (ASGI), other methods by the DRF views
+    note_list_create = async_views.note_list_create_view
+    journal_list_create = async_views.journal_list_create_view
+    journal_by_date = async_views.journal_by_date_view
+    current_user = async_views.current_user_view
+    wait_for_changes = async_views.wait_for_changes_view
+else:
+    note_list_create = views.NoteListCreateView.as_view()
+    journal_list_create = views.JournalEntryListCreateView.as_view()
+    journal_by_date = views.journal_entries_by_date
+    current_user = views.current_user
+    wait_for_changes = views.wait_for_changes
 
 urlpatterns = [
     path('auth/register/', views.RegisterView.as_view(), name='register'),
     path('auth/login/', views.login_view, name='login'),
-    path('auth/me/', views.current_user, name='current_user'),
+    path('auth/me/', current_user, name='current_user'),
     path('auth/connect-partner/', views.connect_partner, name='connect_partner'),
     path('auth/disconnect-partner/', views.disconnect_partner, name='disconnect_partner'),
     
@@ -15,12 +30,23 @@ urlpatterns = [
     path('push/subscribe/', views.save_push_subscription, name='push-subscribe'),
     path('push/unsubscribe/<int:subscription_id>/', views.delete_push_subscription, name='push-unsubscribe'),
     
-    path('notes/', views.NoteListCreateView.as_view(), name='note-list-create'),
+    path('notes/', note_list_create, name='note-list-create'),
+    path('notes/search/', views.search_notes, name='note-search'),
     path('notes/<int:pk>/', views.NoteDetailView.as_view(), name='note-detail'),
     path('notes/<int:note_id>/like/', views.toggle_note_like, name='note-like'),
     
-    path('journal/', views.JournalEntryListCreateView.as_view(), name='journal-list-create'),
+    path('journal/', journal_list_create, name='journal-list-create'),
     path('journal/<int:pk>/', views.JournalEntryDetailView.as_view(), name='journal-detail'),
-    path('journal/by-date/', views.journal_entries_by_date, name='journal-by-date'),
+    path('journal/by-date/', journal_by_date, name='journal-by-date'),
+    path('journal/calendar/', views.journal_calendar, name='journal-calendar'),
+    path('journal/search/', views.search_journal_entries, name='journal-search'),
+    
+    path('sync/', views.sync_changes, name='sync'),
+    path('changes/', wait_for_changes, name='changes'),
+    path('export/', views.export_data, name='export'),
+    path('import/', views.import_data, name='import'),
+    path('events/', async_views.event_stream, name='events'),
+    
+    path('cache/stats/', views.list_cache_stats, name='list-cache-stats'),
 ]
 
@@ -1,20 +1,39 @@
 from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
-from django.db.models import Q
+from django.db import IntegrityError
+from django.db.models import Exists, OuterRef, Prefetch
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import User, Note, JournalEntry, PartnerRequest, UserProfile, NoteLike, PushSubscription
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .models import User, Note, JournalEntry, UserProfile, NoteLike, PushSubscription
 from .serializers import (
-    UserSerializer, RegisterSerializer, NoteSerializer,
-    JournalEntrySerializer, PartnerRequestSerializer,
-    UserProfileSerializer, PartnerProfileSerializer, PushSubscriptionSerializer
+    UserSerializer, RegisterSerializer, NoteSerializer, JournalEntrySerializer,
+    UserProfileSerializer, PartnerProfileSerializer,
+    SyncNoteLikeSerializer, NoteSummarySerializer, JournalEntrySummarySerializer,
+    RELATED_USER_FIELDS, requested_fields, requested_expansions, wants_summary
 )
 from .notification_utils import send_notification_to_partner
-import json
+from .pagination import NoteCursorPagination, JournalEntryCursorPagination
+from .querysets import visible_to
+from .list_cache import CachedListMixin, NOTES, JOURNAL, USERS
+from .etags import notes_etag, journal_etag, users_etag, vapid_key_etag, request_state
+from .couple import Couple, couple_for
+from . import approvals
+from . import bulk
+from . import journal_calendar as journal_calendar_module
+from .likes import toggle_like
+from . import list_cache
+from . import long_poll
+from . import search
+from . import sync
 
 
 class RegisterView(generics.CreateAPIView):
@@ -56,8 +75,9 @@ def login_view(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=users_etag)
 def current_user(request):
-    return Response(UserSerializer(request.user).data)
+    return Response(UserSerializer(request.user, context={'request': request}).data)
 
 
 @api_view(['POST'])
@@ -82,6 +102,8 @@ def connect_partner(request):
         partner.partner = request.user
         request.user.save()
         partner.save()
+        # Saving both users drops their cached couple context; refresh this request's too
+        request.user.couple = Couple(request.user)
         
         return Response({
             'message': 'Partner connected successfully',
@@ -91,18 +113,95 @@ def connect_partner(request):
         return Response({'error': 'Invalid partner code'}, status=status.HTTP_404_NOT_FOUND)
 
 
-class NoteListCreateView(generics.ListCreateAPIView):
+# Nested UserSerializer fields on a note, joined with their partners so that
+# serializing a page of notes doesn't hit the database once per user.
+NOTE_USER_RELATIONS = (
+    'author__partner',
+    'deletion_requested_by__partner',
+    'deletion_approved_by__partner',
+    'edit_requested_by__partner',
+    'edit_approved_by__partner',
+)
+# Journal entries have the same user fields
+JOURNAL_USER_RELATIONS = NOTE_USER_RELATIONS
+
+
+def note_prefetches():
+    return [Prefetch('likes', queryset=NoteLike.objects.select_related('user__partner'))]
+
+
+def get_note_queryset(user):
+    """
+    Notes with everything NoteSerializer needs loaded up front for user:
+    related users joined, likes prefetched, and "liked by me" computed in
+    SQL (the like count is the denormalized Note.like_count, see api/likes.py).
+    """
+    return Note.objects.select_related(*NOTE_USER_RELATIONS).prefetch_related(
+        *note_prefetches()
+    ).annotate(
+        annotated_is_liked=Exists(NoteLike.objects.filter(note=OuterRef('pk'), user=user)),
+    )
+
+
+def trim_for_representation(queryset, request, relations, prefetches=()):
+    """
+    queryset without the joins and prefetches that the representation asked
+    for with ?view=summary or ?fields=/?expand= doesn't serialize
+
+    relations are select_related lookups and prefetches Prefetch objects,
+    each keyed by the serializer field in front of the first "__".
+    """
+    if wants_summary(request):
+        needed = set()
+    else:
+        fields = requested_fields(request)
+        if fields is None:
+            return queryset
+        # Related users left unexpanded come out as ids, read off the row itself
+        needed = (fields & requested_expansions(request)) | (fields - set(RELATED_USER_FIELDS))
+    queryset = queryset.select_related(None).select_related(
+        *(lookup for lookup in relations if lookup.split('__')[0] in needed)
+    )
+    if prefetches:
+        queryset = queryset.prefetch_related(None).prefetch_related(
+            *(prefetch for prefetch in prefetches if prefetch.prefetch_to.split('__')[0] in needed)
+        )
+    return queryset
+
+
+class SummaryListMixin:
+    """
+    List view answering ?view=summary with summary_serializer_class
+
+    ?fields= / ?expand= work on either representation (SparseFieldsMixin).
+    """
+    summary_serializer_class = None
+
+    def get_serializer_class(self):
+        if wants_summary(self.request):
+            return self.summary_serializer_class
+        return super().get_serializer_class()
+
+
+def get_visible_notes(user):
+    """Notes visible to user (own notes plus partner's shared notes), see get_note_queryset()"""
+    return get_note_queryset(user).filter(couple_for(user).visible())
+
+
+@method_decorator(condition(etag_func=notes_etag), name='get')
+class NoteListCreateView(SummaryListMixin, CachedListMixin, generics.ListCreateAPIView):
     serializer_class = NoteSerializer
+    summary_serializer_class = NoteSummarySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NoteCursorPagination
+    list_cache_kind = NOTES
+    list_cache_state = staticmethod(request_state)
 
     def get_queryset(self):
+        # Get own notes and partner's shared notes, one index range per author
         user = self.request.user
-        # Get own notes and partner's shared notes
-        if user.partner:
-            return Note.objects.filter(
-                Q(author=user) | (Q(author=user.partner) & Q(is_shared=True))
-            )
-        return Note.objects.filter(author=user)
+        queryset = trim_for_representation(get_note_queryset(user), self.request, NOTE_USER_RELATIONS, note_prefetches())
+        return visible_to(queryset, user)
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -118,14 +217,9 @@ class NoteListCreateView(generics.ListCreateAPIView):
         search_type = self.request.query_params.get('search_type', 'both')
         
         if search_query:
-            if search_type == 'title':
-                return queryset.filter(title__icontains=search_query)
-            elif search_type == 'content':
-                return queryset.filter(content__icontains=search_query)
-            else:  # both
-                return queryset.filter(
-                    Q(title__icontains=search_query) | Q(content__icontains=search_query)
-                )
+            # Full-text index over HTML-stripped text; keeps the list's usual ordering
+            matching_ids = search.search_ids(get_visible_notes(self.request.user), search_query, search_type)
+            return queryset.filter(id__in=matching_ids)
         return queryset
 
     def perform_create(self, serializer):
@@ -146,129 +240,109 @@ class NoteListCreateView(generics.ListCreateAPIView):
             )
 
 
-class NoteDetailView(generics.RetrieveUpdateDestroyAPIView):
-    serializer_class = NoteSerializer
-    permission_classes = [IsAuthenticated]
+class ApprovalDetailMixin:
+    """
+    update() and delete() for notes and journal entries: the author edits
+    directly, while the partner's edits and either one's deletion wait for
+    the other's approval (the transitions are in api/approvals.py)
+    """
+    item_name = None  # "note" / "entry" in error messages
+    deleted_message = None
+
+    def notify_updated(self, user, instance):
+        """Called after the author edited a shared instance and has a partner"""
+
+    def notify_deletion_requested(self, user, instance):
+        """Called after user (who has a partner) asked to delete instance"""
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.partner:
-            return Note.objects.filter(
-                Q(author=user) | (Q(author=user.partner) & Q(is_shared=True))
-            )
-        return Note.objects.filter(author=user)
-    
     def update(self, request, *args, **kwargs):
-        note = self.get_object()
+        instance = self.get_object()
         user = request.user
-        
+
         # Check if user is author or partner
-        if note.author != user and (not user.partner or note.author != user.partner):
-            return Response({'error': 'You do not have permission to edit this note'}, 
-                          status=status.HTTP_403_FORBIDDEN)
-        
-        # If user is the author, allow direct edit
-        if note.author == user:
-            serializer = self.get_serializer(note, data=request.data, partial=True)
+        if not couple_for(user).includes(instance.author_id):
+            return Response({'error': f'You do not have permission to edit this {self.item_name}'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        # If user is the author, allow direct edit (which also clears any pending edit request)
+        if instance.author_id == user.pk:
+            serializer = self.get_serializer(instance, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
-            updated_note = serializer.save()
-            # Clear any pending edit requests
-            note.edit_requested_by = None
-            note.edit_approved_by = None
-            note.pending_title = None
-            note.pending_content = None
-            note.save()
-            # Send notification to partner
-            if updated_note.is_shared and user.partner:
-                send_notification_to_partner(
-                    user,
-                    'note_updated',
-                    f'✏️ Note Updated by {user.username}',
-                    f'"{updated_note.title}"',
-                    note_id=updated_note.id
-                )
+            approvals.edit(instance, serializer.validated_data)
+            if instance.is_shared and user.partner:
+                self.notify_updated(user, instance)
             return Response(serializer.data)
-        
+
         # Partner trying to edit - need approval
-        # Check if edit already requested
-        if note.edit_requested_by == user:
+        outcome = approvals.request_edit(
+            instance, user, request.data.get('title', instance.title), request.data.get('content', instance.content)
+        )
+        if outcome == approvals.CONFLICT:
+            return Response({'error': 'Invalid edit request'}, status=status.HTTP_400_BAD_REQUEST)
+        if outcome == approvals.ALREADY_REQUESTED:
             return Response({
                 'message': 'You have already requested to edit. Waiting for partner approval.',
                 'edit_requested': True
             })
-        
-        # If no edit request exists, create one with pending changes
-        if not note.edit_requested_by:
-            note.edit_requested_by = user
-            note.pending_title = request.data.get('title', note.title)
-            note.pending_content = request.data.get('content', note.content)
-            note.save()
-            return Response({
-                'message': 'Edit request sent. Waiting for partner approval.',
-                'edit_requested': True
-            })
-        
-        # If partner requested edit and author approves
-        if note.edit_requested_by != user and note.author == user:
-            # Apply pending changes
-            note.title = note.pending_title or note.title
-            note.content = note.pending_content or note.content
-            note.edit_approved_by = user
-            note.edit_requested_by = None
-            note.pending_title = None
-            note.pending_content = None
-            note.save()
-            serializer = self.get_serializer(note)
-            return Response({
-                'message': 'Edit approved and applied.',
-                **serializer.data
-            })
-        
-        return Response({'error': 'Invalid edit request'}, status=status.HTTP_400_BAD_REQUEST)
-    
+        return Response({
+            'message': 'Edit request sent. Waiting for partner approval.',
+            'edit_requested': True
+        })
+
     def delete(self, request, *args, **kwargs):
-        note = self.get_object()
+        instance = self.get_object()
         user = request.user
-        
+
         # Check if user is author or partner
-        if note.author != user and (not user.partner or note.author != user.partner):
-            return Response({'error': 'You do not have permission to delete this note'}, 
-                          status=status.HTTP_403_FORBIDDEN)
-        
-        # If no deletion request exists, create one
-        if not note.deletion_requested_by:
-            note.deletion_requested_by = user
-            note.save()
-            # Send notification to partner about deletion request
-            # Notification should go to user.partner (the partner of the person requesting deletion)
-            if user.partner:
-                send_notification_to_partner(
-                    user,  # Trigger user
-                    'note_deletion_requested',
-                    f'🗑️ {user.username} wants to delete a note',
-                    f'"{note.title}"',
-                    note_id=note.id
-                    # No recipient_user - will send to user.partner by default
-                )
-            return Response({
-                'message': 'Deletion request sent. Waiting for partner approval.',
-                'deletion_requested': True
-            })
-        
-        # If deletion already requested
-        if note.deletion_requested_by == user:
+        if not couple_for(user).includes(instance.author_id):
+            return Response({'error': f'You do not have permission to delete this {self.item_name}'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        outcome = approvals.request_deletion(instance, user)
+        if outcome == approvals.DELETED:
+            # Both partners have approved
+            return Response({'message': self.deleted_message})
+        if outcome == approvals.ALREADY_REQUESTED:
             return Response({
                 'message': 'You have already requested deletion. Waiting for partner approval.',
                 'deletion_requested': True
             })
-        
-        # If partner requests deletion and user approves (or vice versa)
-        if note.deletion_requested_by != user:
-            # Both partners have approved - delete the note
-            note.delete()
-            return Response({'message': 'Note deleted successfully'})
-        
-        return Response({'error': 'Invalid deletion request'}, status=status.HTTP_400_BAD_REQUEST)
+        # Notification goes to user.partner (the partner of the person requesting deletion)
+        if user.partner:
+            self.notify_deletion_requested(user, instance)
+        return Response({
+            'message': 'Deletion request sent. Waiting for partner approval.',
+            'deletion_requested': True
+        })
+
+
+@method_decorator(condition(etag_func=notes_etag), name='get')
+class NoteDetailView(ApprovalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = NoteSerializer
+    permission_classes = [IsAuthenticated]
+    item_name = 'note'
+    deleted_message = 'Note deleted successfully'
+
+    def get_queryset(self):
+        return get_visible_notes(self.request.user)
+
+    def notify_updated(self, user, note):
+        send_notification_to_partner(
+            user,
+            'note_updated',
+            f'✏️ Note Updated by {user.username}',
+            f'"{note.title}"',
+            note_id=note.id
+        )
+
+    def notify_deletion_requested(self, user, note):
+        send_notification_to_partner(
+            user,
+            'note_deletion_requested',
+            f'🗑️ {user.username} wants to delete a note',
+            f'"{note.title}"',
+            note_id=note.id
+        )
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -280,64 +354,52 @@ class NoteDetailView(generics.RetrieveUpdateDestroyAPIView):
 @permission_classes([IsAuthenticated])
 def toggle_note_like(request, note_id):
     """Like or unlike a note"""
-    try:
-        note = Note.objects.get(id=note_id)
-        user = request.user
-        
-        # Check if user has access to this note
-        if note.author != user and (not user.partner or note.author != user.partner):
-            return Response({'error': 'You do not have permission to like this note'}, 
-                          status=status.HTTP_403_FORBIDDEN)
-        
-        # Check if already liked
-        like, created = NoteLike.objects.get_or_create(note=note, user=user)
-        
-        if not created:
-            # Unlike - delete the like
-            like.delete()
-            return Response({'message': 'Note unliked', 'is_liked': False})
-        else:
-            # Like - send notification to partner (same as note creation)
-            # Only send if user has a partner and didn't like their own note
-            # Notification should go to user.partner (partner of the person who liked)
-            import logging
-            logger = logging.getLogger(__name__)
-            
-            logger.info(f'Like action: User {user.username} (partner: {user.partner.username if user.partner else "None"}) liked note by {note.author.username}')
-            
-            if user.partner and note.author != user:
-                logger.info(f'Sending like notification: {user.username} -> {user.partner.username}')
-                send_notification_to_partner(
-                    user,  # Trigger user (who liked) - notification goes to user.partner
-                    'note_liked',
-                    f'❤️ {user.username} liked your note',
-                    f'"{note.title}"',
-                    note_id=note.id
-                )
-            else:
-                if not user.partner:
-                    logger.warning(f'User {user.username} has no partner, skipping notification')
-                if note.author == user:
-                    logger.info(f'User {user.username} liked their own note, skipping notification')
-            
-            return Response({'message': 'Note liked', 'is_liked': True})
-            
-    except Note.DoesNotExist:
+    user = request.user
+    couple = couple_for(user)
+    note = Note.objects.only('id', 'title', 'author_id').filter(id=note_id).first()
+    if note is None:
         return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    # Check if user has access to this note
+    if not couple.includes(note.author_id):
+        return Response({'error': 'You do not have permission to like this note'},
+                        status=status.HTTP_403_FORBIDDEN)
+
+    if not toggle_like(note, user):
+        return Response({'message': 'Note unliked', 'is_liked': False})
+
+    # Notification goes to the partner of the person who liked, unless they liked their own note
+    if couple.partner and note.author_id != user.pk:
+        send_notification_to_partner(
+            user,  # Trigger user (who liked) - notification goes to user.partner
+            'note_liked',
+            f'❤️ {user.username} liked your note',
+            f'"{note.title}"',
+            note_id=note.id
+        )
+    return Response({'message': 'Note liked', 'is_liked': True})
+
+
+def get_visible_journal_entries(user):
+    """Journal entries visible to user: own entries plus partner's shared entries"""
+    return JournalEntry.objects.select_related(*JOURNAL_USER_RELATIONS).filter(couple_for(user).visible())
 
-class JournalEntryListCreateView(generics.ListCreateAPIView):
+
+@method_decorator(condition(etag_func=journal_etag), name='get')
+class JournalEntryListCreateView(SummaryListMixin, CachedListMixin, generics.ListCreateAPIView):
     serializer_class = JournalEntrySerializer
+    summary_serializer_class = JournalEntrySummarySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = JournalEntryCursorPagination
+    list_cache_kind = JOURNAL
+    list_cache_state = staticmethod(request_state)
 
     def get_queryset(self):
-        user = self.request.user
-        # Get own entries and partner's shared entries
-        if user.partner:
-            return JournalEntry.objects.filter(
-                Q(author=user) | (Q(author=user.partner) & Q(is_shared=True))
-            )
-        return JournalEntry.objects.filter(author=user)
+        # Get own entries and partner's shared entries, one index range per author
+        queryset = trim_for_representation(
+            JournalEntry.objects.select_related(*JOURNAL_USER_RELATIONS), self.request, JOURNAL_USER_RELATIONS
+        )
+        return visible_to(queryset, self.request.user)
 
     def perform_create(self, serializer):
         entry = serializer.save(author=self.request.user)
@@ -353,163 +415,240 @@ class JournalEntryListCreateView(generics.ListCreateAPIView):
             )
 
 
-class JournalEntryDetailView(generics.RetrieveUpdateDestroyAPIView):
+@method_decorator(condition(etag_func=journal_etag), name='get')
+class JournalEntryDetailView(ApprovalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = JournalEntrySerializer
     permission_classes = [IsAuthenticated]
+    item_name = 'entry'
+    deleted_message = 'Journal entry deleted successfully'
 
     def get_queryset(self):
-        user = self.request.user
         # Get own entries and partner's shared entries
-        if user.partner:
-            return JournalEntry.objects.filter(
-                Q(author=user) | (Q(author=user.partner) & Q(is_shared=True))
-            )
-        return JournalEntry.objects.filter(author=user)
-    
-    def update(self, request, *args, **kwargs):
-        entry = self.get_object()
-        user = request.user
-        
-        # Check if user is author or partner
-        if entry.author != user and (not user.partner or entry.author != user.partner):
-            return Response({'error': 'You do not have permission to edit this entry'}, 
-                          status=status.HTTP_403_FORBIDDEN)
-        
-        # If user is the author, allow direct edit
-        if entry.author == user:
-            serializer = self.get_serializer(entry, data=request.data, partial=True)
-            serializer.is_valid(raise_exception=True)
-            updated_entry = serializer.save()
-            # Clear any pending edit requests
-            entry.edit_requested_by = None
-            entry.edit_approved_by = None
-            entry.pending_title = None
-            entry.pending_content = None
-            entry.save()
-            # Send notification to partner
-            if updated_entry.is_shared and user.partner:
-                date_str = updated_entry.date.strftime('%Y-%m-%d')
-                send_notification_to_partner(
-                    user,
-                    'journal_updated',
-                    f'✏️ Journal Updated by {user.username}',
-                    f'Entry for {date_str}',
-                    journal_date=date_str
-                )
-            return Response(serializer.data)
-        
-        # Partner trying to edit - need approval
-        # Check if edit already requested
-        if entry.edit_requested_by == user:
-            return Response({
-                'message': 'You have already requested to edit. Waiting for partner approval.',
-                'edit_requested': True
-            })
-        
-        # If no edit request exists, create one with pending changes
-        if not entry.edit_requested_by:
-            entry.edit_requested_by = user
-            entry.pending_title = request.data.get('title', entry.title)
-            entry.pending_content = request.data.get('content', entry.content)
-            entry.save()
-            return Response({
-                'message': 'Edit request sent. Waiting for partner approval.',
-                'edit_requested': True
-            })
-        
-        # If partner requested edit and author approves
-        if entry.edit_requested_by != user and entry.author == user:
-            # Apply pending changes
-            entry.title = entry.pending_title or entry.title
-            entry.content = entry.pending_content or entry.content
-            entry.edit_approved_by = user
-            entry.edit_requested_by = None
-            entry.pending_title = None
-            entry.pending_content = None
-            entry.save()
-            serializer = self.get_serializer(entry)
-            return Response({
-                'message': 'Edit approved and applied.',
-                **serializer.data
-            })
-        
-        return Response({'error': 'Invalid edit request'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    def delete(self, request, *args, **kwargs):
-        entry = self.get_object()
-        user = request.user
-        
-        # Check if user is author or partner
-        if entry.author != user and (not user.partner or entry.author != user.partner):
-            return Response({'error': 'You do not have permission to delete this entry'}, 
-                          status=status.HTTP_403_FORBIDDEN)
-        
-        # If no deletion request exists, create one
-        if not entry.deletion_requested_by:
-            entry.deletion_requested_by = user
-            entry.save()
-            # Send notification to partner about deletion request
-            # Notification should go to user.partner (the partner of the person requesting deletion)
-            date_str = entry.date.strftime('%Y-%m-%d')
-            if user.partner:
-                send_notification_to_partner(
-                    user,  # Trigger user
-                    'journal_deletion_requested',
-                    f'🗑️ {user.username} wants to delete a journal entry',
-                    f'Entry for {date_str}',
-                    journal_date=date_str
-                    # No recipient_user - will send to user.partner by default
-                )
-            return Response({
-                'message': 'Deletion request sent. Waiting for partner approval.',
-                'deletion_requested': True
-            })
-        
-        # If deletion already requested
-        if entry.deletion_requested_by == user:
-            return Response({
-                'message': 'You have already requested deletion. Waiting for partner approval.',
-                'deletion_requested': True
-            })
-        
-        # If partner requests deletion and user approves (or vice versa)
-        if entry.deletion_requested_by != user:
-            # Both partners have approved - delete the entry
-            entry.delete()
-            return Response({'message': 'Journal entry deleted successfully'})
-        
-        return Response({'error': 'Invalid deletion request'}, status=status.HTTP_400_BAD_REQUEST)
+        return get_visible_journal_entries(self.request.user)
+
+    def notify_updated(self, user, entry):
+        date_str = entry.date.strftime('%Y-%m-%d')
+        send_notification_to_partner(
+            user,
+            'journal_updated',
+            f'✏️ Journal Updated by {user.username}',
+            f'Entry for {date_str}',
+            journal_date=date_str
+        )
+
+    def notify_deletion_requested(self, user, entry):
+        date_str = entry.date.strftime('%Y-%m-%d')
+        send_notification_to_partner(
+            user,
+            'journal_deletion_requested',
+            f'🗑️ {user.username} wants to delete a journal entry',
+            f'Entry for {date_str}',
+            journal_date=date_str
+        )
+
+
+def parse_day(value):
+    """date of a YYYY-MM-DD query parameter; ValueError if malformed"""
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=journal_etag)
 def journal_entries_by_date(request):
     date = request.query_params.get('date')
-    if date:
-        user = request.user
-        # Get own entries and partner's shared entries for the date
-        if user.partner:
-            entries = JournalEntry.objects.filter(
-                Q(date=date) & (
-                    Q(author=user) | (Q(author=user.partner) & Q(is_shared=True))
-                )
-            )
-        else:
-            entries = JournalEntry.objects.filter(author=user, date=date)
-        return Response(JournalEntrySerializer(entries, many=True).data)
-    return Response({'error': 'Date parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if not date:
+        return Response({'error': 'Date parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        day = parse_day(date)
+    except ValueError:
+        return Response({'error': 'Date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+    # Get own entries and partner's shared entries for the date
+    entries = trim_for_representation(
+        get_visible_journal_entries(request.user).filter(date=day), request, JOURNAL_USER_RELATIONS
+    )
+    serializer_class = JournalEntrySummarySerializer if wants_summary(request) else JournalEntrySerializer
+    return Response(serializer_class(entries, many=True, context={'request': request}).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@condition(etag_func=journal_etag)
+def journal_calendar(request):
+    """Which days of ?month=YYYY-MM have entries, by whom, with mood and shared flag"""
+    month = request.query_params.get('month')
+    if not month:
+        return Response({'error': 'Month parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        first = journal_calendar_module.parse_month(month)
+    except ValueError:
+        return Response({'error': 'Month must be YYYY-MM'}, status=status.HTTP_400_BAD_REQUEST)
+    payload, hit = journal_calendar_module.get_month(request.user, first, request_state(request, JOURNAL))
+    return Response(payload, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+
+def _search_response(request, queryset, serializer_class):
+    query = request.query_params.get('q', '')
+    if not query.strip():
+        return Response({'error': 'q parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+    search_type = request.query_params.get('search_type', 'both')
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), 100)
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    hits = search.search(queryset, query, search_type, limit=limit)
+    objects = queryset.in_bulk([hit.object_id for hit in hits])
+    context = {'request': request}
+    return Response({
+        'query': query,
+        'results': [
+            {
+                'rank': hit.rank,
+                'highlighted_title': hit.title,
+                'snippet': hit.snippet,
+                'item': serializer_class(objects[hit.object_id], context=context).data,
+            }
+            for hit in hits if hit.object_id in objects
+        ]
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@condition(etag_func=notes_etag)
+def search_notes(request):
+    """Ranked full-text search over visible notes, with highlighted snippets"""
+    return _search_response(request, get_visible_notes(request.user), NoteSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@condition(etag_func=journal_etag)
+def search_journal_entries(request):
+    """Ranked full-text search over visible journal entries, with highlighted snippets"""
+    return _search_response(request, get_visible_journal_entries(request.user), JournalEntrySerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def wait_for_changes(request):
+    """
+    Long-poll: answers once one of the list versions passed as ?notes=,
+    ?journal= or ?users= changes, or after ?timeout= seconds (see
+    api/long_poll.py). Without versions it answers straight away with the
+    current ones.
+    """
+    try:
+        since = long_poll.parse_since(request.query_params)
+    except ValueError:
+        return Response({'error': 'Versions must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    result = long_poll.wait_for_changes(request.user, since, long_poll.get_timeout(request.query_params))
+    return Response(result, headers={'Cache-Control': 'no-store'})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    """
+    Notes, journal entries and likes changed since ?token= (everything
+    without one), the ids deleted since then, and the token for next time.
+    Notes whose likes changed come with them, for their like_count; likes
+    of a deleted note are gone with it.
+    "reset": true means the client must replace its local copy rather than
+    apply the changes on top of it.
+    """
+    user = request.user
+    now = timezone.now()
+    since = None
+    token = request.query_params.get('token')
+    if token:
+        try:
+            since = sync.parse_token(token, user)
+        except sync.InvalidSyncToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    notes = get_visible_notes(user)
+    entries = get_visible_journal_entries(user)
+    likes = NoteLike.objects.filter(note__in=notes.values('pk')).select_related('user__partner')
+    if since is not None:
+        notes = sync.changed_notes(notes, user, since)
+        entries = entries.filter(updated_at__gte=since)
+        likes = likes.filter(created_at__gte=since)
+        deleted = sync.deleted_since(user, since)
+    else:
+        deleted = {kind: [] for kind, _ in sync.TOMBSTONE_KINDS.values()}
+    
+    context = {'request': request}
+    return Response({
+        'token': sync.make_token(user, now),
+        'reset': since is None,
+        'notes': NoteSerializer(notes, many=True, context=context).data,
+        'journal_entries': JournalEntrySerializer(entries, many=True, context=context).data,
+        'note_likes': SyncNoteLikeSerializer(likes, many=True).data,
+        'deleted': {
+            'notes': deleted['note'],
+            'journal_entries': deleted['journal_entry'],
+            'note_likes': deleted['note_like'],
+        },
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_data(request):
+    """Download of the couple's notes, journal entries and likes as NDJSON, streamed (see api/bulk.py)"""
+    user = request.user
+    response = StreamingHttpResponse(
+        bulk.export_lines(user, get_visible_notes(user), get_visible_journal_entries(user)),
+        content_type=bulk.CONTENT_TYPE,
+    )
+    filename = f'love-notes-{user.username}-{timezone.now():%Y-%m-%d}.ndjson'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_data(request):
+    """
+    Import notes and journal entries from an NDJSON export (see api/bulk.py)
+    
+    All or nothing: if any record is invalid, nothing is imported and the
+    invalid lines are listed.
+    """
+    if request.stream is None:
+        return Response({'error': 'Request body is empty'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        counts = bulk.import_records(request.user, iter(request.stream.readline, b''))
+    except bulk.InvalidImport as e:
+        return Response({'error': str(e), 'lines': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError:
+        # A journal entry for one of the dates was created meanwhile
+        return Response({'error': 'Conflicting changes were made during the import, please try again'},
+                        status=status.HTTP_409_CONFLICT)
+    return Response(counts, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=users_etag)
 def profile_view(request):
-    profile, created = UserProfile.objects.get_or_create(user=request.user)
-    
     if request.method == 'GET':
+        try:
+            # Loaded along with the user (api/couple.py)
+            profile = request.user.profile
+        except UserProfile.DoesNotExist:
+            profile, created = UserProfile.objects.get_or_create(user=request.user)
         serializer = UserProfileSerializer(profile)
         return Response(serializer.data)
     
     elif request.method == 'PUT':
+        # Fresh row, so a cached copy of the profile is never written back
+        profile, created = UserProfile.objects.get_or_create(user=request.user)
         serializer = UserProfileSerializer(profile, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
@@ -519,6 +658,7 @@ def profile_view(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=vapid_key_etag)
 def get_vapid_public_key(request):
     """Get VAPID public key for push subscription"""
     from django.conf import settings
@@ -585,6 +725,7 @@ def delete_push_subscription(request, subscription_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=users_etag)
 def partner_profile_view(request):
     if not request.user.partner:
         return Response({'error': 'No partner connected'}, status=status.HTTP_404_NOT_FOUND)
@@ -608,6 +749,46 @@ def disconnect_partner(request):
     partner.partner = None
     request.user.save()
     partner.save()
+    request.user.couple = Couple(request.user)
     
     return Response({'message': 'Partner disconnected successfully'})
 
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def list_cache_stats(request):
+    """Hit/miss counters of the notes/journal list cache in this process; DELETE resets them"""
+    if request.method == 'DELETE':
+        list_cache.stats.reset()
+    return Response(list_cache.stats.as_dict())
+
+
+# Write-through invalidation of the cached notes/journal lists
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def invalidate_note_lists(sender, instance, **kwargs):
+    list_cache.invalidate_user_id(instance.author_id, [NOTES])
+
+
+@receiver(post_save, sender=NoteLike)
+@receiver(post_delete, sender=NoteLike)
+def invalidate_note_like_lists(sender, instance, **kwargs):
+    list_cache.invalidate_user_id(instance.user_id, [NOTES])
+
+
+@receiver(post_save, sender=JournalEntry)
+@receiver(post_delete, sender=JournalEntry)
+def invalidate_journal_lists(sender, instance, **kwargs):
+    list_cache.invalidate_user_id(instance.author_id, [JOURNAL])
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_profile_etags(sender, instance, **kwargs):
+    list_cache.invalidate_user_id(instance.user_id, [USERS])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_lists(sender, instance, **kwargs):
+    # Lists embed usernames/emails and depend on who the partner is
+    list_cache.invalidate_user(instance)
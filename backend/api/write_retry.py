@@ -0,0 +1,55 @@
+"""
+Retry-with-backoff for writes that run into SQLite's "database is locked"
+
+SQLite allows one writer at a time. A write that can't get the lock
+within OPTIONS['timeout'] (or one that needed to upgrade a read
+transaction another connection has since written past) fails with
+OperationalError("database is locked"). Outside a transaction the whole
+write can simply be run again, so models mixing in RetryOnLockMixin retry
+save() and delete() up to WRITE_RETRY_ATTEMPTS times, sleeping
+WRITE_RETRY_BACKOFF seconds doubled on each attempt (with jitter, so
+retrying writers don't collide again).
+
+Inside transaction.atomic() a failed statement can't be re-run on its own,
+so there the error is raised straight away for the caller (or the
+outermost retry_on_lock()) to deal with.
+"""
+from django.conf import settings
+from django.db import OperationalError, connections, router
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def is_lock_error(error):
+    return isinstance(error, OperationalError) and 'locked' in str(error)
+
+
+def retry_on_lock(alias, func, *args, **kwargs):
+    """func(*args, **kwargs) writing to database alias, run again with backoff while it fails with a lock error"""
+    attempts = getattr(settings, 'WRITE_RETRY_ATTEMPTS', 5)
+    backoff = getattr(settings, 'WRITE_RETRY_BACKOFF', 0.05)
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as e:
+            if not is_lock_error(e) or connections[alias].in_atomic_block or attempt == attempts - 1:
+                raise
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.warning(f'{getattr(func, "__qualname__", func)} hit "{e}", retrying in {delay:.3f}s')
+            time.sleep(delay)
+
+
+class RetryOnLockMixin:
+    """Model mixin running save() and delete() through retry_on_lock()"""
+
+    def _write_alias(self, using):
+        return using or router.db_for_write(type(self), instance=self)
+
+    def save(self, *args, **kwargs):
+        return retry_on_lock(self._write_alias(kwargs.get('using')), super().save, *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return retry_on_lock(self._write_alias(kwargs.get('using')), super().delete, *args, **kwargs)
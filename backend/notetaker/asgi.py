@@ -0,0 +1,20 @@
+"""
+ASGI config for notetaker project.
+
+Serves the same API as wsgi.py, with the hot read endpoints answered by
+async views (api/async_views.py), plus the /api/events/ Server-Sent Events
+stream, which holds a connection open per client. Run it with an ASGI
+server, e.g. `uvicorn notetaker.asgi:application`.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notetaker.settings')
+os.environ.setdefault('ASYNC_READ_VIEWS', 'True')
+
+application = get_asgi_application()
@@ -67,17 +67,72 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'notetaker.wsgi.application'
+ASGI_APPLICATION = 'notetaker.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_PROFILE selects the database: sqlite (default, the db.sqlite3 file)
+# or postgres (POSTGRES_* variables below; needs psycopg, see requirements.txt)
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+# Seconds a connection is kept open across requests (0 = one per request).
+# Off by default under ASGI, where requests don't reuse threads the way
+# persistent connections need; use a pooler there instead.
+DB_CONN_MAX_AGE = int(os.environ.get(
+    'DB_CONN_MAX_AGE', '0' if os.environ.get('ASYNC_READ_VIEWS') == 'True' else '60'
+))
+
+if DATABASE_PROFILE == 'postgres':
+    # POSTGRES_POOLER=pgbouncer when connecting through PgBouncer in
+    # transaction pooling mode, which can't keep server-side cursors open
+    POSTGRES_POOLER = os.environ.get('POSTGRES_POOLER', '')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'notetaker'),
+            'USER': os.environ.get('POSTGRES_USER', 'notetaker'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # Check a reused connection is still alive before the request uses it
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': POSTGRES_POOLER == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # A file rather than in-memory test database, so tests running
+            # several threads get WAL and the lock timeout like the real one
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+    # WAL mode, tuned pragmas and BEGIN IMMEDIATE transactions (api/sqlite_backend).
+    # SQLITE_WAL=False keeps the stock backend and rollback journal, e.g. for a
+    # database on a network filesystem, where WAL's shared memory doesn't work
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', 'True') == 'True'
+    if SQLITE_WAL:
+        DATABASES['default'].update({
+            'ENGINE': 'api.sqlite_backend',
+            'OPTIONS': {
+                'timeout': 20,  # seconds a writer waits for the lock
+                'transaction_mode': 'IMMEDIATE',
+            },
+        })
+
+# Model save()/delete() retried with backoff on "database is locked" (api/write_retry.py)
+WRITE_RETRY_ATTEMPTS = 5
+WRITE_RETRY_BACKOFF = 0.05  # seconds before the first retry, doubled on each one
 
 
 # Password validation
@@ -127,13 +182,88 @@ AUTH_USER_MODEL = 'api.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # simplejwt's JWTAuthentication, loading the user's partner and profile with them
+        'api.authentication.CoupleJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
 
+# Couple context (api/couple.py): cache each authenticated user with their partner and
+# profile across requests for this many seconds (0 = load them once per request)
+COUPLE_CACHE = 'default'
+COUPLE_CACHE_TIMEOUT = int(os.environ.get('COUPLE_CACHE_TIMEOUT', '0'))
+
+# Cursor pagination for the notes/journal lists (opt-in via ?page_size= or ?cursor=)
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', '50'))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', '200'))
+# Characters of HTML-stripped text in ?view=summary previews (api/serializers.py)
+SUMMARY_PREVIEW_LENGTH = 140
+
+# Caches. `lists` holds serialized notes/journal list responses (api/list_cache.py),
+# invalidated on every write. It defaults to a directory shared by all worker
+# processes; LIST_CACHE_BACKEND=locmem is faster but per process, so only use
+# it when a single process serves the API (e.g. runserver).
+LIST_CACHE_ENABLED = os.environ.get('LIST_CACHE_ENABLED', 'True') == 'True'
+LIST_CACHE_BACKEND = os.environ.get('LIST_CACHE_BACKEND', 'file')  # 'file' or 'locmem'
+LIST_CACHE_MAX_ENTRIES = int(os.environ.get('LIST_CACHE_MAX_ENTRIES', '1000'))
+LIST_CACHE_TIMEOUT = int(os.environ.get('LIST_CACHE_TIMEOUT', '300'))  # seconds; a safety net, writes invalidate sooner
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'lists': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lists',
+        'TIMEOUT': LIST_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': LIST_CACHE_MAX_ENTRIES,
+            # Evict one least recently used entry at a time once full
+            'CULL_FREQUENCY': LIST_CACHE_MAX_ENTRIES,
+        },
+    },
+}
+if LIST_CACHE_BACKEND == 'file':
+    CACHES['lists'].update({
+        'BACKEND': 'api.list_cache.LRUFileBasedCache',
+        'LOCATION': os.environ.get('LIST_CACHE_DIR', str(BASE_DIR / '.cache' / 'lists')),
+    })
+# `routes` holds recipients' notification settings and push subscriptions
+# (api/notification_routing.py). It is read by the web processes and by the
+# process_notifications worker, so it is a directory they all share: a profile or
+# subscription change made through the API reaches delivery straight away.
+CACHES['routes'] = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.environ.get('NOTIFICATION_ROUTE_CACHE_DIR', str(BASE_DIR / '.cache' / 'routes')),
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
+# Delta sync (/api/sync/, api/sync.py)
+SYNC_TOKEN_OVERLAP = 5  # seconds re-sent at the start of each sync, for rows committed late
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', '90'))  # older tokens get a full sync
+
+# Bulk export/import (/api/export/, /api/import/, api/bulk.py)
+BULK_EXPORT_CHUNK_SIZE = 500  # rows fetched per query while streaming an export
+BULK_IMPORT_BATCH_SIZE = 500  # rows per bulk_create
+BULK_IMPORT_MAX_RECORDS = int(os.environ.get('BULK_IMPORT_MAX_RECORDS', '20000'))
+
+# Serve GET on the hot read endpoints from async views (api/async_views.py);
+# notetaker/asgi.py turns this on, under WSGI they'd only add overhead
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Real-time event stream (/api/events/, api/events.py; served by notetaker/asgi.py).
+# InProcessBroker only reaches clients connected to the same process.
+EVENT_BROKER = 'api.events.InProcessBroker'
+EVENT_BROKER_OPTIONS = {'history': 50, 'max_queue': 100}
+EVENT_STREAM_KEEPALIVE = 15  # seconds between keep-alive comments
+EVENT_STREAM_MAX_AGE = 300  # seconds before the stream ends and the client reconnects
+
+# Long-poll for list changes (/api/changes/, api/long_poll.py)
+LONG_POLL_TIMEOUT = 25  # longest wait in seconds, below common proxy read timeouts
+LONG_POLL_CHECK_INTERVAL = 2  # seconds between re-reads of the cached list versions, for writes made by other processes
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=7),
@@ -165,6 +295,22 @@ except ImportError:
     VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
     VAPID_CLAIM_EMAIL = os.environ.get('VAPID_CLAIM_EMAIL', 'mailto:admin@lovenotes.com')
 
+# Notification outbox: API requests only queue notifications, the
+# process_notifications command delivers them (see CRON_SETUP.md).
+# Set NOTIFICATION_QUEUE_EAGER=True to deliver right away from a background thread of the web process instead (local development).
+NOTIFICATION_QUEUE_EAGER = os.environ.get('NOTIFICATION_QUEUE_EAGER', 'False') == 'True'
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', '5'))
+NOTIFICATION_RETRY_BACKOFF = int(os.environ.get('NOTIFICATION_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+NOTIFICATION_CLAIM_LEASE = 300  # seconds before a claimed-but-unfinished notification is retried
+# Opt-in: notifications wait this long before delivery, and more of the same type from the
+# same sender in the meantime are merged into one push ("❤️ alex liked 12 notes"), e.g. 60.
+# 0 (the default) delivers straight away.
+NOTIFICATION_COALESCE_WINDOW = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW', '0'))  # seconds
+# Recipients' notification settings and push subscriptions (api/notification_routing.py).
+# Must be shared by the web processes and the worker (see CACHES['routes']).
+NOTIFICATION_ROUTE_CACHE = 'routes'
+NOTIFICATION_ROUTE_CACHE_TIMEOUT = 300  # seconds
+
 # Debug: Check if keys are loaded (remove in production)
 if not VAPID_PUBLIC_KEY and DEBUG:
     import os
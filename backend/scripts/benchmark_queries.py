@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Benchmark the list endpoints' queries against seeded data
+Usage: python scripts/benchmark_queries.py --couples 20 --notes 1000 --days 730
+
+Seeds couples with notes, likes, journal entries and push subscriptions,
+then prints EXPLAIN QUERY PLAN and average timings for each endpoint's
+query, first with the access-pattern indexes and then without them. The
+list endpoints are measured both as they run now (per-author UNION ALL,
+see api/querysets.py) and as the single OR filter they used to be.
+Everything runs inside a transaction that is rolled back, so the database
+is left untouched (the indexes are dropped only inside that transaction).
+"""
+import django_setup  # noqa: F401
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from api.models import User, Note, NoteLike, JournalEntry, PushSubscription, UserProfile
+from api.querysets import visible_to
+from api.likes import reconcile_like_counts
+from api.views import get_note_queryset, get_visible_notes, get_visible_journal_entries
+import random
+import sys
+import time
+
+# Indexes added for the list endpoints (api/migrations/0013_access_pattern_indexes.py)
+ACCESS_PATTERN_INDEXES = [
+    'note_author_updated_idx',
+    'pushsub_user_created_idx',
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Seed realistic data and report query plans and timings for the list endpoints, with and without indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--couples', type=int, default=20)
+        parser.add_argument('--notes', type=int, default=1000, help='Notes per couple')
+        parser.add_argument('--days', type=int, default=730, help='Days of journal entries per couple')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN output is SQLite-specific')
+        self.options = options
+        try:
+            with transaction.atomic():
+                user, partner = self.seed()
+                with_indexes = self.run_queries(user, partner, 'with indexes')
+                with connection.cursor() as cursor:
+                    for name in ACCESS_PATTERN_INDEXES:
+                        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+                    cursor.execute('ANALYZE')
+                without_indexes = self.run_queries(user, partner, 'without indexes')
+                self.summary(without_indexes, with_indexes)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def seed(self):
+        options = self.options
+        self.stdout.write(
+            f"Seeding {options['couples']} couples with {options['notes']} notes and "
+            f"{options['days']} days of journal entries each..."
+        )
+        start = time.perf_counter()
+        now = timezone.now()
+        today = date.today()
+        rng = random.Random(42)
+        couples = []
+        for index in range(options['couples']):
+            a = User.objects.create(username=f'bench-{index}-a', email=f'bench-{index}-a@example.com')
+            b = User.objects.create(username=f'bench-{index}-b', email=f'bench-{index}-b@example.com', partner=a)
+            a.partner = b
+            a.save(update_fields=['partner'])
+            couples.append((a, b))
+
+        for a, b in couples:
+            UserProfile.objects.bulk_create([UserProfile(user=a), UserProfile(user=b)])
+            PushSubscription.objects.bulk_create([
+                PushSubscription(user=user, endpoint=f'https://fcm.googleapis.com/fcm/send/{user.id}-{device}', p256dh='k', auth='a')
+                for user in (a, b) for device in range(3)
+            ])
+            notes = Note.objects.bulk_create([
+                Note(
+                    title=f'Note {i}', content='<p>' + 'Love you lots. ' * 40 + '</p>',
+                    author=a if i % 2 else b, is_shared=rng.random() < 0.9,
+                ) for i in range(options['notes'])
+            ], batch_size=500)
+            # bulk_create sets auto_now fields to now; spread them out so ordering is realistic
+            for note in notes:
+                note.updated_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 2))
+            Note.objects.bulk_update(notes, ['updated_at'], batch_size=500)
+            NoteLike.objects.bulk_create([
+                NoteLike(note=note, user=user)
+                for note in notes for user in (a, b) if rng.random() < 0.3
+            ], batch_size=500)
+            # bulk_create skips the receivers that keep Note.like_count
+            reconcile_like_counts()
+            JournalEntry.objects.bulk_create([
+                JournalEntry(
+                    title='', content='<p>' + 'Today was lovely. ' * 30 + '</p>',
+                    author=user, date=today - timedelta(days=day), is_shared=rng.random() < 0.9,
+                ) for day in range(options['days']) for user in (a, b)
+            ], batch_size=500)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f'Seeded in {time.perf_counter() - start:.1f}s\n')
+        return couples[len(couples) // 2]
+
+    def queries(self, user, partner):
+        page_size = self.options['page_size']
+        note_ordering = ('-updated_at', '-id')
+        entry_ordering = ('-date', '-created_at', '-id')
+        notes = visible_to(get_note_queryset(user), user)
+        or_notes = get_visible_notes(user)
+        page_ids = [note.id for note in notes.order_by(*note_ordering)[:page_size]]
+        entries = visible_to(JournalEntry.objects.all(), user)
+        or_entries = get_visible_journal_entries(user)
+        some_date = or_entries.values_list('date', flat=True)[10]
+        return [
+            ('notes list (all)', notes.combined()),
+            ('notes list (first page)', notes.order_by(*note_ordering)[:page_size]),
+            ('notes list (all, OR filter)', or_notes),
+            ('notes list (page, OR filter)', or_notes.order_by(*note_ordering)[:page_size]),
+            ('likes for a page of notes', NoteLike.objects.filter(note_id__in=page_ids)),
+            ('journal list (all)', entries.combined()),
+            ('journal list (first page)', entries.order_by(*entry_ordering)[:page_size]),
+            ('journal list (all, OR filter)', or_entries),
+            ('journal list (page, OR filter)', or_entries.order_by(*entry_ordering)[:page_size]),
+            ('journal by date', or_entries.filter(date=some_date)),
+            ('push subscriptions', PushSubscription.objects.filter(user=partner)),
+        ]
+
+    def run_queries(self, user, partner, label):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'=== {label} ==='))
+        results = {}
+        for name, queryset in self.queries(user, partner):
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                start = time.perf_counter()
+                for _ in range(self.options['repeat']):
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                elapsed = (time.perf_counter() - start) / self.options['repeat'] * 1000
+            temp_sort = any('TEMP B-TREE' in step for step in plan)
+            results[name] = (elapsed, temp_sort)
+            self.stdout.write(f'{name}: {elapsed:.2f} ms' + (' (temp B-tree sort)' if temp_sort else ''))
+            for step in plan:
+                self.stdout.write(f'    {step}')
+        self.stdout.write('')
+        return results
+
+    def summary(self, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING('=== summary (without -> with indexes) ==='))
+        for name, (before_ms, before_sort) in before.items():
+            after_ms, after_sort = after[name]
+            sort_note = ''
+            if before_sort or after_sort:
+                sort_note = f"  temp sort: {'yes' if before_sort else 'no'} -> {'yes' if after_sort else 'no'}"
+            self.stdout.write(f'{name:<32} {before_ms:8.2f} ms -> {after_ms:8.2f} ms{sort_note}')
+
+
+if __name__ == '__main__':
+    Command().run_from_argv([sys.argv[0], 'benchmark_queries', *sys.argv[1:]])
@@ -0,0 +1,16 @@
+"""
+Set up Django for the scripts in this directory
+
+Import it before anything from Django or the api app:
+    import django_setup  # noqa: F401
+The scripts are run from anywhere as python scripts/<name>.py and use the
+same settings (and DATABASE_PROFILE etc. environment) as manage.py.
+"""
+import os
+import sys
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'notetaker.settings')
+django.setup()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Compare read throughput under WSGI and ASGI
+Usage: python scripts/load_test.py --workers 4 --concurrency 32 --requests 400
+
+Seeds a temporary couple, then for each mode starts a fresh process that
+drives Django's own handler in-process (no server needed):
+- wsgi: WSGIHandler called from --workers threads, like a threaded WSGI
+  server with that many workers
+- asgi: ASGIHandler on one event loop with --concurrency requests in
+  flight, like a single ASGI worker (ASYNC_READ_VIEWS on, as in asgi.py)
+
+and reports requests per second and latency per endpoint. With --url the
+same requests go to a running server instead (e.g. gunicorn vs uvicorn
+started with the same worker count). The temporary users are deleted
+afterwards.
+"""
+import django_setup  # noqa: F401
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.likes import reconcile_like_counts
+from api.models import User, Note, NoteLike, JournalEntry
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_PATHS = [
+    '/api/notes/',
+    '/api/notes/?page_size=50',
+    '/api/journal/',
+    '/api/journal/by-date/?date={today}',
+    '/api/auth/me/',
+]
+
+
+def _summary(label, path, latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        'mode': label,
+        'path': path,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Load-test the read endpoints in-process under WSGI and ASGI (or against --url)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='WSGI worker threads')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint')
+        parser.add_argument('--notes', type=int, default=300, help='Notes seeded for the test couple')
+        parser.add_argument('--path', action='append', dest='paths', help='Endpoint to test (repeatable)')
+        parser.add_argument('--no-cache', action='store_true', help='Disable the list response cache')
+        parser.add_argument('--url', help='Base URL of a running server to test instead of in-process handlers')
+        # Internal: run one mode in this process
+        parser.add_argument('--child', choices=['wsgi', 'asgi'], help='(internal)')
+        parser.add_argument('--token', help='(internal)')
+
+    def handle(self, *args, **options):
+        today = date.today()
+        paths = [path.format(today=today) for path in (options['paths'] or DEFAULT_PATHS)]
+        if options['child']:
+            run = self.run_wsgi if options['child'] == 'wsgi' else self.run_asgi
+            results = [run(path, options) for path in paths]
+            self.stdout.write(json.dumps(results))
+            return
+
+        user = self.seed(options['notes'], today)
+        token = str(RefreshToken.for_user(user).access_token)
+        try:
+            if options['url']:
+                results = [self.run_url(path, token, options) for path in paths]
+            else:
+                results = []
+                for mode in ('wsgi', 'asgi'):
+                    results.extend(self.run_child(mode, paths, token, options))
+        finally:
+            User.objects.filter(username__startswith='loadtest-').delete()
+        self.report(results, options)
+
+    def seed(self, notes, today):
+        User.objects.filter(username__startswith='loadtest-').delete()
+        a = User.objects.create(username='loadtest-a', email='loadtest-a@example.com')
+        b = User.objects.create(username='loadtest-b', email='loadtest-b@example.com', partner=a)
+        a.partner = b
+        a.save(update_fields=['partner'])
+        created = Note.objects.bulk_create([
+            Note(title=f'Note {i}', content='<p>' + 'Love you lots. ' * 20 + '</p>', author=a if i % 2 else b)
+            for i in range(notes)
+        ])
+        NoteLike.objects.bulk_create([NoteLike(note=note, user=a) for note in created[::3]])
+        # bulk_create skips the receivers that keep Note.like_count
+        reconcile_like_counts()
+        JournalEntry.objects.bulk_create([
+            JournalEntry(content='<p>Lovely day.</p>', author=user, date=today - timedelta(days=day))
+            for day in range(60) for user in (a, b)
+        ])
+        return a
+
+    def run_child(self, mode, paths, token, options):
+        self.stderr.write(f'Running {mode}...')
+        env = dict(os.environ, ASYNC_READ_VIEWS='True' if mode == 'asgi' else 'False')
+        if options['no_cache']:
+            env['LIST_CACHE_ENABLED'] = 'False'
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', mode, '--token', token,
+            '--workers', str(options['workers']), '--concurrency', str(options['concurrency']),
+            '--requests', str(options['requests']),
+        ]
+        for path in paths:
+            command += ['--path', path]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'{mode} run failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _host(self):
+        host = next((host for host in settings.ALLOWED_HOSTS if host and '*' not in host), 'localhost')
+        return host.lstrip('.')
+
+    def run_wsgi(self, path, options):
+        from django.core.handlers.wsgi import WSGIHandler
+        handler = WSGIHandler()
+        url = urlsplit(path)
+        host = self._host()
+        errors = []
+
+        def request():
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query,
+                'SERVER_NAME': host, 'SERVER_PORT': '80', 'HTTP_HOST': host,
+                'HTTP_AUTHORIZATION': f"Bearer {options['token']}", 'HTTP_ACCEPT': 'application/json',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            statuses = []
+            start = time.perf_counter()
+            body = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            b''.join(body)
+            body.close()
+            if not statuses[0].startswith('200'):
+                errors.append(statuses[0])
+            return time.perf_counter() - start
+
+        request()  # warm up
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            latencies = list(executor.map(lambda _: request(), range(options['requests'])))
+        return _summary('wsgi', path, latencies, time.perf_counter() - start, len(errors))
+
+    def run_asgi(self, path, options):
+        from django.core.handlers.asgi import ASGIHandler
+        handler = ASGIHandler()
+        url = urlsplit(path)
+        host = self._host()
+        errors = []
+
+        async def request():
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': url.path, 'raw_path': url.path.encode(),
+                'query_string': url.query.encode(), 'root_path': '',
+                'headers': [
+                    (b'host', host.encode()),
+                    (b'authorization', f"Bearer {options['token']}".encode()),
+                    (b'accept', b'application/json'),
+                ],
+                'client': ('127.0.0.1', 50000), 'server': (host, 80),
+            }
+            received = asyncio.Event()
+            statuses = []
+
+            async def receive():
+                if received.is_set():
+                    # Nothing more to send; wait until the handler gives up on us
+                    await asyncio.Event().wait()
+                received.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            start = time.perf_counter()
+            await handler(scope, receive, send)
+            if statuses[0] != 200:
+                errors.append(statuses[0])
+            return time.perf_counter() - start
+
+        async def main():
+            await request()  # warm up
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def limited():
+                async with semaphore:
+                    return await request()
+            start = time.perf_counter()
+            latencies = await asyncio.gather(*(limited() for _ in range(options['requests'])))
+            return latencies, time.perf_counter() - start
+
+        latencies, elapsed = asyncio.run(main())
+        return _summary('asgi', path, latencies, elapsed, len(errors))
+
+    def run_url(self, path, token, options):
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=options['concurrency'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        url = options['url'].rstrip('/') + path
+        headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+        errors = []
+
+        def request(_):
+            start = time.perf_counter()
+            response = session.get(url, headers=headers)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            latencies = list(executor.map(request, range(options['requests'])))
+        return _summary(options['url'], path, latencies, time.perf_counter() - start, len(errors))
+
+    def report(self, results, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{options['requests']} requests per endpoint, {options['concurrency']} in flight, "
+            f"{options['workers']} WSGI worker threads"
+        ))
+        self.stdout.write(f"{'mode':<6} {'endpoint':<40} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<6} {result['path']:<40} {result['rps']:8.1f} "
+                f"{result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['errors']:>7}"
+            )
+
+
+if __name__ == '__main__':
+    Command().run_from_argv([sys.argv[0], 'load_test', *sys.argv[1:]])
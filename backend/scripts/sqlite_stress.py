@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Stress concurrent writes against the SQLite database
+Usage: python scripts/sqlite_stress.py --threads 8 --ops 200
+
+Seeds a temporary couple, then runs the same mixed workload once per mode,
+each in a fresh process so it gets its own connections and settings:
+- rollback: the stock sqlite3 backend with the rollback journal and no
+  write retries (SQLITE_WAL=False), i.e. the setup before WAL
+- wal: api.sqlite_backend (WAL, tuned pragmas, BEGIN IMMEDIATE) with
+  save()/delete() retried on lock errors (api/write_retry.py)
+
+Every thread loops over the operations the app runs concurrently: toggling
+a like (api.likes.toggle_like, as toggle_note_like does), saving a journal
+entry (update_or_create), adding and pruning a push subscription (as
+delivery does on a 410) and reading a page of notes. The report shows, per
+mode and operation, how many calls failed with "database is locked" and
+p50/p99 latency. The temporary users are deleted afterwards.
+"""
+import django_setup  # noqa: F401
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from api.likes import toggle_like
+from api.models import User, Note, JournalEntry, PushSubscription
+from api.write_retry import is_lock_error
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+MODES = {
+    'rollback': {'SQLITE_WAL': 'False'},
+    'wal': {'SQLITE_WAL': 'True'},
+}
+OPERATIONS = ('like', 'journal', 'push_prune', 'read')
+
+
+def _percentile(latencies, fraction):
+    return latencies[max(0, int(len(latencies) * fraction) - 1)] * 1000 if latencies else 0
+
+
+class Command(BaseCommand):
+    help = 'Stress concurrent writes on SQLite: lock errors and p99 latency, rollback journal vs WAL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writer threads')
+        parser.add_argument('--ops', type=int, default=200, help='Operations per thread')
+        parser.add_argument('--mode', action='append', dest='modes', choices=list(MODES), help='Mode to run (repeatable)')
+        # Internal: run one mode in this process
+        parser.add_argument('--child', choices=list(MODES), help='(internal)')
+        parser.add_argument('--users', help='(internal)')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self.run(options)))
+            return
+
+        if connection.vendor != 'sqlite':
+            raise CommandError('sqlite_stress needs the SQLite database')
+        users = self.seed()
+        try:
+            # Children need the database to themselves to switch journal modes
+            connection.close()
+            results = {mode: self.run_child(mode, users, options) for mode in (options['modes'] or MODES)}
+        finally:
+            User.objects.filter(username__startswith='stress-').delete()
+        self.report(results, options)
+
+    def seed(self):
+        User.objects.filter(username__startswith='stress-').delete()
+        a = User.objects.create(username='stress-a', email='stress-a@example.com')
+        b = User.objects.create(username='stress-b', email='stress-b@example.com', partner=a)
+        a.partner = b
+        a.save(update_fields=['partner'])
+        Note.objects.bulk_create([
+            Note(title=f'Note {i}', content='<p>Thinking of you.</p>', author=a if i % 2 else b)
+            for i in range(50)
+        ])
+        return f'{a.pk},{b.pk}'
+
+    def run_child(self, mode, users, options):
+        self.stderr.write(f'Running {mode}...')
+        env = dict(os.environ, **MODES[mode])
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', mode, '--users', users,
+            '--threads', str(options['threads']), '--ops', str(options['ops']),
+        ]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f'{mode} run failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def run(self, options):
+        if options['child'] == 'rollback':
+            settings.WRITE_RETRY_ATTEMPTS = 1
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode = DELETE')
+            connection.close()
+
+        from api.views import get_note_queryset
+        from api.querysets import visible_to
+        users = list(User.objects.filter(pk__in=options['users'].split(',')))
+        note_ids = list(Note.objects.filter(author__in=users).values_list('pk', flat=True))
+        connection.close()
+        today = date.today()
+
+        def like(user):
+            toggle_like(Note(pk=random.choice(note_ids)), user)
+
+        def journal(user):
+            JournalEntry.objects.update_or_create(
+                author=user, date=today - timedelta(days=random.randrange(30)),
+                defaults={'content': f'<p>Entry {uuid.uuid4().hex}</p>', 'mood': random.choice(['happy', 'calm'])},
+            )
+
+        def push_prune(user):
+            subscription = PushSubscription.objects.create(
+                user=user, endpoint=f'https://push.example.com/{uuid.uuid4().hex}', p256dh='key', auth='auth'
+            )
+            subscription.delete()
+
+        def read(user):
+            list(visible_to(get_note_queryset(user), user)[:50])
+
+        operations = {'like': like, 'journal': journal, 'push_prune': push_prune, 'read': read}
+
+        def worker(index):
+            rng = random.Random(index)
+            user = users[index % len(users)]
+            results = []
+            try:
+                for _ in range(options['ops']):
+                    name = rng.choice(OPERATIONS)
+                    start = time.perf_counter()
+                    outcome = 'ok'
+                    try:
+                        operations[name](user)
+                    except OperationalError as e:
+                        outcome = 'locked' if is_lock_error(e) else 'error'
+                    results.append((name, time.perf_counter() - start, outcome))
+            finally:
+                connection.close()
+            return results
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            samples = [sample for results in executor.map(worker, range(options['threads'])) for sample in results]
+        elapsed = time.perf_counter() - start
+
+        summary = {'elapsed': elapsed}
+        for name in OPERATIONS + ('all',):
+            rows = [sample for sample in samples if name in ('all', sample[0])]
+            latencies = sorted(latency for _, latency, _ in rows)
+            summary[name] = {
+                'ops': len(rows),
+                'locked': sum(1 for *_, outcome in rows if outcome == 'locked'),
+                'errors': sum(1 for *_, outcome in rows if outcome == 'error'),
+                'p50_ms': _percentile(latencies, 0.5),
+                'p99_ms': _percentile(latencies, 0.99),
+            }
+        return summary
+
+    def report(self, results, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{options['threads']} threads x {options['ops']} operations"
+        ))
+        self.stdout.write(f"{'mode':<9} {'operation':<11} {'ops':>6} {'locked':>7} {'errors':>7} {'p50 ms':>8} {'p99 ms':>9}")
+        for mode, summary in results.items():
+            for name in OPERATIONS + ('all',):
+                row = summary[name]
+                self.stdout.write(
+                    f"{mode:<9} {name:<11} {row['ops']:>6} {row['locked']:>7} {row['errors']:>7} "
+                    f"{row['p50_ms']:8.1f} {row['p99_ms']:9.1f}"
+                )
+            self.stdout.write(f"{mode:<9} {'ops/s':<11} {summary['all']['ops'] / summary['elapsed']:>6.0f}")
+
+
+
+if __name__ == '__main__':
+    Command().run_from_argv([sys.argv[0], 'sqlite_stress', *sys.argv[1:]])